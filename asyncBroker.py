@@ -0,0 +1,166 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+
+_logger = logging.getLogger()
+
+
+class AsyncOttoBroker():
+    # psycopg2 and urllib are blocking, so their calls are run on a bounded thread pool and awaited.
+    # independent pieces of a request are gathered so they overlap instead of queuing behind each other
+    def __init__(self, broker, max_workers=32):
+        self._broker = broker
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='broker-io')
+
+        # long-polls wait on futures resolved from the event loop rather than parking an executor thread each
+        self._alert_loop = None
+        self._alert_waiters = set()
+
+    @property
+    def broker(self):
+        return self._broker
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _on_alerts(self):
+        # runs on whichever thread published the alerts
+        loop = self._alert_loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wake_alert_waiters)
+
+    def _wake_alert_waiters(self):
+        waiters, self._alert_waiters = self._alert_waiters, set()
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def get_watch_alerts(self, since, user_id=None, timeout=None):
+        if not isinstance(since, int):
+            return self._broker.return_failure('since must be an int', do_log=False)
+
+        engine = self._broker._watch_alerts
+        loop = asyncio.get_running_loop()
+        if self._alert_loop is None:
+            engine.add_listener(self._on_alerts)
+        self._alert_loop = loop
+
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            alerts, cursor = engine.wait_for_alerts(since, user_id=user_id, timeout=0)
+            remaining = None if deadline is None else deadline - loop.time()
+            if alerts or (remaining is not None and remaining <= 0):
+                break
+            # registered before yielding, so an alert published after the check above still wakes this waiter
+            waiter = loop.create_future()
+            self._alert_waiters.add(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._alert_waiters.discard(waiter)
+
+        return {
+            self._broker.STATUS_KEY: self._broker.STATUS_SUCCESS,
+            'alerts': alerts,
+            'cursor': cursor
+        }
+
+    async def _get_user(self, user_id, shallow=False):
+        cache = self._broker._user_cache
+        backend = self._broker._backend_name()
+        user = cache.get(backend, user_id, shallow)
+        if user is not None:
+            return user
+
+        generation = cache.generation(backend, user_id)
+        user = await self._load_user(user_id, shallow)
+        if user is not None:
+            cache.put(backend, user_id, shallow, user, generation)
+        return user
+
+    async def _load_user(self, user_id, shallow=False):
+        db = self._broker._cur_db
+        if shallow:
+            return await self.run(db.broker_get_single_user, user_id)
+
+        user, longs, historical_longs, shorts, historical_shorts, watch_list = await asyncio.gather(
+            self.run(db.broker_get_single_user, user_id),
+            self.run(db.broker_get_longs_by_user, user_id),
+            self.run(db.broker_get_historical_longs_by_user, user_id),
+            self.run(db.broker_get_shorts_by_user, user_id),
+            self.run(db.broker_get_historical_shorts_by_user, user_id),
+            self.run(db.broker_get_watches, user_id)
+        )
+        if user is None:
+            return None
+
+        self._broker._attach_positions(user, longs, historical_longs, shorts, historical_shorts, watch_list)
+        return user
+
+    async def get_stock_value(self, symbol_list):
+        return await self.run(self._broker.get_stock_value, symbol_list)
+
+    async def get_user_info(self, user_id, shallow, detail=None):
+        if detail is not None and detail != self._broker.DETAIL_FULL:
+            # summaries are a single aggregate query, so there is nothing to overlap
+            return await self.run(self._broker.get_user_info, user_id, shallow, detail)
+        if not isinstance(shallow, bool):
+            return self._broker.return_failure('shallow must be either \'True\' or \'False\'', do_log=False)
+
+        user = await self._get_user(user_id, shallow)
+        if not user:
+            return self._broker.return_failure('Invalid user_id: {}'.format(user_id), do_log=False)
+
+        return {
+            self._broker.STATUS_KEY: self._broker.STATUS_SUCCESS,
+            'user': await self.run(self._broker._get_full_user_dict, user, shallow=shallow)
+        }
+
+    async def get_all_users(self, shallow, detail=None):
+        if detail is not None and detail != self._broker.DETAIL_FULL:
+            return await self.run(self._broker.get_all_users, shallow, detail)
+        if not isinstance(shallow, bool):
+            return self._broker.return_failure('shallow must be either \'True\' or \'False\'', do_log=False)
+
+        user_ids = await self.run(self._broker._cur_db.broker_get_all_user_ids)
+        users = await asyncio.gather(*[self._get_user(user_id, shallow) for user_id in user_ids])
+        user_list = await asyncio.gather(*[self.run(self._broker._get_full_user_dict, user) for user in users if user])
+
+        return {
+            self._broker.STATUS_KEY: self._broker.STATUS_SUCCESS,
+            'user_list': list(user_list)
+        }
+
+    async def _trade(self, trade_func, symbol, quantity, user_id, api_key):
+        # the quote does not depend on the user, so fetch both at the same time
+        user, stock_val = await asyncio.gather(
+            self._get_user(user_id),
+            self.get_stock_value([symbol])
+        )
+        return await self.run(trade_func, symbol, quantity, user_id, api_key, user=user, stock_val=stock_val)
+
+    async def buy_long(self, symbol, quantity, user_id, api_key):
+        return await self._trade(self._broker.buy_long, symbol, quantity, user_id, api_key)
+
+    async def sell_long(self, symbol, quantity, user_id, api_key):
+        return await self._trade(self._broker.sell_long, symbol, quantity, user_id, api_key)
+
+    async def buy_short(self, symbol, quantity, user_id, api_key):
+        return await self._trade(self._broker.buy_short, symbol, quantity, user_id, api_key)
+
+    async def sell_short(self, symbol, quantity, user_id, api_key):
+        return await self._trade(self._broker.sell_short, symbol, quantity, user_id, api_key)
+
+    async def set_watch(self, user_id, symbol, api_key):
+        user, stock_val = await asyncio.gather(
+            self._get_user(user_id),
+            self.get_stock_value([symbol])
+        )
+        return await self.run(self._broker.set_watch, user_id, symbol, api_key, user=user, stock_val=stock_val)
@@ -0,0 +1,344 @@
+from aiohttp import web
+
+import argparse
+import configparser
+import logging
+import json
+from decimal import Decimal
+
+from broker import OttoBroker
+from asyncBroker import AsyncOttoBroker
+from jsonEncoder import CustomJSONEncoder
+from serverCommon import (SYMBOLS_KEY, SYMBOL_KEY, USERID_KEY, APIKEY_KEY, DISPLAYNAME_KEY, AMOUNT_KEY, REASON_KEY,
+                          QUANTITY_KEY, ENTRIES_KEY, VALUATE_KEY, SHALLOW_KEY, DETAIL_KEY, SINCE_KEY, JOB_KEY, ACTION_KEY,
+                          ORDER_TYPE_KEY, PRICE_KEY, ID_KEY, PROFILE_HEADER, UNPROFILED_PATHS, TIMEOUT_KEY,
+                          IF_NONE_MATCH_HEADER, GZIP_MIN_BYTES,
+                          MAX_BULK_ENTRIES, MAX_POLL_TIMEOUT, DEFAULT_POLL_TIMEOUT, MISSING_PARAM_MSG, INVALID_TYPE_MSG,
+                          STR_TRUE, STR_FALSE, configure_logging, etag_matches, build_broker)
+
+_logger = logging.getLogger()
+
+
+def jsonify(obj):
+    return web.Response(text=json.dumps(obj, cls=CustomJSONEncoder), content_type='application/json')
+
+
+async def conditional_jsonify(request, etag, build):
+    if etag_matches(request.headers.get(IF_NONE_MATCH_HEADER), etag):
+        response = web.Response(status=304)
+    else:
+        result = await build()
+        response = jsonify(result)
+        if result.get(OttoBroker.STATUS_KEY) != OttoBroker.STATUS_SUCCESS:
+            return response
+    if etag is not None:
+        response.headers['ETag'] = 'W/"{}"'.format(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@web.middleware
+async def compress_response(request, handler):
+    response = await handler(request)
+    if isinstance(response, web.Response) and response.status == 200 and response.body is not None:
+        response.headers.add('Vary', 'Accept-Encoding')
+        # aiohttp picks the coding from Accept-Encoding and leaves the body alone if the client sent none
+        if len(response.body) >= GZIP_MIN_BYTES:
+            response.enable_compression()
+    return response
+
+
+def profile_requests(broker):
+    # cProfile follows the event loop thread, so coroutines of other requests that run while this one awaits are
+    # in the profile too, and the executor threads doing the blocking work are not
+    @web.middleware
+    async def profile_request(request, handler):
+        profile = None
+        if request.path not in UNPROFILED_PATHS:
+            profile = broker.start_profile(request.headers.get(PROFILE_HEADER))
+        try:
+            return await handler(request)
+        finally:
+            if profile is not None:
+                args = {k: v for k, v in request.query.items() if k != APIKEY_KEY}
+                broker.finish_profile(profile, request.path, args)
+    return profile_request
+
+
+def missing_param(args, *keys):
+    for key in keys:
+        if key not in args:
+            return OttoBroker.return_failure(MISSING_PARAM_MSG.format(param=key))
+    return None
+
+
+def parse_shallow(args):
+    if SHALLOW_KEY not in args:
+        return False
+    shallow = args[SHALLOW_KEY]
+    if shallow.lower() == STR_TRUE.lower():
+        return True
+    elif shallow.lower() == STR_FALSE.lower():
+        return False
+    return shallow
+
+
+def create_app(abroker):
+    broker = abroker.broker
+    routes = web.RouteTableDef()
+
+    @routes.get('/broker/hello')
+    async def flask_test(request):
+        return web.Response(text="I am OttoBroker yes hello")
+
+    @routes.get('/broker/stock_info')
+    async def get_stock_info(request):
+        failure = missing_param(request.query, SYMBOLS_KEY)
+        if failure:
+            return jsonify(failure)
+        symbols = [s.upper() for s in request.query[SYMBOLS_KEY].split(',')]
+        return await conditional_jsonify(request, broker.get_stock_value_etag(symbols), lambda: abroker.get_stock_value(symbols))
+
+    @routes.get('/broker/ready')
+    async def ready(request):
+        readiness = broker.get_readiness()
+        response = jsonify(readiness)
+        if not readiness['ready']:
+            response.set_status(503)
+        return response
+
+    @routes.get('/broker/quote_stats')
+    async def quote_stats(request):
+        return jsonify(broker.get_quote_stats())
+
+    @routes.get('/broker/db_stats')
+    async def db_stats(request):
+        return jsonify(broker.get_db_stats())
+
+    @routes.get('/broker/toggle_test_mode')
+    async def toggle_test(request):
+        failure = missing_param(request.query, APIKEY_KEY)
+        if failure:
+            return jsonify(failure)
+        return jsonify(await abroker.run(broker.toggle_test_mode, request.query[APIKEY_KEY]))
+
+    @routes.get('/broker/test_mode')
+    async def view_test(request):
+        return jsonify({
+            broker.STATUS_KEY: broker.STATUS_SUCCESS,
+            'test_mode': broker._test_mode
+        })
+
+    @routes.get('/broker/user_info')
+    async def get_user_info(request):
+        failure = missing_param(request.query, USERID_KEY)
+        if failure:
+            return jsonify(failure)
+        shallow = parse_shallow(request.query)
+        detail = request.query.get(DETAIL_KEY, broker.DETAIL_FULL).lower()
+        etag = await abroker.run(broker.get_user_info_etag, request.query[USERID_KEY], shallow, detail)
+        return await conditional_jsonify(request, etag, lambda: abroker.get_user_info(request.query[USERID_KEY], shallow, detail))
+
+    @routes.get('/broker/all_users')
+    async def get_all_users(request):
+        shallow = parse_shallow(request.query)
+        detail = request.query.get(DETAIL_KEY, broker.DETAIL_FULL).lower()
+        etag = await abroker.run(broker.get_all_users_etag, shallow, detail)
+        return await conditional_jsonify(request, etag, lambda: abroker.get_all_users(shallow, detail))
+
+    @routes.get('/broker/register')
+    async def register_user(request):
+        failure = missing_param(request.query, APIKEY_KEY, USERID_KEY, DISPLAYNAME_KEY)
+        if failure:
+            return jsonify(failure)
+        return jsonify(await abroker.run(broker.register_user, request.query[USERID_KEY],
+                                         request.query[DISPLAYNAME_KEY], request.query[APIKEY_KEY]))
+
+    async def capital(request, capital_func):
+        failure = missing_param(request.query, APIKEY_KEY, USERID_KEY, AMOUNT_KEY)
+        if failure:
+            return jsonify(failure)
+        try:
+            amount = Decimal(request.query[AMOUNT_KEY])
+        except Exception:
+            return jsonify(broker.return_failure(INVALID_TYPE_MSG.format(param=AMOUNT_KEY, type='Decimal')))
+        failure = missing_param(request.query, REASON_KEY)
+        if failure:
+            return jsonify(failure)
+        return jsonify(await abroker.run(capital_func, request.query[USERID_KEY], amount,
+                                         request.query[REASON_KEY], request.query[APIKEY_KEY]))
+
+    @routes.get('/broker/deposit')
+    async def deposit(request):
+        return await capital(request, broker.deposit)
+
+    @routes.get('/broker/withdraw')
+    async def withdraw(request):
+        return await capital(request, broker.withdraw)
+
+    @routes.post('/broker/bulk_capital')
+    async def bulk_capital(request):
+        try:
+            body = json.loads(await request.text(), parse_float=Decimal)
+        except Exception:
+            return jsonify(broker.return_failure('request body must be JSON', do_log=False))
+        if not isinstance(body, dict):
+            return jsonify(broker.return_failure('request body must be a JSON object', do_log=False))
+
+        failure = missing_param(body, APIKEY_KEY, ENTRIES_KEY)
+        if failure:
+            return jsonify(failure)
+        if isinstance(body[ENTRIES_KEY], list) and len(body[ENTRIES_KEY]) > MAX_BULK_ENTRIES:
+            return jsonify(broker.return_failure('at most {} entries per call'.format(MAX_BULK_ENTRIES), do_log=False))
+
+        valuate = body.get(VALUATE_KEY, False)
+        if not isinstance(valuate, bool):
+            return jsonify(broker.return_failure(INVALID_TYPE_MSG.format(param=VALUATE_KEY, type='bool')))
+
+        return jsonify(await abroker.run(broker.bulk_capital, body[ENTRIES_KEY], body[APIKEY_KEY], valuate))
+
+    async def trade(request, trade_func):
+        failure = missing_param(request.query, APIKEY_KEY, USERID_KEY, SYMBOL_KEY, QUANTITY_KEY)
+        if failure:
+            return jsonify(failure)
+        try:
+            quantity = int(request.query[QUANTITY_KEY])
+        except Exception:
+            return jsonify(broker.return_failure(INVALID_TYPE_MSG.format(param=QUANTITY_KEY, type='int')))
+        return jsonify(await trade_func(request.query[SYMBOL_KEY].upper(), quantity,
+                                        request.query[USERID_KEY], request.query[APIKEY_KEY]))
+
+    @routes.get('/broker/buy_long')
+    async def buy_long(request):
+        return await trade(request, abroker.buy_long)
+
+    @routes.get('/broker/sell_long')
+    async def sell_long(request):
+        return await trade(request, abroker.sell_long)
+
+    @routes.get('/broker/buy_short')
+    async def buy_short(request):
+        return await trade(request, abroker.buy_short)
+
+    @routes.get('/broker/sell_short')
+    async def sell_short(request):
+        return await trade(request, abroker.sell_short)
+
+    @routes.get('/broker/set_watch')
+    async def set_watch(request):
+        failure = missing_param(request.query, APIKEY_KEY, USERID_KEY, SYMBOL_KEY)
+        if failure:
+            return jsonify(failure)
+        return jsonify(await abroker.set_watch(request.query[USERID_KEY], request.query[SYMBOL_KEY].upper(),
+                                               request.query[APIKEY_KEY]))
+
+    @routes.get('/broker/remove_watch')
+    async def remove_watch(request):
+        failure = missing_param(request.query, APIKEY_KEY, USERID_KEY, SYMBOL_KEY)
+        if failure:
+            return jsonify(failure)
+        return jsonify(await abroker.run(broker.remove_watch, request.query[USERID_KEY],
+                                         request.query[SYMBOL_KEY].upper(), request.query[APIKEY_KEY]))
+
+    @routes.get('/broker/place_order')
+    async def place_order(request):
+        failure = missing_param(request.query, APIKEY_KEY, USERID_KEY, SYMBOL_KEY, ACTION_KEY, ORDER_TYPE_KEY, PRICE_KEY, QUANTITY_KEY)
+        if failure:
+            return jsonify(failure)
+        try:
+            price = Decimal(request.query[PRICE_KEY])
+        except Exception:
+            return jsonify(broker.return_failure(INVALID_TYPE_MSG.format(param=PRICE_KEY, type='Decimal')))
+        try:
+            quantity = int(request.query[QUANTITY_KEY])
+        except Exception:
+            return jsonify(broker.return_failure(INVALID_TYPE_MSG.format(param=QUANTITY_KEY, type='int')))
+        return jsonify(await abroker.run(broker.place_order, request.query[USERID_KEY], request.query[SYMBOL_KEY].upper(),
+                                         request.query[ACTION_KEY].lower(), request.query[ORDER_TYPE_KEY].lower(),
+                                         price, quantity, request.query[APIKEY_KEY]))
+
+    @routes.get('/broker/cancel_order')
+    async def cancel_order(request):
+        failure = missing_param(request.query, APIKEY_KEY, USERID_KEY, ID_KEY)
+        if failure:
+            return jsonify(failure)
+        try:
+            order_id = int(request.query[ID_KEY])
+        except Exception:
+            return jsonify(broker.return_failure(INVALID_TYPE_MSG.format(param=ID_KEY, type='int')))
+        return jsonify(await abroker.run(broker.cancel_order, order_id, request.query[USERID_KEY], request.query[APIKEY_KEY]))
+
+    @routes.get('/broker/orders')
+    async def list_orders(request):
+        failure = missing_param(request.query, USERID_KEY)
+        if failure:
+            return jsonify(failure)
+        return jsonify(await abroker.run(broker.get_orders, request.query[USERID_KEY]))
+
+    @routes.get('/broker/profiles')
+    async def list_profiles(request):
+        failure = missing_param(request.query, APIKEY_KEY)
+        if failure:
+            return jsonify(failure)
+        return jsonify(await abroker.run(broker.get_profiles, request.query[APIKEY_KEY]))
+
+    @routes.get('/broker/profile')
+    async def get_profile(request):
+        failure = missing_param(request.query, APIKEY_KEY, ID_KEY)
+        if failure:
+            return jsonify(failure)
+        try:
+            profile_id = int(request.query[ID_KEY])
+        except Exception:
+            return jsonify(broker.return_failure(INVALID_TYPE_MSG.format(param=ID_KEY, type='int')))
+        return jsonify(await abroker.run(broker.get_profile, request.query[APIKEY_KEY], profile_id))
+
+    @routes.get('/broker/watch_alerts')
+    async def watch_alerts(request):
+        try:
+            since = int(request.query.get(SINCE_KEY, '0'))
+        except Exception:
+            return jsonify(broker.return_failure(INVALID_TYPE_MSG.format(param=SINCE_KEY, type='int')))
+        try:
+            timeout = min(max(float(request.query.get(TIMEOUT_KEY, str(DEFAULT_POLL_TIMEOUT))), 0), MAX_POLL_TIMEOUT)
+        except Exception:
+            return jsonify(broker.return_failure(INVALID_TYPE_MSG.format(param=TIMEOUT_KEY, type='float')))
+        return jsonify(await abroker.get_watch_alerts(since, request.query.get(USERID_KEY), timeout))
+
+    @routes.get('/broker/jobs')
+    async def list_jobs(request):
+        return jsonify(broker.get_jobs())
+
+    @routes.get('/broker/run_job')
+    async def run_job(request):
+        failure = missing_param(request.query, APIKEY_KEY, JOB_KEY)
+        if failure:
+            return jsonify(failure)
+        return jsonify(await abroker.run(broker.run_job, request.query[JOB_KEY], request.query[APIKEY_KEY]))
+
+    app = web.Application(middlewares=[profile_requests(broker), compress_response])
+    app.add_routes(routes)
+
+    async def on_cleanup(app):
+        abroker.shutdown()
+    app.on_cleanup.append(on_cleanup)
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c",
+            dest="configFile",
+            help="Relative Path to config file",
+            required=True)
+    args = parser.parse_args()
+    config = configparser.ConfigParser(delimiters=('='))
+    config.read(args.configFile)
+
+    configure_logging()
+    broker = build_broker(config)
+
+    abroker = AsyncOttoBroker(broker, max_workers=int(config.get('DEFAULT', 'async_workers', fallback='32')))
+
+    web.run_app(create_app(abroker), port=8888)
@@ -0,0 +1,90 @@
+import argparse
+import concurrent.futures
+import configparser
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+
+from benchUtil import get_json
+from stubQuoteServer import StubQuoteServer
+
+# both servers bind this port, so they are benchmarked one after the other
+SERVER_PORT = 8888
+SERVERS = [('flask', 'main.py'), ('aiohttp', 'asyncMain.py')]
+READY_TIMEOUT = 60
+
+
+def wait_ready(base_url, proc):
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit('server exited with status {}'.format(proc.returncode))
+        try:
+            if get_json(base_url + '/broker/ready', timeout=5).get('ready'):
+                return
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(0.2)
+    raise SystemExit('server at {} was not ready after {}s'.format(base_url, READY_TIMEOUT))
+
+
+def run_requests(base_url, user_ids, request_count, concurrency):
+    def one(user_id):
+        get_json('{}/broker/user_info?{}'.format(base_url, urllib.parse.urlencode({'userid': user_id})))
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, itertools.islice(itertools.cycle(user_ids), request_count)))
+    return time.perf_counter() - start
+
+
+def bench_server(script, config_path, request_count, concurrency):
+    base_url = 'http://127.0.0.1:{}'.format(SERVER_PORT)
+    proc = subprocess.Popen([sys.executable, script, '-c', config_path], cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        wait_ready(base_url, proc)
+        user_ids = [user['id'] for user in get_json(base_url + '/broker/all_users?shallow=True')['user_list']]
+        if not user_ids:
+            raise SystemExit('no users to benchmark against; seed the database first')
+        return len(user_ids), run_requests(base_url, user_ids, request_count, concurrency)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare user_info throughput of the Flask and aiohttp servers '
+                                                 'while the quote provider is slow')
+    parser.add_argument('-c', dest='configFile', required=True, help='Relative Path to config file')
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds injected into every quote response')
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    stub = StubQuoteServer(latency=args.latency).start()
+
+    # same settings for both servers, but quotes come from the stub
+    config = configparser.ConfigParser(delimiters=('='))
+    config.read(args.configFile)
+    config.set('DEFAULT', 'quote_api_url', stub.url)
+    with tempfile.NamedTemporaryFile('w', suffix='.ini', delete=False) as config_file:
+        config.write(config_file)
+
+    try:
+        print('{} user_info requests, {} concurrent clients, {:.0f}ms injected quote latency'.format(
+            args.requests, args.concurrency, args.latency * 1000))
+        for name, script in SERVERS:
+            user_count, elapsed = bench_server(script, config_file.name, args.requests, args.concurrency)
+            print('{:<8} {:8.2f}s {:8.1f} req/s over {} users'.format(name, elapsed, args.requests / elapsed, user_count))
+    finally:
+        os.unlink(config_file.name)
+        stub.stop()
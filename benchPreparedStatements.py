@@ -0,0 +1,67 @@
+import argparse
+import configparser
+import statistics
+import time
+import uuid
+from decimal import Decimal
+
+from benchUtil import percentile
+from postgresWrapper import PostgresWrapper
+
+
+def bench_queries(db, user_id, api_key, iterations):
+    # the reads a user_info request makes plus a deposit, each timed on its own
+    queries = [
+        ('get_user', lambda: db.broker_get_single_user(user_id)),
+        ('get_api_user', lambda: db.broker_get_single_api_users(api_key)),
+        ('get_longs', lambda: db.broker_get_longs_by_user(user_id)),
+        ('get_historical_longs', lambda: db.broker_get_historical_longs_by_user(user_id)),
+        ('get_shorts', lambda: db.broker_get_shorts_by_user(user_id)),
+        ('get_historical_shorts', lambda: db.broker_get_historical_shorts_by_user(user_id)),
+        ('get_watches', lambda: db.broker_get_watches(user_id)),
+        ('give_money', lambda: db.broker_give_money_to_user(user_id, Decimal('0.01'), 'prepared bench', api_key)),
+    ]
+
+    results = {}
+    for name, query in queries:
+        # the first call pays for the connection and the PREPARE
+        query()
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            query()
+            samples.append((time.perf_counter() - started) * 1000)
+        results[name] = samples
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare per-query latency with and without server-side prepared statements')
+    parser.add_argument('-c', dest='configFile', required=True, help='Relative Path to config file')
+    parser.add_argument('--apikey', required=True, help='api key registered in ottobroker.apiusers')
+    parser.add_argument('--iterations', type=int, default=500)
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser(delimiters=('='))
+    config.read(args.configFile)
+    connection_string = config.get('DEFAULT', 'test_connection_string')
+
+    setup_db = PostgresWrapper(connection_string, force_quiet=True)
+    user_id = 'bench_{}'.format(uuid.uuid4().hex[:12])
+    if setup_db.broker_create_user(user_id, user_id, args.apikey) is None:
+        raise SystemExit('could not create bench user; check the api key')
+
+    # a single pooled connection, so every timed call reuses the same session
+    plain = bench_queries(PostgresWrapper(connection_string, force_quiet=True, pool_size=1, prepare_statements=False),
+                          user_id, args.apikey, args.iterations)
+    prepared = bench_queries(PostgresWrapper(connection_string, force_quiet=True, pool_size=1, prepare_statements=True),
+                             user_id, args.apikey, args.iterations)
+
+    print('{} iterations per query, latencies in ms'.format(args.iterations))
+    print('{:<24} {:>10} {:>10} {:>10} {:>10} {:>8}'.format('query', 'plain p50', 'prep p50', 'plain p95', 'prep p95', 'speedup'))
+    for name in plain:
+        print('{:<24} {:10.3f} {:10.3f} {:10.3f} {:10.3f} {:7.2f}x'.format(
+            name,
+            percentile(plain[name], 50), percentile(prepared[name], 50),
+            percentile(plain[name], 95), percentile(prepared[name], 95),
+            statistics.mean(plain[name]) / statistics.mean(prepared[name])))
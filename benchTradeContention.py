@@ -0,0 +1,94 @@
+import argparse
+import configparser
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from postgresWrapper import PostgresWrapper
+
+PRICE = Decimal('10.00')
+STARTING_BALANCE = Decimal('100000.00')
+
+
+def trade_succeeded(txid):
+    # selllong/sellshort report failure as -1, the others as NULL; any other negative id is a failure too
+    return txid is not None and txid >= 0
+
+
+def create_users(db, count, api_key):
+    user_ids = []
+    for _ in range(count):
+        user_id = 'bench_{}'.format(uuid.uuid4().hex[:12])
+        if db.broker_create_user(user_id, user_id, api_key) is None:
+            raise SystemExit('could not create bench users; check the api key')
+        db.broker_give_money_to_user(user_id, STARTING_BALANCE, 'contention bench', api_key)
+        user_ids.append(user_id)
+    return user_ids
+
+
+def run_scenario(db, user_ids, threads, ops_per_thread, api_key, symbol):
+    # every thread alternates buying and selling one long, so a correct run ends where it started
+    # plus whatever trades failed half way; the expected values are rebuilt from the successful calls
+    balance_delta = {user_id: Decimal(0) for user_id in user_ids}
+    open_delta = {user_id: 0 for user_id in user_ids}
+    lock = threading.Lock()
+
+    def worker(index):
+        user_id = user_ids[index % len(user_ids)]
+        local_balance = Decimal(0)
+        local_open = 0
+        for op in range(ops_per_thread):
+            if op % 2 == 0:
+                if trade_succeeded(db.broker_buy_long(user_id, symbol, PRICE, 1, api_key)):
+                    local_balance -= PRICE
+                    local_open += 1
+            else:
+                if trade_succeeded(db.broker_sell_long(user_id, symbol, PRICE, 1, api_key)):
+                    local_balance += PRICE
+                    local_open -= 1
+        with lock:
+            balance_delta[user_id] += local_balance
+            open_delta[user_id] += local_open
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+
+    errors = []
+    for user_id in user_ids:
+        user = db.broker_get_single_user(user_id)
+        open_count = sum([s.count for s in db.broker_get_longs_by_user(user_id) if s.ticker_symbol == symbol])
+        if user.balance != STARTING_BALANCE + balance_delta[user_id]:
+            errors.append('{}: balance {} expected {}'.format(user_id, user.balance, STARTING_BALANCE + balance_delta[user_id]))
+        if open_count != open_delta[user_id]:
+            errors.append('{}: {} open lots expected {}'.format(user_id, open_count, open_delta[user_id]))
+    return elapsed, errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hammer the trade functions from parallel workers and check for lost updates')
+    parser.add_argument('-c', dest='configFile', required=True, help='Relative Path to config file')
+    parser.add_argument('--apikey', required=True, help='api key registered in ottobroker.apiusers')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--ops', type=int, default=100, help='trades per thread')
+    parser.add_argument('--symbol', default='BENCH')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser(delimiters=('='))
+    config.read(args.configFile)
+    # never run this against the live database
+    db = PostgresWrapper(config.get('DEFAULT', 'test_connection_string'), force_quiet=True)
+
+    total_ops = args.threads * args.ops
+    for name, user_count in [('same user', 1), ('distinct users', args.threads)]:
+        user_ids = create_users(db, user_count, args.apikey)
+        elapsed, errors = run_scenario(db, user_ids, args.threads, args.ops, args.apikey, args.symbol)
+        print('{:<16} {:6d} trades {:8.2f}s {:8.1f} trades/s  {}'.format(
+            name, total_ops, elapsed, total_ops / elapsed, 'OK' if not errors else '{} ERRORS'.format(len(errors))))
+        for error in errors:
+            print('    ' + error)
@@ -1,15 +1,26 @@
 import json
 import logging
 import datetime
+import time
 import copy
 from decimal import Decimal, ROUND_HALF_UP, ROUND_HALF_DOWN
 import signal
 import functools
+import uuid
+import threading
+import collections
+import hashlib
 
 import pytz
 
-from webWrapper import RestWrapper
+from quoteClient import QuoteClient, QuoteFailure
 from postgresWrapper import PostgresWrapper
+from memoryWrapper import MemoryWrapper
+from watchAlerts import WatchAlertEngine
+from requestProfiler import RequestProfiler
+from userCache import UserSnapshotCache
+from scheduler import JobScheduler
+from orderBook import OrderBook
 
 _logger = logging.getLogger()
 
@@ -19,42 +30,184 @@ class OttoBroker():
     MESSAGE_KEY = 'message'
     VALUE_KEY = 'value'
     NAME_KEY = 'name'
+    STALE_KEY = 'stale'
+    PRICE_AGE_KEY = 'price_age'
 
     STATUS_SUCCESS = 'success'
     STATUS_ERROR = 'error'
 
-    def __init__(self, db_connection_string, test_connection_string, max_liabilities_ratio):
-        self._rest = RestWrapper("https://api.iextrading.com/1.0", {})
-
-        self._db = PostgresWrapper(db_connection_string)
-        self._test_db = PostgresWrapper(test_connection_string)
+    DETAIL_FULL = 'full'
+    DETAIL_SUMMARY = 'summary'
+    DETAIL_LEVELS = (DETAIL_FULL, DETAIL_SUMMARY)
+    # a summary is always valued, so there is no shallow form of it
+    SUMMARY_SHALLOW_MSG = 'detail \'summary\' can\'t be combined with shallow=True'
+    PRICES_UNAVAILABLE_MSG = 'Prices unavailable for some of your positions, try again shortly'
+
+    DEFAULT_QUOTE_API_URL = "https://api.iextrading.com/1.0"
+
+    # varchar(256) columns; a longer value would abort the whole bulk statement
+    MAX_TEXT_LENGTH = 256
+
+    STORAGE_POSTGRES = 'postgres'
+    STORAGE_MEMORY = 'memory'
+
+    READINESS_PENDING = 'pending'
+    READINESS_WARMING = 'warming'
+    READINESS_READY = 'ready'
+    READINESS_FAILED = 'failed'
+    # resting orders and watches only trigger once loaded, so the broker isn't ready until these succeed
+    REQUIRED_WARM_UP_STEPS = ('database', 'watch_alerts', 'orders')
+
+    def __init__(self, db_connection_string, test_connection_string, max_liabilities_ratio, watch_alert_percent=5,
+                 quote_api_url=DEFAULT_QUOTE_API_URL, max_quote_batch=100, quote_fetch_workers=4,
+                 quote_failure_threshold=3, quote_breaker_reset=30, profile_sample_rate=0.0,
+                 replica_connection_string=None, replica_pin_seconds=5, user_cache_size=1000, user_cache_notify=False,
+                 user_cache_ttl=5,
+                 db_pool_size=10, prepare_statements=True, maintenance_api_key=None, short_max_age_days=30,
+                 borrow_fee_daily_rate=0, expired_shorts_interval=300, borrow_fee_interval=86400,
+                 order_refresh_interval=15, watch_refresh_interval=60, max_listed_orders=100, etag_max_age=5, storage_backend=STORAGE_POSTGRES,
+                 memory_api_keys=None, api_key_cache_ttl=60):
+        self._quotes = QuoteClient(quote_api_url, max_batch_symbols=max_quote_batch, max_fetch_workers=quote_fetch_workers,
+                                   failure_threshold=quote_failure_threshold, reset_timeout=quote_breaker_reset)
+
+        if storage_backend == self.STORAGE_MEMORY:
+            # live and test data each get their own tables, which last as long as the process
+            self._db = MemoryWrapper(api_keys=memory_api_keys)
+            self._test_db = MemoryWrapper(api_keys=memory_api_keys)
+        elif storage_backend == self.STORAGE_POSTGRES:
+            self._db = PostgresWrapper(db_connection_string, replica_connection_string=replica_connection_string,
+                                       read_your_writes_window=replica_pin_seconds, pool_size=db_pool_size,
+                                       prepare_statements=prepare_statements)
+            self._test_db = PostgresWrapper(test_connection_string, pool_size=db_pool_size, prepare_statements=prepare_statements)
+        else:
+            raise Exception('Unknown storage_backend {}'.format(storage_backend))
 
         self._test_mode = False
         self._cur_db = self._db
 
         self._max_liabilities_ratio = max_liabilities_ratio
 
+        self._watch_alerts = WatchAlertEngine(watch_alert_percent)
+
+        self._profiler = RequestProfiler(sample_rate=profile_sample_rate)
+
+        # without notifications, writes made by other workers only reach this cache when the snapshot expires
+        self._user_cache = UserSnapshotCache(max_entries=user_cache_size, ttl=None if user_cache_notify else user_cache_ttl)
+        self._user_cache_notify = user_cache_notify
+        self._instance_id = uuid.uuid4().hex
+
+        # scheduled maintenance runs as the api user owning maintenance_api_key
+        self._scheduler = JobScheduler()
+        self._maintenance_api_key = maintenance_api_key
+        self._short_max_age = short_max_age_days * 86400
+        self._borrow_fee_daily_rate = Decimal(str(borrow_fee_daily_rate))
+        self._expired_shorts_interval = expired_shorts_interval
+        self._borrow_fee_interval = borrow_fee_interval
+
+        # held while switching backends and while a resting order fills, so a fill never spans a test mode toggle
+        self._mode_lock = threading.Lock()
+        self._order_book = OrderBook(self._fill_order, guard=self._mode_lock)
+        self._order_refresh_interval = order_refresh_interval
+        self._watch_refresh_interval = watch_refresh_interval
+        self._max_listed_orders = max_listed_orders
+
+        # 304s skip the quote fetch that would bump the price version, so etags also roll over every etag_max_age seconds
+        self._etag_max_age = etag_max_age
+
+        # api key -> when it was last seen valid, per backend. a hit needs no query, and keys revoked in the
+        # database stop working once their entry is older than api_key_cache_ttl
+        self._api_keys = {'live': {}, 'test': {}}
+        self._api_key_cache_ttl = api_key_cache_ttl
+
+        self._readiness_lock = threading.Lock()
+        self._readiness = {'state': self.READINESS_PENDING, 'steps': collections.OrderedDict()}
+        self._warm_up_deadline = None
+
+    def _invalidate_user(self, *user_ids, backend=None):
+        if backend is None:
+            backend = self._backend_name()
+        for user_id in user_ids:
+            self._user_cache.invalidate(backend, user_id)
+        if self._user_cache_notify and user_ids:
+            try:
+                self._backend_db(backend).broker_notify_users_changed(user_ids, self._instance_id)
+            except Exception as e:
+                # the write already happened, other workers just keep their snapshot a little longer
+                _logger.exception(e)
+
+    def _on_user_changed(self, backend, sender, user_id):
+        # the reload must come from the primary, or a lagging replica puts the old snapshot straight back
+        db = self._backend_db(backend)
+        if sender is None:
+            db.pin_to_primary()
+            self._user_cache.clear(backend)
+        elif sender != self._instance_id:
+            db.pin_to_primary(user_id)
+            self._user_cache.invalidate(backend, user_id)
+
+    def start_user_cache_listeners(self):
+        if not self._user_cache_notify or not self._user_cache.enabled:
+            return
+        self._db.listen_users_changed(functools.partial(self._on_user_changed, 'live'))
+        self._test_db.listen_users_changed(functools.partial(self._on_user_changed, 'test'))
+
     def _is_valid_api_user(self, api_key):
-        return self._cur_db.broker_get_single_api_users(api_key) != None
+        known = self._api_keys[self._backend_name()]
+        checked = known.get(api_key)
+        if checked is not None and time.monotonic() - checked < self._api_key_cache_ttl:
+            return True
+        if self._cur_db.broker_get_single_api_users(api_key) == None:
+            known.pop(api_key, None)
+            return False
+        known[api_key] = time.monotonic()
+        return True
+
+    def _backend_name(self):
+        return 'test' if self._test_mode else 'live'
+
+    def _backend_db(self, backend):
+        return self._db if backend == 'live' else self._test_db
 
     def _get_user(self, user_id, shallow=False):
+        backend = self._backend_name()
+        user = self._user_cache.get(backend, user_id, shallow)
+        if user is not None:
+            return user
+
+        generation = self._user_cache.generation(backend, user_id)
+        user = self._load_user(user_id, shallow)
+        if user is not None:
+            self._user_cache.put(backend, user_id, shallow, user, generation)
+        return user
+
+    def _load_user(self, user_id, shallow=False):
         user = self._cur_db.broker_get_single_user(user_id)
         if user is None:
             return None
 
         if not shallow:
-            user.longs = self._convert_stock_list_to_dict(self._cur_db.broker_get_longs_by_user(user_id))
-            user.historical_longs = self._convert_stock_list_to_dict(self._cur_db.broker_get_historical_longs_by_user(user_id))
-            user.shorts = self._convert_stock_list_to_dict(self._cur_db.broker_get_shorts_by_user(user_id))
-            user.historical_shorts = self._convert_stock_list_to_dict(self._cur_db.broker_get_historical_shorts_by_user(user_id))
-
-            watch_list = self._cur_db.broker_get_watches(user_id)
-            watch_dict = {}
-            for stock in watch_list:
-                watch_dict[stock.ticker_symbol] = stock
-            user.watches = watch_dict
+            self._attach_positions(
+                user,
+                self._cur_db.broker_get_longs_by_user(user_id),
+                self._cur_db.broker_get_historical_longs_by_user(user_id),
+                self._cur_db.broker_get_shorts_by_user(user_id),
+                self._cur_db.broker_get_historical_shorts_by_user(user_id),
+                self._cur_db.broker_get_watches(user_id)
+            )
         
         return user
+
+    @classmethod
+    def _attach_positions(cls, user, longs, historical_longs, shorts, historical_shorts, watch_list):
+        user.longs = cls._convert_stock_list_to_dict(longs)
+        user.historical_longs = cls._convert_stock_list_to_dict(historical_longs)
+        user.shorts = cls._convert_stock_list_to_dict(shorts)
+        user.historical_shorts = cls._convert_stock_list_to_dict(historical_shorts)
+
+        watch_dict = {}
+        for stock in watch_list:
+            watch_dict[stock.ticker_symbol] = stock
+        user.watches = watch_dict
     
     @staticmethod
     def _convert_stock_list_to_dict(stock_list):
@@ -66,15 +219,19 @@ class OttoBroker():
                 result_dict[stock.ticker_symbol] = [stock]
         return result_dict
     
-    def _get_user_net_worth(self, user):
+    def _get_user_net_worth(self, user, allow_stale=True):
         symbols = list(user.longs.keys())
-        symbols.extend(list(user.historical_longs.keys()))
         symbols.extend(list(user.shorts.keys()))
-        symbols.extend(list(user.historical_shorts.keys()))
+        if allow_stale:
+            symbols.extend(list(user.historical_longs.keys()))
+            symbols.extend(list(user.historical_shorts.keys()))
+            # watches ride along in the same batch so clients don't need a separate stock_info call
+            symbols.extend(list(user.watches.keys()))
         symbols = set(symbols)
 
         if symbols:
-            stock_vals = self.get_stock_value(list(symbols))
+            # valuations may fall back to last-known prices while the quote provider is down, trade checks may not
+            stock_vals = self.get_stock_value(list(symbols), allow_stale=allow_stale)
         else:
             stock_vals = {}
 
@@ -82,23 +239,40 @@ class OttoBroker():
         liabilities = Decimal(0)
 
         for l in user.longs:
-            total_count = 0
-            for stock in user.longs[l]:
-                total_count += stock.count
-            assets += stock_vals[l][self.VALUE_KEY] * total_count
+            value = self._get_position_value(user.longs[l], stock_vals.get(l), 'purchase_cost', allow_stale)
+            if value is None:
+                return None, None, stock_vals
+            assets += value
             assets = Decimal(assets.quantize(Decimal('.01'), rounding=ROUND_HALF_UP))
 
         for s in user.shorts:
-            total_count = 0
-            for stock in user.shorts[s]:
-                total_count += stock.count
-            liabilities += stock_vals[s][self.VALUE_KEY] * total_count
+            value = self._get_position_value(user.shorts[s], stock_vals.get(s), 'sell_cost', allow_stale)
+            if value is None:
+                return None, None, stock_vals
+            liabilities += value
             liabilities = Decimal(liabilities.quantize(Decimal('.01'), rounding=ROUND_HALF_UP))
         
         return assets, liabilities, stock_vals
+
+    @classmethod
+    def _get_position_value(cls, stocks, stock_val, cost_attr, allow_stale=True):
+        total_count = 0
+        for stock in stocks:
+            total_count += stock.count
+
+        if stock_val is not None and stock_val.get(cls.STATUS_KEY) == cls.STATUS_SUCCESS:
+            return stock_val[cls.VALUE_KEY] * total_count
+
+        if not allow_stale:
+            return None
+        # not even a stale price is known, so value the lots at what they traded for
+        return sum([getattr(stock, cost_attr) * stock.count for stock in stocks])
     
-    def _too_much_liability(self, user, additional_liability=None):
-        user_assets, user_liabilities, _ = self._get_user_net_worth(user)
+    def _too_much_liability(self, user, additional_liability=None, allow_stale=True):
+        # None means a position had no price to check against, which is neither a yes nor a no
+        user_assets, user_liabilities, _ = self._get_user_net_worth(user, allow_stale=allow_stale)
+        if user_assets is None:
+            return None
 
         if additional_liability is not None:
             user_liabilities += additional_liability
@@ -112,12 +286,57 @@ class OttoBroker():
             stock_vals = None
         else:
             assets, liabilities, stock_vals = self._get_user_net_worth(user)
-        return user.to_dict(assets, liabilities, stock_vals, shallow=shallow)
+        result = user.to_dict(assets, liabilities, stock_vals, shallow=shallow)
+        result['degraded'] = bool(stock_vals) and any([
+            val.get(self.STATUS_KEY) == self.STATUS_SUCCESS and val.get(self.STALE_KEY, False)
+            for symbol, val in stock_vals.items() if symbol != self.STATUS_KEY
+        ])
+        return result
+
+    def _get_summary_user_dict(self, user, summaries, stock_vals):
+        # the aggregates come from SQL, only the price dependent parts are filled in here
+        assets = Decimal(user.balance)
+        liabilities = Decimal(0)
+        realized_pnl = Decimal(0)
+        unrealized_pnl = Decimal(0)
+        positions = {}
+
+        for summary in summaries:
+            position = summary.to_dict(stock_vals.get(summary.ticker_symbol, {}))
+            positions[summary.ticker_symbol] = position
+            assets = Decimal((assets + position['long_value']).quantize(Decimal('.01'), rounding=ROUND_HALF_UP))
+            liabilities = Decimal((liabilities + position['short_value']).quantize(Decimal('.01'), rounding=ROUND_HALF_UP))
+            realized_pnl += position['realized_pnl']
+            if position['unrealized_pnl'] is not None:
+                unrealized_pnl += position['unrealized_pnl']
+
+        return {
+            'id': user.id,
+            'created_date': user.created,
+            'balance': user.balance,
+            'display_name': user.display_name,
+            'assets': assets,
+            'liabilities': liabilities,
+            'realized_pnl': realized_pnl,
+            'unrealized_pnl': unrealized_pnl,
+            'positions': positions,
+            'degraded': any([position['stale'] for position in positions.values() if position['long_count'] or position['short_count']])
+        }
+
+    def _get_summary_stock_vals(self, summaries):
+        # only open positions need a price
+        symbols = list(set([summary.ticker_symbol for summary in summaries if summary.is_open]))
+        if not symbols:
+            return {}
+        return self.get_stock_value(symbols, allow_stale=True)
 
     def is_market_live(self, time=None):
         if self._test_mode:
             return True
-            
+        return self._is_market_hours(time)
+
+    @staticmethod
+    def _is_market_hours(time=None):
         if time is None:
             time = datetime.datetime.now(pytz.timezone('EST5EDT'))
         
@@ -159,47 +378,71 @@ class OttoBroker():
 
         return result
     
-    def get_stock_value(self, symbol_list):
+    def get_stock_value(self, symbol_list, allow_stale=False):
         result = dict()
-        unparsed = self._rest.request(
-            '/stock/market/batch/',
-            {
-                'types': 'quote',
-                'symbols': ','.join(symbol_list)}
-            )
-        data = None
+        quotes = self._quotes.get_quotes(symbol_list, allow_stale=allow_stale)
+        now = time.time()
+
+        for symbol in symbol_list:
+            if symbol not in quotes:
+                result[symbol] = {
+                    self.STATUS_KEY: self.STATUS_ERROR,
+                    self.MESSAGE_KEY: 'Unknown symbol'
+                }
+            elif isinstance(quotes[symbol], QuoteFailure):
+                result[symbol] = {
+                    self.STATUS_KEY: self.STATUS_ERROR,
+                    self.MESSAGE_KEY: quotes[symbol].message
+                }
+            else:
+                result[symbol] = {
+                    self.STATUS_KEY: self.STATUS_SUCCESS,
+                    self.VALUE_KEY: quotes[symbol].value,
+                    self.NAME_KEY: quotes[symbol].name,
+                    self.STALE_KEY: quotes[symbol].stale,
+                    self.PRICE_AGE_KEY: round(max(now - quotes[symbol].fetched, 0), 1)
+                }
+
+        result[self.STATUS_KEY] = self.STATUS_SUCCESS
+
+        fresh_prices = {
+            symbol: result[symbol][self.VALUE_KEY] for symbol in symbol_list
+            if result[symbol][self.STATUS_KEY] == self.STATUS_SUCCESS and not result[symbol][self.STALE_KEY]
+        }
+        triggered = self._watch_alerts.on_prices(fresh_prices)
+        if triggered:
+            self._mark_watches_alerted(triggered)
+        if self.is_market_live():
+            self._order_book.on_prices(fresh_prices)
 
-        try:
-            data = json.loads(unparsed)
-        except Exception as e:
-            return self.return_failure('Invalid API response', exc_info=e)
-        if data is None:
-            return self.return_failure('Got None from api response')
-        elif not isinstance(data, dict):
-            return self.return_failure('Unexpected data type ' + str(type(data)))
+        return result
 
+    def _mark_watches_alerted(self, triggered):
         try:
-            for symbol in symbol_list:
-                if symbol not in data:
-                    result[symbol] = {
-                        self.STATUS_KEY: self.STATUS_ERROR,
-                        self.MESSAGE_KEY: 'Unknown symbol'
-                    }
-                else:
-                    result[symbol] = {
-                        self.STATUS_KEY: self.STATUS_SUCCESS,
-                        self.VALUE_KEY: Decimal(str(data[symbol]['quote']['latestPrice'])),
-                        self.NAME_KEY: data[symbol]['quote']['companyName']
-                    }
-
-            result[self.STATUS_KEY] = self.STATUS_SUCCESS
+            self._cur_db.broker_mark_watches_alerted([(user_id, symbol, watch_cost) for user_id, symbol, _, watch_cost, _ in triggered])
         except Exception as e:
-            return self.return_failure('Unexpected response format', exc_info=e)
+            # the alert already went out, it may just fire once more after a restart
+            _logger.exception(e)
 
-        return result
+    def get_db_stats(self):
+        return {
+            self.STATUS_KEY: self.STATUS_SUCCESS,
+            'test_mode': self._test_mode,
+            'routing_stats': self._cur_db.get_routing_stats(),
+            'statement_stats': self._cur_db.get_statement_stats(),
+            'order_book_stats': self._order_book.get_stats(),
+            'user_cache_stats': self._user_cache.get_stats()
+        }
+
+    def get_quote_stats(self):
+        return {
+            self.STATUS_KEY: self.STATUS_SUCCESS,
+            'quote_stats': self._quotes.get_stats()
+        }
     
-    def buy_long(self, symbol, quantity, user_id, api_key):
-        user = self._get_user(user_id)
+    def buy_long(self, symbol, quantity, user_id, api_key, user=None, stock_val=None):
+        if user is None:
+            user = self._get_user(user_id)
 
         if not user:
             return self.return_failure('Invalid user_id: {}'.format(user_id), do_log=False)
@@ -210,7 +453,8 @@ class OttoBroker():
         if not self.is_market_live():
             return self.return_failure('No trading after hours', do_log=False)
 
-        stock_val = self.get_stock_value([symbol])
+        if stock_val is None:
+            stock_val = self.get_stock_value([symbol])
 
         if stock_val[self.STATUS_KEY] != self.STATUS_SUCCESS:
             # don't need to log here, because the error is presumably also logged in get_stock_value
@@ -235,12 +479,18 @@ class OttoBroker():
             }
             return self.return_failure('Insufficient funds', extra_vals=extra_vals, do_log=False)
         
-        if self._too_much_liability(user):
+        too_much_liability = self._too_much_liability(user, allow_stale=False)
+        if too_much_liability is None:
+            return self.return_failure(self.PRICES_UNAVAILABLE_MSG, do_log=False)
+        if too_much_liability:
             return self.return_failure('Your liabilities are too large. Buy back shorts to be allowed to purchase stocks', do_log=False)
         
-        if self._cur_db.broker_buy_long(user.id, symbol, per_stock_cost, quantity, api_key) is None:
+        # the SQL functions return NULL or -1 when the trade did not happen, e.g. another worker got there first
+        txid = self._cur_db.broker_buy_long(user.id, symbol, per_stock_cost, quantity, api_key)
+        if txid is None or txid < 0:
             return self.return_failure('buying long failed. Ensure you have a valid API key')
         
+        self._invalidate_user(user.id)
         user = self._get_user(user.id)
         return {
             self.STATUS_KEY: self.STATUS_SUCCESS,
@@ -251,8 +501,9 @@ class OttoBroker():
             'symbol': symbol
         }
     
-    def sell_long(self, symbol, quantity, user_id, api_key):
-        user = self._get_user(user_id)
+    def sell_long(self, symbol, quantity, user_id, api_key, user=None, stock_val=None):
+        if user is None:
+            user = self._get_user(user_id)
 
         if not user:
             return self.return_failure('Invalid user_id: {}'.format(user_id), do_log=False)
@@ -263,7 +514,8 @@ class OttoBroker():
         if not self.is_market_live():
             return self.return_failure('No trading after hours', do_log=False)
 
-        stock_val = self.get_stock_value([symbol])
+        if stock_val is None:
+            stock_val = self.get_stock_value([symbol])
 
         if stock_val[self.STATUS_KEY] != self.STATUS_SUCCESS:
             # don't need to log here, because the error is presumably also logged in get_stock_value
@@ -291,9 +543,11 @@ class OttoBroker():
             }
             return self.return_failure('Insufficient longs to sell', extra_vals=extra_vals, do_log=False)
         
-        if self._cur_db.broker_sell_long(user.id, symbol, per_stock_cost, quantity, api_key) is None:
+        txid = self._cur_db.broker_sell_long(user.id, symbol, per_stock_cost, quantity, api_key)
+        if txid is None or txid < 0:
             return self.return_failure('selling long failed. Ensure you have a valid API key')
         
+        self._invalidate_user(user.id)
         user = self._get_user(user.id)
         return {
             self.STATUS_KEY: self.STATUS_SUCCESS,
@@ -304,8 +558,9 @@ class OttoBroker():
             'symbol': symbol
         }
     
-    def buy_short(self, symbol, quantity, user_id, api_key):
-        user = self._get_user(user_id)
+    def buy_short(self, symbol, quantity, user_id, api_key, user=None, stock_val=None):
+        if user is None:
+            user = self._get_user(user_id)
 
         if not user:
             return self.return_failure('Invalid user_id: {}'.format(user_id), do_log=False)
@@ -316,7 +571,8 @@ class OttoBroker():
         if not self.is_market_live():
             return self.return_failure('No trading after hours', do_log=False)
 
-        stock_val = self.get_stock_value([symbol])
+        if stock_val is None:
+            stock_val = self.get_stock_value([symbol])
 
         if stock_val[self.STATUS_KEY] != self.STATUS_SUCCESS:
             # don't need to log here, because the error is presumably also logged in get_stock_value
@@ -354,9 +610,11 @@ class OttoBroker():
             }
             return self.return_failure('Insufficient shorts to buy back', extra_vals=extra_vals, do_log=False)
 
-        if self._cur_db.broker_buy_short(user.id, symbol, per_stock_cost, quantity, api_key) is None:
+        txid = self._cur_db.broker_buy_short(user.id, symbol, per_stock_cost, quantity, api_key)
+        if txid is None or txid < 0:
             return self.return_failure('buying short failed. Ensure you have a valid API key')
         
+        self._invalidate_user(user.id)
         user = self._get_user(user.id)
         return {
             self.STATUS_KEY: self.STATUS_SUCCESS,
@@ -367,8 +625,9 @@ class OttoBroker():
             'symbol': symbol
         }
     
-    def sell_short(self, symbol, quantity, user_id, api_key):
-        user = self._get_user(user_id)
+    def sell_short(self, symbol, quantity, user_id, api_key, user=None, stock_val=None):
+        if user is None:
+            user = self._get_user(user_id)
 
         if not user:
             return self.return_failure('Invalid user_id: {}'.format(user_id), do_log=False)
@@ -379,7 +638,8 @@ class OttoBroker():
         if not self.is_market_live():
             return self.return_failure('No trading after hours', do_log=False)
 
-        stock_val = self.get_stock_value([symbol])
+        if stock_val is None:
+            stock_val = self.get_stock_value([symbol])
 
         if stock_val[self.STATUS_KEY] != self.STATUS_SUCCESS:
             # don't need to log here, because the error is presumably also logged in get_stock_value
@@ -394,12 +654,17 @@ class OttoBroker():
         per_stock_cost = stock_val[symbol][self.VALUE_KEY]
         total_cost = per_stock_cost * quantity
         
-        if self._too_much_liability(user, additional_liability=total_cost):
+        too_much_liability = self._too_much_liability(user, additional_liability=total_cost, allow_stale=False)
+        if too_much_liability is None:
+            return self.return_failure(self.PRICES_UNAVAILABLE_MSG, do_log=False)
+        if too_much_liability:
             return self.return_failure('Your liabilities are too large. Buy back shorts to be allowed to acquire other shorts', do_log=False)
         
-        if self._cur_db.broker_sell_short(user.id, symbol, per_stock_cost, quantity, api_key) is None:
+        txid = self._cur_db.broker_sell_short(user.id, symbol, per_stock_cost, quantity, api_key)
+        if txid is None or txid < 0:
             return self.return_failure('selling short failed. Ensure you have a valid API key')
         
+        self._invalidate_user(user.id)
         user = self._get_user(user.id)
         return {
             self.STATUS_KEY: self.STATUS_SUCCESS,
@@ -425,6 +690,7 @@ class OttoBroker():
         if self._cur_db.broker_give_money_to_user(user.id, -amount, reason, api_key) is None:
             return self.return_failure('withdraw failed. Ensure you have a valid API key')
 
+        self._invalidate_user(user.id)
         user = self._get_user(user.id)
 
         return {
@@ -445,6 +711,7 @@ class OttoBroker():
         if self._cur_db.broker_give_money_to_user(user.id, amount, reason, api_key) is None:
             return self.return_failure('deposit failed. Ensure you have a valid API key')
 
+        self._invalidate_user(user.id)
         user = self._get_user(user.id)
 
         return {
@@ -452,8 +719,77 @@ class OttoBroker():
             'user': self._get_full_user_dict(user)
         }
 
-    def get_user_info(self, user_id, shallow):
-        user = self._get_user(user_id)
+    def bulk_capital(self, entries, api_key, valuate=False):
+        if not isinstance(entries, list) or not entries:
+            return self.return_failure('entries must be a non-empty list', do_log=False)
+
+        results = []
+        valid = []
+        for entry in entries:
+            result = {self.STATUS_KEY: self.STATUS_ERROR}
+            results.append(result)
+            if not isinstance(entry, dict):
+                result[self.MESSAGE_KEY] = 'entry must be an object'
+                continue
+
+            result['userid'] = entry.get('userid')
+            result['amount'] = entry.get('amount')
+            try:
+                amount = Decimal(str(entry['amount']))
+            except Exception:
+                result[self.MESSAGE_KEY] = 'amount must be a Decimal'
+                continue
+            if not amount.is_finite():
+                result[self.MESSAGE_KEY] = 'amount must be a finite number'
+                continue
+            if not entry.get('userid') or not entry.get('reason'):
+                result[self.MESSAGE_KEY] = 'entry requires userid and reason'
+                continue
+            if len(str(entry['userid'])) > self.MAX_TEXT_LENGTH or len(str(entry['reason'])) > self.MAX_TEXT_LENGTH:
+                result[self.MESSAGE_KEY] = 'userid and reason must be at most {} characters'.format(self.MAX_TEXT_LENGTH)
+                continue
+
+            result['amount'] = amount
+            valid.append((len(results) - 1, (str(entry['userid']), amount, str(entry['reason']))))
+
+        if valid:
+            rows = self._cur_db.broker_give_money_bulk([v[1] for v in valid], api_key)
+            if not rows:
+                return self.return_failure('bulk capital failed. Ensure you have a valid API key')
+            self._invalidate_user(*set([row[1] for row in rows if row[3] == 'ok']))
+
+            for entry_index, _, txid, status in rows:
+                result = results[valid[entry_index - 1][0]]
+                if status == 'ok':
+                    result[self.STATUS_KEY] = self.STATUS_SUCCESS
+                    result['transaction_id'] = txid
+                else:
+                    result[self.MESSAGE_KEY] = status
+
+        if valuate:
+            users = {}
+            for result in results:
+                if result[self.STATUS_KEY] == self.STATUS_SUCCESS:
+                    if result['userid'] not in users:
+                        users[result['userid']] = self._get_full_user_dict(self._get_user(result['userid']))
+                    result['user'] = users[result['userid']]
+
+        return {
+            self.STATUS_KEY: self.STATUS_SUCCESS,
+            'applied': len([r for r in results if r[self.STATUS_KEY] == self.STATUS_SUCCESS]),
+            'results': results
+        }
+
+    def get_user_info(self, user_id, shallow, detail=DETAIL_FULL):
+        if detail not in self.DETAIL_LEVELS:
+            return self.return_failure('detail must be one of {}'.format(', '.join(self.DETAIL_LEVELS)), do_log=False)
+        if detail == self.DETAIL_SUMMARY and shallow is True:
+            return self.return_failure(self.SUMMARY_SHALLOW_MSG, do_log=False)
+        if detail == self.DETAIL_SUMMARY and shallow is False:
+            return self._get_user_summary(user_id)
+
+        # the same snapshot get_user_info_etag looked at
+        user = self._get_user(user_id, shallow=shallow is True)
 
         if not isinstance(shallow, bool):
             return self.return_failure('shallow must be either \'True\' or \'False\'', do_log=False)
@@ -466,9 +802,40 @@ class OttoBroker():
             'user': self._get_full_user_dict(user, shallow=shallow)
         }
     
-    def get_all_users(self, shallow):
+    def _get_user_summary(self, user_id):
+        user = self._get_user(user_id, shallow=True)
+        if not user:
+            return self.return_failure('Invalid user_id: {}'.format(user_id), do_log=False)
+
+        summaries = self._cur_db.broker_get_position_summaries(user_id)
+        return {
+            self.STATUS_KEY: self.STATUS_SUCCESS,
+            'user': self._get_summary_user_dict(user, summaries, self._get_summary_stock_vals(summaries))
+        }
+
+    def _get_all_user_summaries(self):
+        # one query for the users, one for every position and one quote batch, however many users there are
+        summaries_by_user = {}
+        summaries = self._cur_db.broker_get_all_position_summaries()
+        for summary in summaries:
+            summaries_by_user.setdefault(summary.user_id, []).append(summary)
+        stock_vals = self._get_summary_stock_vals(summaries)
+
+        return {
+            self.STATUS_KEY: self.STATUS_SUCCESS,
+            'user_list': [self._get_summary_user_dict(user, summaries_by_user.get(user.id, []), stock_vals)
+                          for user in self._cur_db.broker_get_all_users()]
+        }
+
+    def get_all_users(self, shallow, detail=DETAIL_FULL):
+        if detail not in self.DETAIL_LEVELS:
+            return self.return_failure('detail must be one of {}'.format(', '.join(self.DETAIL_LEVELS)), do_log=False)
         if not isinstance(shallow, bool):
             return self.return_failure('shallow must be either \'True\' or \'False\'', do_log=False)
+        if detail == self.DETAIL_SUMMARY:
+            if shallow:
+                return self.return_failure(self.SUMMARY_SHALLOW_MSG, do_log=False)
+            return self._get_all_user_summaries()
 
         result = {
             self.STATUS_KEY: self.STATUS_SUCCESS,
@@ -481,6 +848,57 @@ class OttoBroker():
 
         return result
 
+    def _make_etag(self, *parts):
+        return hashlib.md5('|'.join([self._backend_name()] + [str(part) for part in parts]).encode()).hexdigest()
+
+    def _price_etag_parts(self, symbols=None):
+        version, breaker_state = self._quotes.get_price_version(symbols)
+        return [version, breaker_state, int(time.time() // self._etag_max_age)]
+
+    def get_user_info_etag(self, user_id, shallow, detail=DETAIL_FULL):
+        # None means the response can't be validated and is always built in full
+        if not self._etag_max_age or not isinstance(shallow, bool) or detail not in self.DETAIL_LEVELS:
+            return None
+        if detail == self.DETAIL_FULL and self._user_cache.enabled:
+            # the body is built from the cached snapshot, so the etag is too; on a hit this costs no query at all
+            try:
+                user = self._get_user(user_id, shallow)
+            except Exception as e:
+                _logger.exception(e)
+                return None
+            if user is None:
+                return None
+            parts = ['user', user_id, shallow, detail, user.fingerprint()]
+            symbols = user.symbols()
+        else:
+            try:
+                state = self._cur_db.broker_get_user_state(user_id)
+            except Exception as e:
+                _logger.exception(e)
+                return None
+            if state is None:
+                return None
+            last_txid, watch_hash, symbols = state
+            parts = ['user', user_id, shallow, detail, last_txid, watch_hash]
+
+        if not shallow:
+            parts += self._price_etag_parts(symbols)
+        return self._make_etag(*parts)
+
+    def get_all_users_etag(self, shallow, detail=DETAIL_FULL):
+        if not self._etag_max_age or not isinstance(shallow, bool) or detail not in self.DETAIL_LEVELS:
+            return None
+        try:
+            last_txid, user_count, watch_hash = self._cur_db.broker_get_global_state()
+        except Exception as e:
+            _logger.exception(e)
+            return None
+        return self._make_etag('all_users', shallow, detail, last_txid, user_count, watch_hash, *self._price_etag_parts())
+
+    def get_stock_value_etag(self, symbol_list):
+        if not self._etag_max_age:
+            return None
+        return self._make_etag('stock', ','.join(symbol_list), *self._price_etag_parts(symbol_list))
 
     def register_user(self, user_id, display_name, api_key):
         user = self._get_user(user_id)
@@ -491,6 +909,7 @@ class OttoBroker():
         if self._cur_db.broker_create_user(user_id, display_name, api_key) is None:
             return self.return_failure('User could not be created. Ensure you have a valid API key')
 
+        self._invalidate_user(user_id)
         user = self._get_user(user_id)
         return {
             self.STATUS_KEY: self.STATUS_SUCCESS,
@@ -501,27 +920,32 @@ class OttoBroker():
         if not self._is_valid_api_user(api_key):
             return self.return_failure('Invalid api_key', do_log=False)
         
-        if self._test_mode:
-            self._test_mode = False
-            self._cur_db = self._db
-        else:
-            self._test_mode = True
-            self._cur_db = self._test_db
+        with self._mode_lock:
+            if self._test_mode:
+                self._test_mode = False
+                self._cur_db = self._db
+            else:
+                self._test_mode = True
+                self._cur_db = self._test_db
+            self.load_watch_alerts()
+            self.load_orders()
         return {
             self.STATUS_KEY: self.STATUS_SUCCESS,
             'test_mode': self._test_mode
         }
 
-    def set_watch(self, user_id, symbol, api_key):
+    def set_watch(self, user_id, symbol, api_key, user=None, stock_val=None):
         if not self._is_valid_api_user(api_key):
             return self.return_failure('Invalid api_key', do_log=False)
 
-        user = self._get_user(user_id)
+        if user is None:
+            user = self._get_user(user_id)
 
         if not user:
             return self.return_failure('Invalid user_id: {}'.format(user_id), do_log=False)
 
-        stock_val = self.get_stock_value([symbol])
+        if stock_val is None:
+            stock_val = self.get_stock_value([symbol])
 
         if stock_val[self.STATUS_KEY] != self.STATUS_SUCCESS:
             # don't need to log here, because the error is presumably also logged in get_stock_value
@@ -540,7 +964,9 @@ class OttoBroker():
         else:
             if not self._cur_db.broker_create_watch(user.id, symbol, watch_cost):
                 return self.return_failure('Failed creating watch. Go yell at otto')
+        self._watch_alerts.set_watch(user.id, symbol, watch_cost)
         
+        self._invalidate_user(user_id)
         user = self._get_user(user_id)
 
         return {
@@ -559,12 +985,345 @@ class OttoBroker():
         
         if symbol in user.watches:
             self._cur_db.broker_remove_watch(user.id, symbol)
+            self._watch_alerts.remove_watch(user.id, symbol)
         else:
             return self.return_failure('No matching watch to remove', do_log=False)
         
+        self._invalidate_user(user_id)
         user = self._get_user(user_id)
 
         return {
             self.STATUS_KEY: self.STATUS_SUCCESS,
             'user': self._get_full_user_dict(user)
         }
+
+    def load_watch_alerts(self):
+        return self._watch_alerts.load(self._cur_db.broker_get_all_watches())
+
+    def get_watch_alerts(self, since, user_id=None, timeout=None):
+        if not isinstance(since, int):
+            return self.return_failure('since must be an int', do_log=False)
+
+        alerts, cursor = self._watch_alerts.wait_for_alerts(since, user_id=user_id, timeout=timeout)
+        return {
+            self.STATUS_KEY: self.STATUS_SUCCESS,
+            'alerts': alerts,
+            'cursor': cursor
+        }
+
+    def start_profile(self, admin_key=None):
+        # an admin api key forces profiling, otherwise the request is sampled
+        forced = admin_key is not None and self._is_valid_api_user(admin_key)
+        return self._profiler.start(forced=forced)
+
+    def finish_profile(self, handle, name, args):
+        return self._profiler.finish(handle, name, args)
+
+    def start_jobs(self):
+        # resting orders only trigger on fresh prices, so their symbols are re-quoted even when nobody asks for them
+        if self._order_refresh_interval > 0:
+            self._scheduler.add_job('refresh_order_prices', self._order_refresh_interval, self._refresh_order_prices)
+            self._scheduler.start()
+        # likewise for armed watches, which would otherwise only alert when someone happens to quote the symbol
+        if self._watch_refresh_interval > 0:
+            self._scheduler.add_job('refresh_watch_prices', self._watch_refresh_interval, self._refresh_watch_prices)
+            self._scheduler.start()
+
+        if self._maintenance_api_key is None:
+            _logger.warning('no maintenance_api_key configured, scheduled jobs are disabled')
+            return
+        self._scheduler.add_job('cover_expired_shorts', self._expired_shorts_interval, self._cover_expired_shorts)
+        if self._borrow_fee_daily_rate > 0:
+            self._scheduler.add_job('charge_borrow_fees', self._borrow_fee_interval, self._charge_borrow_fees)
+        self._scheduler.start()
+
+    def _cover_expired_shorts(self):
+        # maintenance always works on the live book, so it follows the real market hours even in test mode
+        if not self._is_market_hours():
+            return 0
+        tickers = self._db.broker_get_expired_short_tickers(self._short_max_age)
+        if not tickers:
+            return 0
+
+        # one quote batch for every ticker; shorts whose price can't be fetched wait for the next run
+        quotes = self.get_stock_value(tickers)
+        prices = {t: quotes[t][self.VALUE_KEY] for t in tickers if quotes[t][self.STATUS_KEY] == self.STATUS_SUCCESS}
+        if not prices:
+            return 0
+
+        rows = self._db.broker_cover_expired_shorts(prices, self._short_max_age, self._maintenance_api_key)
+        self._invalidate_user(*set([row[0] for row in rows]), backend='live')
+        return sum([row[2] for row in rows])
+
+    def _charge_borrow_fees(self):
+        rows = self._db.broker_charge_borrow_fees(self._borrow_fee_daily_rate, self._maintenance_api_key)
+        self._invalidate_user(*set([row[0] for row in rows]), backend='live')
+        return len(rows)
+
+    def get_jobs(self):
+        return {
+            self.STATUS_KEY: self.STATUS_SUCCESS,
+            'jobs': self._scheduler.get_stats()
+        }
+
+    def run_job(self, name, api_key):
+        if not self._is_valid_api_user(api_key):
+            return self.return_failure('Invalid api_key', do_log=False)
+
+        stats = self._scheduler.run_job(name)
+        if stats is None:
+            return self.return_failure('Unknown or already running job: {}'.format(name), do_log=False)
+
+        return {
+            self.STATUS_KEY: self.STATUS_SUCCESS,
+            'job': stats
+        }
+
+    def load_orders(self):
+        interrupted = self._cur_db.broker_interrupt_filling_orders()
+        if interrupted:
+            _logger.error('orders {} were executing when the broker stopped; check them by hand'.format(interrupted))
+        loaded = self._order_book.load(self._cur_db.broker_get_open_orders())
+        self._order_book.start()
+        return loaded
+
+    def _refresh_order_prices(self):
+        symbols = self._order_book.symbols()
+        if symbols and self.is_market_live():
+            self.get_stock_value(symbols)
+        return len(symbols)
+
+    def _refresh_watch_prices(self):
+        symbols = self._watch_alerts.symbols()
+        if symbols and self.is_market_live():
+            self.get_stock_value(symbols)
+        return len(symbols)
+
+    def _fill_order(self, order, price):
+        # runs under _mode_lock, so db is also the backend the trade below goes through
+        db = self._cur_db
+        if not self.is_market_live():
+            # the market closed between the tick and now, so the order goes back to resting
+            self._order_book.add(order)
+            return
+        if not db.broker_claim_order(order.id):
+            # cancelled while it was queued
+            return
+
+        trade_func = {
+            'buy_long': self.buy_long,
+            'sell_long': self.sell_long,
+            'buy_short': self.buy_short,
+            'sell_short': self.sell_short
+        }[order.action]
+        # execute at the tick that triggered the order, through the same checks as a market order
+        stock_val = {
+            self.STATUS_KEY: self.STATUS_SUCCESS,
+            order.ticker_symbol: {
+                self.STATUS_KEY: self.STATUS_SUCCESS,
+                self.VALUE_KEY: price,
+                self.STALE_KEY: False
+            }
+        }
+        try:
+            result = trade_func(order.ticker_symbol, order.quantity, order.user_id, order.api_key, stock_val=stock_val)
+        except Exception as e:
+            _logger.exception(e)
+            result = self.return_failure('order execution raised an error', do_log=False)
+
+        if result[self.STATUS_KEY] == self.STATUS_SUCCESS:
+            db.broker_close_order(order.id, 'FILLED', price, None)
+            _logger.info('filled order {}: {} {} {} at {}'.format(order.id, order.action, order.quantity, order.ticker_symbol, price))
+        else:
+            db.broker_close_order(order.id, 'REJECTED', None, result.get(self.MESSAGE_KEY, '')[:256])
+
+    def place_order(self, user_id, symbol, action, order_type, trigger_price, quantity, api_key):
+        if not self._is_valid_api_user(api_key):
+            return self.return_failure('Invalid api_key', do_log=False)
+
+        user = self._get_user(user_id, shallow=True)
+        if not user:
+            return self.return_failure('Invalid user_id: {}'.format(user_id), do_log=False)
+        if action not in OrderBook.BUY_ACTIONS + OrderBook.SELL_ACTIONS:
+            return self.return_failure('action must be one of {}'.format(', '.join(OrderBook.BUY_ACTIONS + OrderBook.SELL_ACTIONS)), do_log=False)
+        if order_type not in OrderBook.ORDER_TYPES:
+            return self.return_failure('type must be one of {}'.format(', '.join(OrderBook.ORDER_TYPES)), do_log=False)
+        if not isinstance(quantity, int):
+            return self.return_failure('Quantity, \'{}\' must be an int'.format(quantity), do_log=False)
+        if quantity < 1:
+            return self.return_failure('Orders need a quantity of at least 1', do_log=False)
+        if not isinstance(trigger_price, Decimal) or trigger_price <= 0:
+            return self.return_failure('price must be a positive Decimal', do_log=False)
+
+        order = self._cur_db.broker_create_order(user.id, symbol, action, order_type, trigger_price, quantity, api_key)
+        if order is None:
+            return self.return_failure('placing the order failed. Ensure you have a valid API key')
+        self._order_book.add(order)
+
+        return {
+            self.STATUS_KEY: self.STATUS_SUCCESS,
+            'order': order.to_dict()
+        }
+
+    def cancel_order(self, order_id, user_id, api_key):
+        if not self._is_valid_api_user(api_key):
+            return self.return_failure('Invalid api_key', do_log=False)
+
+        if not self._cur_db.broker_cancel_order(order_id, user_id):
+            return self.return_failure('No open order {} for user {}'.format(order_id, user_id), do_log=False)
+        self._order_book.remove(order_id)
+
+        return {
+            self.STATUS_KEY: self.STATUS_SUCCESS,
+            'order_id': order_id
+        }
+
+    def get_orders(self, user_id):
+        return {
+            self.STATUS_KEY: self.STATUS_SUCCESS,
+            'orders': [o.to_dict() for o in self._cur_db.broker_get_orders_by_user(user_id, self._max_listed_orders)]
+        }
+
+    def start_warm_up(self, budget):
+        # warms up in the background so the server listens meanwhile; get_readiness reports the progress
+        if budget <= 0:
+            # no warm-up, but the broker can't serve resting orders or watches without loading them
+            with self._mode_lock:
+                self.load_watch_alerts()
+                self.load_orders()
+            with self._readiness_lock:
+                self._readiness['state'] = self.READINESS_READY
+            return None
+        thread = threading.Thread(target=self.warm_up, args=(budget,), name='warm-up', daemon=True)
+        thread.start()
+        return thread
+
+    def warm_up(self, budget):
+        started = time.monotonic()
+        deadline = started + budget
+        with self._readiness_lock:
+            self._warm_up_deadline = deadline
+            self._readiness = {
+                'state': self.READINESS_WARMING,
+                'budget': budget,
+                'steps': collections.OrderedDict()
+            }
+
+        # nothing else can work without the database, the later steps only save first requests some latency
+        ready = self._warm_up_step('database', deadline, self._warm_up_database)
+        if ready:
+            ready = self._warm_up_step('watch_alerts', deadline, self._warm_up_watch_alerts)
+            ready = self._warm_up_step('orders', deadline, self._warm_up_orders) and ready
+        if ready:
+            self._warm_up_step('api_keys', deadline, self._warm_up_api_keys)
+            self._warm_up_step('connections', deadline, self._warm_up_connections)
+            self._warm_up_step('quotes', deadline, self._warm_up_quotes)
+
+        with self._readiness_lock:
+            self._readiness['state'] = self.READINESS_READY if ready else self.READINESS_FAILED
+            self._readiness['elapsed'] = round(time.monotonic() - started, 3)
+            _logger.info('warm up finished in {}s: {}'.format(self._readiness['elapsed'], self._readiness['state']))
+        return ready
+
+    def _warm_up_step(self, name, deadline, step):
+        if time.monotonic() >= deadline:
+            with self._readiness_lock:
+                self._readiness['steps'][name] = {self.STATUS_KEY: 'skipped'}
+            return False
+
+        with self._readiness_lock:
+            self._readiness['steps'][name] = {self.STATUS_KEY: 'running'}
+        started = time.monotonic()
+        try:
+            result = {self.STATUS_KEY: self.STATUS_SUCCESS}
+            result.update(step(deadline))
+        except Exception as e:
+            _logger.exception(e)
+            result = {self.STATUS_KEY: self.STATUS_ERROR, self.MESSAGE_KEY: str(e)}
+        result['elapsed'] = round(time.monotonic() - started, 3)
+
+        with self._readiness_lock:
+            self._readiness['steps'][name] = result
+        return result[self.STATUS_KEY] == self.STATUS_SUCCESS
+
+    def _warm_up_database(self, deadline):
+        lookup_ids = self._cur_db.broker_get_lookup_ids()
+        missing = [name for name in ('LONG', 'SHORT') if name not in lookup_ids['fakestocktypes']]
+        missing += [name for name in ('BUY', 'SELL', 'CAPITAL') if name not in lookup_ids['faketransactiontypes']]
+        if missing:
+            raise Exception('Missing lookup rows {}, was createDB.sql run?'.format(', '.join(missing)))
+        return {'lookup_ids': lookup_ids}
+
+    def _warm_up_watch_alerts(self, deadline):
+        # same lock as toggle_test_mode, so a toggle can't swap the backend halfway through the load
+        with self._mode_lock:
+            return {'watches': self.load_watch_alerts()}
+
+    def _warm_up_orders(self, deadline):
+        with self._mode_lock:
+            return {'orders': self.load_orders()}
+
+    def _warm_up_api_keys(self, deadline):
+        api_users = self._cur_db.broker_get_api_users()
+        now = time.monotonic()
+        self._api_keys[self._backend_name()].update([(api_user.api_key, now) for api_user in api_users])
+        return {'api_keys': len(api_users)}
+
+    def _warm_up_connections(self, deadline):
+        # running the hot reads once records their statements, warm_up then prepares them on every pooled connection
+        user_ids = self._cur_db.broker_get_all_user_ids()
+        if user_ids:
+            self._load_user(user_ids[0])
+            self._cur_db.broker_get_position_summaries(user_ids[0])
+            self._cur_db.broker_get_user_state(user_ids[0])
+        for api_key in list(self._api_keys[self._backend_name()])[:1]:
+            self._cur_db.broker_get_single_api_users(api_key)
+        return self._cur_db.warm_up(deadline)
+
+    def _warm_up_quotes(self, deadline):
+        # fills the last known prices valuations fall back on and checks the quote api answers
+        symbols = self._cur_db.broker_get_held_tickers()
+        if not symbols:
+            return {'symbols': 0, 'priced': 0}
+        quotes = self._quotes.get_quotes(symbols)
+        priced = len([quote for quote in quotes.values() if not isinstance(quote, QuoteFailure)])
+        if not priced:
+            raise Exception('No prices for any of {} held symbols'.format(len(symbols)))
+        return {'symbols': len(symbols), 'priced': priced}
+
+    def get_readiness(self):
+        with self._readiness_lock:
+            readiness = copy.deepcopy(self._readiness)
+            deadline = self._warm_up_deadline
+
+        # a step stuck past the budget doesn't hold up serving once the required steps checked out
+        over_budget = deadline is not None and time.monotonic() > deadline
+        required_ok = all(readiness['steps'].get(name, {}).get(self.STATUS_KEY) == self.STATUS_SUCCESS
+                          for name in self.REQUIRED_WARM_UP_STEPS)
+        readiness['ready'] = readiness['state'] == self.READINESS_READY or (
+            readiness['state'] == self.READINESS_WARMING and over_budget and required_ok)
+        readiness['over_budget'] = over_budget and readiness['state'] == self.READINESS_WARMING
+        readiness[self.STATUS_KEY] = self.STATUS_SUCCESS
+        return readiness
+
+    def get_profiles(self, api_key):
+        if not self._is_valid_api_user(api_key):
+            return self.return_failure('Invalid api_key', do_log=False)
+
+        return {
+            self.STATUS_KEY: self.STATUS_SUCCESS,
+            'profiles': self._profiler.list_profiles()
+        }
+
+    def get_profile(self, api_key, profile_id):
+        if not self._is_valid_api_user(api_key):
+            return self.return_failure('Invalid api_key', do_log=False)
+
+        profile = self._profiler.get_profile(profile_id)
+        if profile is None:
+            return self.return_failure('No profile with id {}'.format(profile_id), do_log=False)
+
+        return {
+            self.STATUS_KEY: self.STATUS_SUCCESS,
+            'profile': profile
+        }
@@ -0,0 +1,59 @@
+import logging
+import threading
+import time
+
+_logger = logging.getLogger()
+
+
+class CircuitBreaker():
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=30, clock=time.monotonic):
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_progress = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def allow(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self._reset_timeout:
+                self._state = self.HALF_OPEN
+                self._trial_in_progress = False
+            if self._state == self.HALF_OPEN and not self._trial_in_progress:
+                # let a single call through to find out whether the upstream recovered
+                self._trial_in_progress = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                _logger.info('Circuit {} closed'.format(self.name))
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_progress = False
+            if self._state == self.HALF_OPEN or self._failures >= self._failure_threshold:
+                if self._state != self.OPEN:
+                    _logger.error('Circuit {} opened after {} failures'.format(self.name, self._failures))
+                self._state = self.OPEN
+                self._opened_at = self._clock()
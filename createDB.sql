@@ -48,19 +48,69 @@ CREATE TABLE ottobroker.fakestocks(
     expiration TIMESTAMP,
     sell_cost NUMERIC(100, 2),
     sold TIMESTAMP, 
+    borrow_charged TIMESTAMP,
     PRIMARY KEY(id),
     FOREIGN KEY(stocktypeid) REFERENCES ottobroker.fakestocktypes(id),
     FOREIGN KEY(userid) REFERENCES ottobroker.users(id),
     FOREIGN KEY(txid) REFERENCES ottobroker.faketransactions(id)
 );
+-- lots move here from fakestocks once they are closed (sold longs, bought back shorts)
+CREATE TABLE ottobroker.closedstocks(
+    id int NOT NULL,
+    stocktypeid int NOT NULL,
+    userid varchar(256) NOT NULL,
+    txid int NOT NULL,
+    closetxid int,
+    ticker varchar(10) NOT NULL,
+    purchase_cost NUMERIC(100, 2),
+    purchased TIMESTAMP,
+    expiration TIMESTAMP,
+    sell_cost NUMERIC(100, 2),
+    sold TIMESTAMP, 
+    PRIMARY KEY(id),
+    FOREIGN KEY(stocktypeid) REFERENCES ottobroker.fakestocktypes(id),
+    FOREIGN KEY(userid) REFERENCES ottobroker.users(id),
+    FOREIGN KEY(txid) REFERENCES ottobroker.faketransactions(id),
+    FOREIGN KEY(closetxid) REFERENCES ottobroker.faketransactions(id)
+);
+-- serves max(id) per user for conditional GETs without touching the table
+CREATE INDEX faketransactions_userid_id_idx ON ottobroker.faketransactions(userid, id);
+CREATE INDEX fakestocks_userid_ticker_idx ON ottobroker.fakestocks(userid, ticker);
+CREATE INDEX closedstocks_userid_idx ON ottobroker.closedstocks(userid);
+-- open shorts are the only lots without a purchase time; the maintenance jobs scan just these
+CREATE INDEX fakestocks_open_shorts_idx ON ottobroker.fakestocks(ticker) WHERE purchased IS NULL;
 CREATE TABLE ottobroker.watches(
     id serial NOT NULL,
     userid varchar(256) NOT NULL,
     ticker varchar(10) NOT NULL,
     watch_cost NUMERIC(100, 2) NOT NULL,
+    -- set once the watch alerted; it stays quiet until set_watch moves it
+    alerted TIMESTAMP,
     PRIMARY KEY(id),
     FOREIGN KEY(userid) REFERENCES ottobroker.users(id)
 );
 
+-- resting limit and stop orders; open ones are loaded into the in-memory order book at startup
+CREATE TABLE ottobroker.orders(
+    id serial NOT NULL,
+    userid varchar(256) NOT NULL,
+    ticker varchar(10) NOT NULL,
+    action varchar(16) NOT NULL,
+    ordertype varchar(16) NOT NULL,
+    trigger_price NUMERIC(100, 2) NOT NULL,
+    quantity int NOT NULL,
+    status varchar(16) NOT NULL,
+    created TIMESTAMP NOT NULL,
+    closed TIMESTAMP,
+    fill_price NUMERIC(100, 2),
+    message varchar(256),
+    apiuserid int NOT NULL,
+    PRIMARY KEY(id),
+    FOREIGN KEY(userid) REFERENCES ottobroker.users(id),
+    FOREIGN KEY(apiuserid) REFERENCES ottobroker.apiusers(id)
+);
+CREATE INDEX orders_userid_idx ON ottobroker.orders(userid);
+CREATE INDEX orders_open_idx ON ottobroker.orders(id) WHERE status IN ('OPEN', 'FILLING');
+
 INSERT INTO ottobroker.faketransactiontypes (txtype) values ('BUY'), ('SELL'), ('CAPITAL');
 INSERT INTO ottobroker.fakestocktypes (stocktype) values ('LONG'), ('SHORT');
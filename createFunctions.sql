@@ -21,20 +21,21 @@ LANGUAGE 'plpgsql' VOLATILE;
 CREATE OR REPLACE FUNCTION ottobroker.givemoney(_user_id varchar(256), _amount numeric(100, 2), _reason varchar(256), _api_key char(32))
 RETURNS int AS $BODY$
     DECLARE 
-        user_exists int = 0;
-        user_balance numeric(100, 2) = 0;
         txtype_id int = -1;
         transaction_id int = null;
         api_user_id int = null;
     BEGIN
-        select count(id) into user_exists from ottobroker.users where id = _user_id;
+        _amount := round(_amount, 2);
         select id into api_user_id from ottobroker.apiusers where apikey = _api_key;
-        if user_exists = 1 AND FOUND THEN
-            select balance into user_balance from ottobroker.users where id =_user_id;
-            update ottobroker.users set balance = user_balance + _amount where id = _user_id;
-            select id into txtype_id from ottobroker.faketransactiontypes where txtype = 'CAPITAL';
-            insert into ottobroker.faketransactions (txtypeid, userid, dollaramount, stockamount, executed, reason, apiuserid)
-            values (txtype_id, _user_id, _amount, 0, now(), _reason, api_user_id) returning id into transaction_id;
+        if api_user_id IS NOT NULL THEN
+            -- update in place so concurrent deposits/withdrawals can't overwrite each other's balance
+            update ottobroker.users set balance = balance + _amount
+            where id = _user_id AND (_amount >= 0 OR balance + _amount >= 0);
+            if FOUND THEN
+                select id into txtype_id from ottobroker.faketransactiontypes where txtype = 'CAPITAL';
+                insert into ottobroker.faketransactions (txtypeid, userid, dollaramount, stockamount, executed, reason, apiuserid)
+                values (txtype_id, _user_id, _amount, 0, now(), _reason, api_user_id) returning id into transaction_id;
+            end if;
         end if;
         return transaction_id;
     END;
@@ -44,29 +45,30 @@ LANGUAGE 'plpgsql' VOLATILE;
 CREATE OR REPLACE FUNCTION ottobroker.buylong(_user_id varchar(256), _ticker varchar(10), _per_cost numeric(100, 2), _quantity int, _api_key char(32))
 RETURNS INTEGER AS $BODY$
     DECLARE
-        total_cost numeric(100, 2) = -1;
-        user_balance numeric(100, 2) = -1;
-        stock_index int = -1;
+        -- plpgsql ignores the (100, 2) of an argument, so the price is rounded to cents before it is multiplied
+        total_cost numeric(100, 2) = _quantity * round(_per_cost, 2);
         transaction_id int = null;
         txtype_id int = -1;
         stocktype_id int = -1;
         _now timestamp = now();
         api_user_id int = null;
     BEGIN
-        select balance into user_balance from ottobroker.users where id = _user_id;
-        total_cost := _quantity * _per_cost;
         select id into api_user_id from ottobroker.apiusers where apikey = _api_key;
-        if user_balance >= total_cost and FOUND THEN
-            update ottobroker.users set balance = user_balance - total_cost where id = _user_id;
-            select id into txtype_id from ottobroker.faketransactiontypes where txtype = 'BUY';
-            select id into stocktype_id from ottobroker.fakestocktypes where stocktype = 'LONG';
-            
-            insert into ottobroker.faketransactions (txtypeid, userid, dollaramount, stockamount, ticker, executed, apiuserid)
-            values (txtype_id, _user_id, total_cost, _quantity, _ticker, _now, api_user_id) returning id into transaction_id;
+        if api_user_id IS NOT NULL THEN
+            -- the balance check and debit happen in one statement under the user's row lock
+            update ottobroker.users set balance = balance - total_cost
+            where id = _user_id AND balance >= total_cost;
+            if FOUND THEN
+                select id into txtype_id from ottobroker.faketransactiontypes where txtype = 'BUY';
+                select id into stocktype_id from ottobroker.fakestocktypes where stocktype = 'LONG';
+                
+                insert into ottobroker.faketransactions (txtypeid, userid, dollaramount, stockamount, ticker, executed, apiuserid)
+                values (txtype_id, _user_id, total_cost, _quantity, _ticker, _now, api_user_id) returning id into transaction_id;
 
-            insert into ottobroker.fakestocks (stocktypeid, userid, txid, ticker, purchase_cost, purchased)
-            select stocktype_id, _user_id, transaction_id, _ticker, _per_cost, _now
-            from generate_series(1, _quantity);
+                insert into ottobroker.fakestocks (stocktypeid, userid, txid, ticker, purchase_cost, purchased)
+                select stocktype_id, _user_id, transaction_id, _ticker, _per_cost, _now
+                from generate_series(1, _quantity);
+            end if;
         end if;
         return transaction_id;
     END;
@@ -76,29 +78,37 @@ LANGUAGE 'plpgsql' VOLATILE;
 CREATE OR REPLACE FUNCTION ottobroker.selllong(_user_id varchar(256), _ticker varchar(10), _per_value numeric(100, 2), _quantity int, _api_key char(32))
 RETURNS INTEGER AS $BODY$
     DECLARE
-        total_value numeric(100, 2) = -1;
-        user_balance NUMERIC(100, 2) = -1;
-        stock_count int = -1;
+        total_value numeric(100, 2) = _quantity * round(_per_value, 2);
         transaction_id int = -1;
         txtype_id int = null;
         stocktype_id int = (select id from ottobroker.fakestocktypes where stocktype = 'LONG');
         _now timestamp = now();
         api_user_id int = null;
-        update_ids int[] := ARRAY(select id from ottobroker.fakestocks where userid = _user_id and sold is null and ticker = _ticker and stocktypeid = stocktype_id order by purchased asc limit _quantity);
+        update_ids int[];
     BEGIN
-        select count(id) into stock_count from ottobroker.fakestocks where userid = _user_id AND ticker = _ticker AND sold is Null AND stocktypeid = stocktype_id;
         select id into api_user_id from ottobroker.apiusers where apikey = _api_key;
-        if stock_count >= _quantity AND FOUND THEN
-            total_value := _quantity * _per_value;
-            select balance into user_balance from ottobroker.users where id = _user_id;
-            update ottobroker.users set balance = user_balance + total_value where id = _user_id;
+        if api_user_id IS NULL THEN
+            return transaction_id;
+        end if;
+
+        -- serialize trades of this user only; lots are picked after the lock so two sells can't take the same lots
+        perform 1 from ottobroker.users where id = _user_id for no key update;
+        update_ids := ARRAY(select id from ottobroker.fakestocks where userid = _user_id and sold is null and ticker = _ticker and stocktypeid = stocktype_id order by purchased asc limit _quantity);
+
+        if coalesce(array_length(update_ids, 1), 0) >= _quantity THEN
+            update ottobroker.users set balance = balance + total_value where id = _user_id;
             select id into txtype_id from ottobroker.faketransactiontypes where txtype = 'SELL';
 
             insert into ottobroker.faketransactions (txtypeid, userid, dollaramount, stockamount, ticker, executed, apiuserid)
             values (txtype_id, _user_id, total_value, _quantity, _ticker, _now, api_user_id) returning id into transaction_id;
 
-            update ottobroker.fakestocks set sold = _now, sell_cost = _per_value
-            where id = ANY(update_ids);
+            with closed as (
+                delete from ottobroker.fakestocks where id = ANY(update_ids)
+                returning id, stocktypeid, userid, txid, ticker, purchase_cost, purchased, expiration
+            )
+            insert into ottobroker.closedstocks (id, stocktypeid, userid, txid, closetxid, ticker, purchase_cost, purchased, expiration, sell_cost, sold)
+            select id, stocktypeid, userid, txid, transaction_id, ticker, purchase_cost, purchased, expiration, _per_value, _now
+            from closed;
         end if;
         return transaction_id;
     END;
@@ -108,30 +118,37 @@ LANGUAGE 'plpgsql' VOLATILE;
 CREATE OR REPLACE FUNCTION ottobroker.buyshort(_user_id varchar(256), _ticker varchar(10), _per_cost numeric(100, 2), _quantity int, _api_key char(32))
 RETURNS INTEGER AS $BODY$
     DECLARE
-        total_cost numeric(100, 2) = -1;
+        total_cost numeric(100, 2) = _quantity * round(_per_cost, 2);
         user_balance numeric(100, 2) = -1;
-        stock_count int = -1;
-        stock_index int = -1;
         transaction_id int = null;
         txtype_id int = -1;
         stocktype_id int = (select id from ottobroker.fakestocktypes where stocktype = 'SHORT');
         _now timestamp = now();
         api_user_id int = null;
-        update_ids int[] = ARRAY(select id from ottobroker.fakestocks where userid = _user_id and purchased is null and ticker = _ticker and stocktypeid = stocktype_id order by sold asc limit _quantity);
+        update_ids int[];
     BEGIN
-        select count(id) into stock_count from ottobroker.fakestocks where userid = _user_id AND ticker = _ticker AND purchased is Null AND stocktypeid = stocktype_id;
-        select balance into user_balance from ottobroker.users where id = _user_id;
-        total_cost := _quantity * _per_cost;
         select id into api_user_id from ottobroker.apiusers where apikey = _api_key;
-        if user_balance >= total_cost AND stock_count >= _quantity AND FOUND THEN
-            update ottobroker.users set balance = user_balance - total_cost where id = _user_id;
+        if api_user_id IS NULL THEN
+            return transaction_id;
+        end if;
+
+        select balance into user_balance from ottobroker.users where id = _user_id for no key update;
+        update_ids := ARRAY(select id from ottobroker.fakestocks where userid = _user_id and purchased is null and ticker = _ticker and stocktypeid = stocktype_id order by sold asc limit _quantity);
+
+        if user_balance >= total_cost AND coalesce(array_length(update_ids, 1), 0) >= _quantity THEN
+            update ottobroker.users set balance = balance - total_cost where id = _user_id;
             select id into txtype_id from ottobroker.faketransactiontypes where txtype = 'BUY';
 
             insert into ottobroker.faketransactions (txtypeid, userid, dollaramount, stockamount, ticker, executed, apiuserid)
             values (txtype_id, _user_id, total_cost, _quantity, _ticker, _now, api_user_id) returning id into transaction_id;
 
-            update ottobroker.fakestocks set purchased = _now, purchase_cost = _per_cost
-            where id = ANY(update_ids);
+            with closed as (
+                delete from ottobroker.fakestocks where id = ANY(update_ids)
+                returning id, stocktypeid, userid, txid, ticker, expiration, sell_cost, sold
+            )
+            insert into ottobroker.closedstocks (id, stocktypeid, userid, txid, closetxid, ticker, purchase_cost, purchased, expiration, sell_cost, sold)
+            select id, stocktypeid, userid, txid, transaction_id, ticker, _per_cost, _now, expiration, sell_cost, sold
+            from closed;
         end if;
         return transaction_id;
     END;
@@ -141,8 +158,7 @@ LANGUAGE 'plpgsql' VOLATILE;
 CREATE OR REPLACE FUNCTION ottobroker.sellshort(_user_id varchar(256), _ticker varchar(10), _per_value numeric(100, 2), _quantity int, _api_key char(32))
 RETURNS INTEGER AS $BODY$
     DECLARE
-        total_value numeric(100, 2) = -1;
-        user_balance NUMERIC(100, 2) = -1;
+        total_value numeric(100, 2) = _quantity * round(_per_value, 2);
         transaction_id int = -1;
         txtype_id int = null;
         stocktype_id int = -1;
@@ -150,21 +166,198 @@ RETURNS INTEGER AS $BODY$
         api_user_id int = null;
     BEGIN
         select id into api_user_id from ottobroker.apiusers where apikey = _api_key;
-        if FOUND THEN
-            total_value := _quantity * _per_value;
-            select balance into user_balance from ottobroker.users where id = _user_id;
-            update ottobroker.users set balance = user_balance + total_value where id = _user_id;
-            select id into txtype_id from ottobroker.faketransactiontypes where txtype = 'SELL';
-            select id into stocktype_id from ottobroker.fakestocktypes where stocktype = 'SHORT';
-            
-            insert into ottobroker.faketransactions (txtypeid, userid, dollaramount, stockamount, ticker, executed, apiuserid)
-            values (txtype_id, _user_id, total_value, _quantity, _ticker, _now, api_user_id) returning id into transaction_id;
+        if api_user_id IS NOT NULL THEN
+            update ottobroker.users set balance = balance + total_value where id = _user_id;
+            if FOUND THEN
+                select id into txtype_id from ottobroker.faketransactiontypes where txtype = 'SELL';
+                select id into stocktype_id from ottobroker.fakestocktypes where stocktype = 'SHORT';
+                
+                insert into ottobroker.faketransactions (txtypeid, userid, dollaramount, stockamount, ticker, executed, apiuserid)
+                values (txtype_id, _user_id, total_value, _quantity, _ticker, _now, api_user_id) returning id into transaction_id;
 
-            insert into ottobroker.fakestocks (stocktypeid, userid, txid, ticker, sell_cost, sold)
-            select stocktype_id, _user_id, transaction_id, _ticker, _per_value, _now
-            from generate_series(1, _quantity);
+                insert into ottobroker.fakestocks (stocktypeid, userid, txid, ticker, sell_cost, sold)
+                select stocktype_id, _user_id, transaction_id, _ticker, _per_value, _now
+                from generate_series(1, _quantity);
+            end if;
         end if;
         return transaction_id;
     END;
     $BODY$
 LANGUAGE 'plpgsql' VOLATILE;
+
+CREATE OR REPLACE FUNCTION ottobroker.givemoneybulk(_user_ids varchar(256)[], _amounts numeric(100, 2)[], _reasons varchar(256)[], _api_key char(32))
+RETURNS TABLE(entry_index int, entry_user_id varchar(256), entry_txid int, entry_status varchar(32)) AS $BODY$
+    DECLARE
+        txtype_id int = (select id from ottobroker.faketransactiontypes where txtype = 'CAPITAL');
+        api_user_id int = null;
+        _now timestamp = now();
+    BEGIN
+        select id into api_user_id from ottobroker.apiusers where apikey = _api_key;
+        if api_user_id IS NULL THEN
+            return;
+        end if;
+
+        -- lock the affected users in a fixed order so concurrent bulk payouts can't deadlock
+        perform 1 from ottobroker.users where id = ANY(_user_ids) order by id for no key update;
+
+        return query
+        with entries as (
+            -- transaction ids are drawn up front so each entry knows the id of its own row
+            select e.ord::int as ord, e.userid, round(e.amount, 2) as amount, e.reason,
+                nextval(pg_get_serial_sequence('ottobroker.faketransactions', 'id'))::int as txid
+            from unnest(_user_ids, _amounts, _reasons) with ordinality as e(userid, amount, reason, ord)
+        ),
+        totals as (
+            select userid, sum(amount) as amount from entries group by userid
+        ),
+        credited as (
+            -- all entries of a user apply together, or none do if they would overdraw the balance
+            update ottobroker.users u set balance = u.balance + t.amount
+            from totals t
+            where u.id = t.userid AND u.balance + t.amount >= 0
+            returning u.id
+        ),
+        inserted as (
+            insert into ottobroker.faketransactions (id, txtypeid, userid, dollaramount, stockamount, executed, reason, apiuserid)
+            select e.txid, txtype_id, e.userid, e.amount, 0, _now, e.reason, api_user_id
+            from entries e join credited c on c.id = e.userid
+            returning id
+        )
+        select e.ord, e.userid, i.id,
+            (case when i.id is not null then 'ok'
+                  when u.id is null then 'unknown_user'
+                  else 'insufficient_funds' end)::varchar(32)
+        from entries e
+        left join inserted i on i.id = e.txid
+        left join ottobroker.users u on u.id = e.userid
+        order by e.ord;
+    END;
+    $BODY$
+LANGUAGE 'plpgsql' VOLATILE;
+
+CREATE OR REPLACE FUNCTION ottobroker.coverexpiredshorts(_tickers varchar(10)[], _prices numeric(100, 2)[], _max_age interval, _api_key char(32))
+RETURNS TABLE(job_user_id varchar(256), job_ticker varchar(10), job_quantity int, job_txid int) AS $BODY$
+    DECLARE
+        txtype_id int = (select id from ottobroker.faketransactiontypes where txtype = 'BUY');
+        stocktype_id int = (select id from ottobroker.fakestocktypes where stocktype = 'SHORT');
+        api_user_id int = null;
+        _now timestamp = now();
+    BEGIN
+        select id into api_user_id from ottobroker.apiusers where apikey = _api_key;
+        if api_user_id IS NULL THEN
+            return;
+        end if;
+
+        -- take the same user row locks as buyshort, in a fixed order, before picking the lots
+        perform 1 from ottobroker.users where id in (
+            select s.userid from ottobroker.fakestocks s
+            where s.stocktypeid = stocktype_id AND s.purchased is null AND s.ticker = ANY(_tickers)
+                AND coalesce(s.expiration, s.sold + _max_age) <= _now
+        ) order by id for no key update;
+
+        return query
+        with prices as (
+            select p.ticker, round(p.price, 2) as price from unnest(_tickers, _prices) as p(ticker, price)
+        ),
+        expired as (
+            -- shorts without an explicit expiration expire _max_age after they were opened
+            select s.id, s.userid, s.ticker, p.price
+            from ottobroker.fakestocks s join prices p on p.ticker = s.ticker
+            where s.stocktypeid = stocktype_id AND s.purchased is null
+                AND coalesce(s.expiration, s.sold + _max_age) <= _now
+        ),
+        covers as (
+            -- one buy transaction per user and ticker, like a buyshort of every expired lot
+            select e.userid, e.ticker, e.price, count(*)::int as quantity,
+                nextval(pg_get_serial_sequence('ottobroker.faketransactions', 'id'))::int as txid
+            from expired e
+            group by e.userid, e.ticker, e.price
+        ),
+        debited as (
+            -- a forced cover goes through even if it overdraws the account
+            update ottobroker.users u set balance = u.balance - t.cost
+            from (select userid, sum(price * quantity) as cost from covers group by userid) t
+            where u.id = t.userid
+            returning u.id
+        ),
+        inserted as (
+            insert into ottobroker.faketransactions (id, txtypeid, userid, dollaramount, stockamount, ticker, executed, reason, apiuserid)
+            select c.txid, txtype_id, c.userid, c.price * c.quantity, c.quantity, c.ticker, _now, 'short expired', api_user_id
+            from covers c
+            returning id
+        ),
+        closed as (
+            delete from ottobroker.fakestocks s using expired e where s.id = e.id
+            returning s.id, s.stocktypeid, s.userid, s.txid, s.ticker, s.expiration, s.sell_cost, s.sold
+        ),
+        archived as (
+            insert into ottobroker.closedstocks (id, stocktypeid, userid, txid, closetxid, ticker, purchase_cost, purchased, expiration, sell_cost, sold)
+            select c.id, c.stocktypeid, c.userid, c.txid, v.txid, c.ticker, v.price, _now, c.expiration, c.sell_cost, c.sold
+            from closed c join covers v on v.userid = c.userid AND v.ticker = c.ticker
+            returning id
+        )
+        select c.userid, c.ticker, c.quantity, c.txid
+        from covers c
+        order by c.userid, c.ticker;
+    END;
+    $BODY$
+LANGUAGE 'plpgsql' VOLATILE;
+
+CREATE OR REPLACE FUNCTION ottobroker.chargeborrowfees(_daily_rate numeric, _api_key char(32))
+RETURNS TABLE(job_user_id varchar(256), job_fee numeric(100, 2), job_txid int) AS $BODY$
+    DECLARE
+        txtype_id int = (select id from ottobroker.faketransactiontypes where txtype = 'CAPITAL');
+        stocktype_id int = (select id from ottobroker.fakestocktypes where stocktype = 'SHORT');
+        api_user_id int = null;
+        _now timestamp = now();
+    BEGIN
+        select id into api_user_id from ottobroker.apiusers where apikey = _api_key;
+        if api_user_id IS NULL THEN
+            return;
+        end if;
+
+        perform 1 from ottobroker.users where id in (
+            select s.userid from ottobroker.fakestocks s
+            where s.stocktypeid = stocktype_id AND s.purchased is null
+        ) order by id for no key update;
+
+        return query
+        with accrued as (
+            -- the fee accrues on the short sale price from the sale, or the previous charge, until now
+            select s.id, s.userid,
+                s.sell_cost * _daily_rate * extract(epoch from (_now - coalesce(s.borrow_charged, s.sold))) / 86400 as fee
+            from ottobroker.fakestocks s
+            where s.stocktypeid = stocktype_id AND s.purchased is null
+        ),
+        totals as (
+            -- users owing less than a cent are skipped and keep accruing until the next run
+            select a.userid, round(sum(a.fee), 2) as fee,
+                nextval(pg_get_serial_sequence('ottobroker.faketransactions', 'id'))::int as txid
+            from accrued a
+            group by a.userid
+            having round(sum(a.fee), 2) > 0
+        ),
+        charged as (
+            update ottobroker.fakestocks s set borrow_charged = _now
+            from accrued a join totals t on t.userid = a.userid
+            where s.id = a.id
+            returning s.id
+        ),
+        debited as (
+            update ottobroker.users u set balance = u.balance - t.fee
+            from totals t
+            where u.id = t.userid
+            returning u.id
+        ),
+        inserted as (
+            insert into ottobroker.faketransactions (id, txtypeid, userid, dollaramount, stockamount, executed, reason, apiuserid)
+            select t.txid, txtype_id, t.userid, -t.fee, 0, _now, 'short borrow fee', api_user_id
+            from totals t
+            returning id
+        )
+        select t.userid, t.fee::numeric(100, 2), t.txid
+        from totals t
+        order by t.userid;
+    END;
+    $BODY$
+LANGUAGE 'plpgsql' VOLATILE;
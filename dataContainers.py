@@ -1,4 +1,6 @@
+import hashlib
 import logging
+from decimal import Decimal, ROUND_HALF_UP
 
 _logger = logging.getLogger()
 
@@ -19,6 +21,21 @@ class BrokerUser():
         self.shorts = dict()
         self.historical_shorts = dict()
         self.watches = dict()
+        self._fingerprint = None
+
+    def symbols(self):
+        return set(self.longs) | set(self.historical_longs) | set(self.shorts) | set(self.historical_shorts) | set(self.watches)
+
+    def fingerprint(self):
+        # digest of everything to_dict shows besides prices. cached snapshots are never modified, so it is computed once
+        if self._fingerprint is None:
+            parts = [self.id, self.created, self.display_name, self.balance]
+            for positions in [self.longs, self.historical_longs, self.shorts, self.historical_shorts]:
+                for symbol in sorted(positions):
+                    parts.append((symbol, sorted([repr(stock.to_dict()) for stock in positions[symbol]])))
+            parts.append([(symbol, self.watches[symbol].watch_cost) for symbol in sorted(self.watches)])
+            self._fingerprint = hashlib.md5(repr(parts).encode()).hexdigest()
+        return self._fingerprint
     
     def to_dict(self, assets, liabilities, stock_vals, shallow=False):
         result = {
@@ -44,7 +61,7 @@ class BrokerUser():
             historical_short_dict = self._get_stock_dict(self.historical_shorts, stock_vals, True)
             
             for symbol in self.watches:
-                watch_dict[symbol] = self.watches[symbol].watch_cost
+                watch_dict[symbol] = self._get_watch_dict(self.watches[symbol], stock_vals.get(symbol, {}))
 
         result['historical_holdings'] = historical_long_dict
         result['holdings'] = long_dict
@@ -58,18 +75,79 @@ class BrokerUser():
     def _get_stock_dict(stock_dict, stock_vals, is_historical):
         result = {}
         for symbol in stock_dict:
+            stock_val = stock_vals.get(symbol, {})
             result[symbol] = {
-                'name': stock_vals[symbol]['name'],
+                'name': stock_val.get('name'),
                 'stocks': [x.to_dict() for x in stock_dict[symbol]],
                 'stock_count': sum([x.count for x in stock_dict[symbol]])
             }
 
             if not is_historical:
-                result[symbol]['per_value'] = stock_vals[symbol]['value']
-                result[symbol]['total_value'] = sum([x.count for x in stock_dict[symbol]]) * stock_vals[symbol]['value']
+                # per_value is None when no price, not even a stale one, is available
+                per_value = stock_val.get('value')
+                result[symbol]['per_value'] = per_value
+                result[symbol]['total_value'] = None if per_value is None else result[symbol]['stock_count'] * per_value
+                result[symbol]['stale'] = stock_val.get('stale', True)
+                result[symbol]['price_age'] = stock_val.get('price_age')
         
         return result
 
+    @staticmethod
+    def _get_watch_dict(watch, stock_val):
+        # priced from the same quote batch as the holdings; the change fields are None when no price is available
+        current_price = stock_val.get('value')
+        change = None if current_price is None else current_price - watch.watch_cost
+        return {
+            'watch_cost': watch.watch_cost,
+            'current_price': current_price,
+            'change': change,
+            'percent_change': (change * 100 / watch.watch_cost).quantize(Decimal('.01'), rounding=ROUND_HALF_UP) if change is not None and watch.watch_cost else None,
+            'stale': stock_val.get('stale', True)
+        }
+
+class BrokerPositionSummary():
+    def __init__(self, raw):
+        self.user_id = raw[0]
+        self.ticker_symbol = raw[1]
+        self.long_count = int(raw[2])
+        self.long_cost = raw[3]
+        self.short_count = int(raw[4])
+        self.short_proceeds = raw[5]
+        self.realized_pnl = raw[6]
+        self.closed_count = int(raw[7])
+
+    @property
+    def is_open(self):
+        return self.long_count > 0 or self.short_count > 0
+
+    def to_dict(self, stock_val):
+        # without any price, not even a stale one, open lots are valued at what they traded for
+        price = stock_val.get('value')
+        long_value = self.long_cost if price is None else price * self.long_count
+        short_value = self.short_proceeds if price is None else price * self.short_count
+        return {
+            'name': stock_val.get('name'),
+            'current_price': price,
+            'stale': stock_val.get('stale', True),
+            'long_count': self.long_count,
+            'long_cost_basis': self.long_cost,
+            'average_cost': self._average(self.long_cost, self.long_count),
+            'long_value': long_value,
+            'short_count': self.short_count,
+            'short_proceeds': self.short_proceeds,
+            'average_short_price': self._average(self.short_proceeds, self.short_count),
+            'short_value': short_value,
+            'unrealized_pnl': None if price is None and self.is_open else (long_value - self.long_cost) + (self.short_proceeds - short_value),
+            'realized_pnl': self.realized_pnl,
+            'closed_count': self.closed_count
+        }
+
+    @staticmethod
+    def _average(total, count):
+        if not count:
+            return None
+        return (total / count).quantize(Decimal('.01'), rounding=ROUND_HALF_UP)
+
 class BrokerStock():
     def __init__(self, raw):
         self.stock_type = raw[0]
@@ -94,9 +172,43 @@ class BrokerWatch():
         self.user_id = raw[1]
         self.ticker_symbol = raw[2]
         self.watch_cost = raw[3]
+        self.alerted = raw[4]
 
     def to_dict(self):
         return {
             'symbol': self.ticker_symbol,
             'watch_cost': self.watch_cost
-        }
\ No newline at end of file
+        }
+
+class BrokerOrder():
+    def __init__(self, raw):
+        self.id = raw[0]
+        self.user_id = raw[1]
+        self.ticker_symbol = raw[2]
+        self.action = raw[3]
+        self.order_type = raw[4]
+        self.trigger_price = raw[5]
+        self.quantity = raw[6]
+        self.status = raw[7]
+        self.created = raw[8]
+        self.closed = raw[9]
+        self.fill_price = raw[10]
+        self.message = raw[11]
+        # the key of the api user that placed the order, used when it executes; never returned to clients
+        self.api_key = raw[12]
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'symbol': self.ticker_symbol,
+            'action': self.action,
+            'type': self.order_type,
+            'price': self.trigger_price,
+            'quantity': self.quantity,
+            'status': self.status,
+            'created': self.created,
+            'closed': self.closed,
+            'fill_price': self.fill_price,
+            'message': self.message
+        }
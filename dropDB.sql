@@ -4,7 +4,12 @@ DROP FUNCTION ottobroker.buylong;
 DROP FUNCTION ottobroker.selllong;
 DROP FUNCTION ottobroker.buyshort;
 DROP FUNCTION ottobroker.sellshort;
+DROP FUNCTION ottobroker.givemoneybulk;
+DROP FUNCTION ottobroker.coverexpiredshorts;
+DROP FUNCTION ottobroker.chargeborrowfees;
 DROP TABLE ottobroker.watches;
+DROP TABLE ottobroker.orders;
+DROP TABLE ottobroker.closedstocks;
 DROP TABLE ottobroker.fakestocks;
 DROP TABLE ottobroker.fakestocktypes;
 DROP TABLE ottobroker.faketransactions;
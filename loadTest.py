@@ -0,0 +1,333 @@
+import argparse
+import collections
+import configparser
+import datetime
+import io
+import random
+import threading
+import time
+import urllib.parse
+
+import psycopg2
+
+from benchUtil import percentile, get_json
+from stubQuoteServer import StubQuoteServer
+
+USER_PREFIX = 'load_'
+SEED_REASON = 'load test seed'
+COPY_BATCH_ROWS = 100000
+ID_BLOCK_SIZE = 10000
+
+DEFAULT_MIX = 'user_info=40,stock_info=10,all_users=2,buy_long=15,sell_long=10,buy_short=8,sell_short=5,deposit=5,set_watch=5'
+
+
+def symbol_universe(count):
+    return ['LT{:04d}'.format(i) for i in range(count)]
+
+
+class IdBlock():
+    # hands out ids from a serial sequence, reserving them a block at a time so COPY rows can carry their own ids
+    def __init__(self, cursor, table):
+        self._cursor = cursor
+        self._table = table
+        self._next = 0
+        self._end = 0
+
+    def next(self):
+        if self._next >= self._end:
+            self._cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id'));", [self._table])
+            self._next = self._cursor.fetchone()[0]
+            self._end = self._next + ID_BLOCK_SIZE
+            self._cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), %s);", [self._table, self._end])
+        value = self._next
+        self._next += 1
+        return value
+
+
+class CopyBuffer():
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = columns
+        self.rows = 0
+        self.total = 0
+        self._buffer = io.StringIO()
+
+    def add(self, *values):
+        self._buffer.write('\t'.join(['\\N' if v is None else str(v) for v in values]) + '\n')
+        self.rows += 1
+
+    def flush(self, cursor):
+        if not self.rows:
+            return
+        self._buffer.seek(0)
+        cursor.copy_expert('COPY {} ({}) FROM STDIN'.format(self.table, ', '.join(self.columns)), self._buffer)
+        self.total += self.rows
+        self.rows = 0
+        self._buffer = io.StringIO()
+
+
+class Seeder():
+    def __init__(self, connection, api_key, symbols, rng):
+        self._connection = connection
+        self._cursor = connection.cursor()
+        self._symbols = symbols
+        self._rng = rng
+
+        self._cursor.execute('SELECT id FROM ottobroker.apiusers WHERE apikey=%s;', [api_key])
+        row = self._cursor.fetchone()
+        if row is None:
+            raise SystemExit('unknown api key')
+        self._api_user_id = row[0]
+
+        self._cursor.execute('SELECT txtype, id FROM ottobroker.faketransactiontypes;')
+        self._txtypes = dict(self._cursor.fetchall())
+        self._cursor.execute('SELECT stocktype, id FROM ottobroker.fakestocktypes;')
+        self._stocktypes = dict(self._cursor.fetchall())
+
+        self._tx_ids = IdBlock(self._cursor, 'ottobroker.faketransactions')
+        # closed lots keep the id they had in fakestocks, so both tables draw from its sequence
+        self._lot_ids = IdBlock(self._cursor, 'ottobroker.fakestocks')
+
+        # flushed in this order so foreign keys always point at rows that are already there
+        self._users = CopyBuffer('ottobroker.users', ['id', 'created', 'displayname', 'balance'])
+        self._transactions = CopyBuffer('ottobroker.faketransactions',
+            ['id', 'txtypeid', 'userid', 'dollaramount', 'stockamount', 'ticker', 'executed', 'reason', 'apiuserid'])
+        self._open = CopyBuffer('ottobroker.fakestocks',
+            ['id', 'stocktypeid', 'userid', 'txid', 'ticker', 'purchase_cost', 'purchased', 'expiration', 'sell_cost', 'sold'])
+        self._closed = CopyBuffer('ottobroker.closedstocks',
+            ['id', 'stocktypeid', 'userid', 'txid', 'closetxid', 'ticker', 'purchase_cost', 'purchased', 'expiration', 'sell_cost', 'sold'])
+        self._watches = CopyBuffer('ottobroker.watches', ['userid', 'ticker', 'watch_cost'])
+        self._buffers = [self._users, self._transactions, self._open, self._closed, self._watches]
+
+    def first_free_index(self):
+        self._cursor.execute("SELECT count(*) FROM ottobroker.users WHERE id LIKE %s;", [USER_PREFIX + '%'])
+        return self._cursor.fetchone()[0]
+
+    def _transaction(self, txtype, user_id, amount, quantity, ticker, executed, reason=None):
+        txid = self._tx_ids.next()
+        self._transactions.add(txid, self._txtypes[txtype], user_id, amount, quantity, ticker, executed, reason, self._api_user_id)
+        return txid
+
+    def _price(self):
+        return '{:.2f}'.format(self._rng.uniform(5, 500))
+
+    def add_user(self, index, now, positions, lots_per_position, closed_fraction, short_fraction, watches):
+        rng = self._rng
+        user_id = '{}{:07d}'.format(USER_PREFIX, index)
+        created = now - datetime.timedelta(days=rng.uniform(30, 720))
+        balance = '{:.2f}'.format(rng.uniform(10000, 1000000))
+        self._users.add(user_id, created, user_id, balance)
+        self._transaction('CAPITAL', user_id, balance, 0, None, created, SEED_REASON)
+
+        for _ in range(max(0, int(rng.gauss(positions, positions / 3)))):
+            ticker = rng.choice(self._symbols)
+            quantity = max(1, int(rng.expovariate(1 / lots_per_position)))
+            opened = created + (now - created) * rng.random()
+            open_price = self._price()
+            closed = rng.random() < closed_fraction
+            closed_at = opened + (now - opened) * rng.random()
+            close_price = self._price()
+
+            if rng.random() < short_fraction:
+                open_tx = self._transaction('SELL', user_id, '{:.2f}'.format(float(open_price) * quantity), quantity, ticker, opened)
+                close_tx = self._transaction('BUY', user_id, '{:.2f}'.format(float(close_price) * quantity), quantity, ticker, closed_at) if closed else None
+                for _ in range(quantity):
+                    if closed:
+                        self._closed.add(self._lot_ids.next(), self._stocktypes['SHORT'], user_id, open_tx, close_tx, ticker,
+                                         close_price, closed_at, None, open_price, opened)
+                    else:
+                        self._open.add(self._lot_ids.next(), self._stocktypes['SHORT'], user_id, open_tx, ticker,
+                                       None, None, None, open_price, opened)
+            else:
+                open_tx = self._transaction('BUY', user_id, '{:.2f}'.format(float(open_price) * quantity), quantity, ticker, opened)
+                close_tx = self._transaction('SELL', user_id, '{:.2f}'.format(float(close_price) * quantity), quantity, ticker, closed_at) if closed else None
+                for _ in range(quantity):
+                    if closed:
+                        self._closed.add(self._lot_ids.next(), self._stocktypes['LONG'], user_id, open_tx, close_tx, ticker,
+                                         open_price, opened, None, close_price, closed_at)
+                    else:
+                        self._open.add(self._lot_ids.next(), self._stocktypes['LONG'], user_id, open_tx, ticker,
+                                       open_price, opened, None, None, None)
+
+        for ticker in rng.sample(self._symbols, min(watches, len(self._symbols))):
+            self._watches.add(user_id, ticker, self._price())
+
+        if max([b.rows for b in self._buffers]) >= COPY_BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        for buffer in self._buffers:
+            buffer.flush(self._cursor)
+        self._connection.commit()
+
+    def totals(self):
+        return {b.table: b.total for b in self._buffers}
+
+
+def seed(args, connection_string):
+    rng = random.Random(args.seed)
+    connection = psycopg2.connect(connection_string)
+    seeder = Seeder(connection, args.apikey, symbol_universe(args.symbols), rng)
+    first = seeder.first_free_index()
+    now = datetime.datetime.now()
+
+    started = time.perf_counter()
+    for index in range(first, first + args.users):
+        seeder.add_user(index, now, args.positions, args.lots, args.closed_fraction, args.short_fraction, args.watches)
+    seeder.flush()
+
+    # the planner needs fresh statistics after a bulk load of this size
+    connection.autocommit = True
+    connection.cursor().execute('ANALYZE;')
+    connection.close()
+
+    elapsed = time.perf_counter() - started
+    print('seeded {} users in {:.1f}s'.format(args.users, elapsed))
+    for table, rows in seeder.totals().items():
+        print('    {:<32} {:>12,} rows'.format(table, rows))
+
+
+def parse_mix(mix):
+    weights = collections.OrderedDict()
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        weights[name.strip()] = float(weight)
+    unknown = set(weights) - set(REQUEST_BUILDERS)
+    if unknown:
+        raise SystemExit('unknown endpoints in mix: {}'.format(', '.join(sorted(unknown))))
+    return weights
+
+
+def _trade(rng, user_ids, symbols, api_key):
+    return {'userid': rng.choice(user_ids), 'symbol': rng.choice(symbols), 'quantity': rng.randint(1, 5), 'apikey': api_key}
+
+
+REQUEST_BUILDERS = {
+    'user_info': lambda rng, user_ids, symbols, api_key: {'userid': rng.choice(user_ids)},
+    'stock_info': lambda rng, user_ids, symbols, api_key: {'symbols': ','.join(rng.sample(symbols, min(5, len(symbols))))},
+    # a deep all_users walks every seeded user, which would drown out the rest of the mix
+    'all_users': lambda rng, user_ids, symbols, api_key: {'shallow': 'True'},
+    'buy_long': _trade,
+    'sell_long': _trade,
+    'buy_short': _trade,
+    'sell_short': _trade,
+    'deposit': lambda rng, user_ids, symbols, api_key: {
+        'userid': rng.choice(user_ids), 'amount': '{:.2f}'.format(rng.uniform(1, 1000)), 'reason': 'load test', 'apikey': api_key},
+    'set_watch': lambda rng, user_ids, symbols, api_key: {
+        'userid': rng.choice(user_ids), 'symbol': rng.choice(symbols), 'apikey': api_key},
+}
+
+
+def run_load(args, connection_string):
+    base_url = args.url.rstrip('/') + '/broker/'
+    weights = parse_mix(args.mix)
+    symbols = symbol_universe(args.symbols)
+
+    connection = psycopg2.connect(connection_string)
+    cursor = connection.cursor()
+    cursor.execute("SELECT id FROM ottobroker.users WHERE id LIKE %s;", [USER_PREFIX + '%'])
+    user_ids = [row[0] for row in cursor.fetchall()]
+    connection.close()
+    if not user_ids:
+        raise SystemExit('no seeded users found; run the seed command first')
+
+    stub = None
+    if args.stub_port:
+        stub = StubQuoteServer(latency=args.stub_latency, port=args.stub_port).start()
+        print('stub quotes at {} (point quote_api_url at it)'.format(stub.url))
+
+    # the seeded population lives in the test database; the server is put back the way it was even if the run fails
+    toggled = False
+    try:
+        if not get_json(base_url + 'test_mode')['test_mode']:
+            get_json(base_url + 'toggle_test_mode?' + urllib.parse.urlencode({'apikey': args.apikey}))
+            toggled = True
+
+        latencies = collections.defaultdict(list)
+        outcomes = collections.defaultdict(collections.Counter)
+        lock = threading.Lock()
+        deadline = time.monotonic() + args.duration
+
+        def worker(worker_id):
+            rng = random.Random('{}-{}'.format(args.seed, worker_id))
+            names = list(weights)
+            local_latencies = collections.defaultdict(list)
+            local_outcomes = collections.defaultdict(collections.Counter)
+            while time.monotonic() < deadline:
+                name = rng.choices(names, weights=[weights[n] for n in names])[0]
+                params = REQUEST_BUILDERS[name](rng, user_ids, symbols, args.apikey)
+                url = base_url + name + '?' + urllib.parse.urlencode(params)
+                started = time.perf_counter()
+                try:
+                    status = get_json(url).get('status', 'missing status')
+                except Exception:
+                    status = 'http_error'
+                local_latencies[name].append(time.perf_counter() - started)
+                local_outcomes[name][status] += 1
+            with lock:
+                for name, samples in local_latencies.items():
+                    latencies[name].extend(samples)
+                    outcomes[name].update(local_outcomes[name])
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+        started = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        if toggled:
+            get_json(base_url + 'toggle_test_mode?' + urllib.parse.urlencode({'apikey': args.apikey}))
+        if stub is not None:
+            stub.stop()
+
+    total = sum([len(samples) for samples in latencies.values()])
+    print('{} requests from {} workers over {:.1f}s, {:.1f} req/s against {} seeded users'.format(
+        total, args.concurrency, elapsed, total / elapsed, len(user_ids)))
+    print('{:<12} {:>8} {:>9} {:>8} {:>8} {:>9} {:>9} {:>9}'.format(
+        'endpoint', 'count', 'req/s', 'success', 'error', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for name in weights:
+        samples = latencies.get(name)
+        if not samples:
+            continue
+        print('{:<12} {:8d} {:9.1f} {:8d} {:8d} {:9.1f} {:9.1f} {:9.1f}'.format(
+            name, len(samples), len(samples) / elapsed,
+            outcomes[name]['success'], len(samples) - outcomes[name]['success'],
+            percentile(samples, 50) * 1000, percentile(samples, 95) * 1000, percentile(samples, 99) * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Seed a synthetic population into the test database and drive the broker routes with it')
+    parser.add_argument('-c', dest='configFile', required=True, help='Relative Path to config file')
+    parser.add_argument('--apikey', required=True, help='api key registered in ottobroker.apiusers')
+    parser.add_argument('--symbols', type=int, default=200, help='size of the synthetic ticker universe')
+    parser.add_argument('--seed', type=int, default=1)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='bulk load users, lots, transactions and watches with COPY')
+    seed_parser.add_argument('--users', type=int, default=10000)
+    seed_parser.add_argument('--positions', type=float, default=20, help='average positions opened per user')
+    seed_parser.add_argument('--lots', type=float, default=10, help='average lots per position')
+    seed_parser.add_argument('--closed-fraction', type=float, default=0.6, help='share of positions already closed')
+    seed_parser.add_argument('--short-fraction', type=float, default=0.2, help='share of positions that are shorts')
+    seed_parser.add_argument('--watches', type=int, default=5, help='watches per user')
+
+    run_parser = commands.add_parser('run', help='drive a running broker with a weighted mix of requests')
+    run_parser.add_argument('--url', default='http://127.0.0.1:8888')
+    run_parser.add_argument('--duration', type=float, default=60, help='seconds to run for')
+    run_parser.add_argument('--concurrency', type=int, default=32)
+    run_parser.add_argument('--mix', default=DEFAULT_MIX, help='comma separated endpoint=weight pairs')
+    run_parser.add_argument('--stub-port', type=int, default=8899, help='port for the stub quote server, 0 to not start one')
+    run_parser.add_argument('--stub-latency', type=float, default=0.05, help='seconds the stub waits before answering')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser(delimiters=('='))
+    config.read(args.configFile)
+    # never seed or load the live database
+    connection_string = config.get('DEFAULT', 'test_connection_string')
+
+    if args.command == 'seed':
+        seed(args, connection_string)
+    else:
+        run_load(args, connection_string)
@@ -1,50 +1,42 @@
-from flask import Flask, request, Response
+from flask import Flask, request, Response, g
 
 import argparse
 import configparser
 import signal
 import logging
-from logging import handlers
-import os
 import json
+import gzip
 from decimal import Decimal
 
 from broker import OttoBroker
 from jsonEncoder import CustomJSONEncoder
+from serverCommon import (SYMBOLS_KEY, SYMBOL_KEY, USERID_KEY, APIKEY_KEY, DISPLAYNAME_KEY, AMOUNT_KEY, REASON_KEY,
+                          QUANTITY_KEY, ENTRIES_KEY, VALUATE_KEY, SHALLOW_KEY, DETAIL_KEY, SINCE_KEY, JOB_KEY, ACTION_KEY,
+                          ORDER_TYPE_KEY, PRICE_KEY, ID_KEY, PROFILE_HEADER, UNPROFILED_PATHS, TIMEOUT_KEY,
+                          IF_NONE_MATCH_HEADER, GZIP_MIN_BYTES, GZIP_LEVEL, MAX_BULK_ENTRIES, MAX_POLL_TIMEOUT,
+                          DEFAULT_POLL_TIMEOUT, MISSING_PARAM_MSG, INVALID_TYPE_MSG, STR_TRUE, STR_FALSE,
+                          configure_logging, etag_matches, build_broker)
 
-handler = handlers.TimedRotatingFileHandler("logs/log_broker.log", when="midnight", interval=1)
-logging.basicConfig(format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
-    filename=os.devnull,
-    level=logging.INFO)
 _logger = logging.getLogger()
-_logger.addHandler(handler)
 
-# START CONSTANTS
-# api params
-SYMBOLS_KEY = 'symbols'
-SYMBOL_KEY = 'symbol'
-USERID_KEY = 'userid'
-APIKEY_KEY = 'apikey'
-DISPLAYNAME_KEY = 'displayname'
-AMOUNT_KEY = 'amount'
-REASON_KEY = 'reason'
-QUANTITY_KEY = 'quantity'
-SHALLOW_KEY = 'shallow'
-
-# error messages
-MISSING_PARAM_MSG = 'missing required parameter: {param}'
-INVALID_TYPE_MSG = 'param \'{param}\' could not be converted to type \'{type}\''
-
-# bool conversion consts
-STR_TRUE = 'True'
-STR_FALSE = 'False'
-
-
-# END CONSTANTS
 
 def jsonify(obj):
     return Response(json.dumps(obj, cls=CustomJSONEncoder), mimetype='application/json')
 
+def conditional_jsonify(etag, build):
+    # build only runs when the client's copy is out of date
+    if etag_matches(request.headers.get(IF_NONE_MATCH_HEADER), etag):
+        response = Response(status=304)
+    else:
+        result = build()
+        response = jsonify(result)
+        if result.get(OttoBroker.STATUS_KEY) != OttoBroker.STATUS_SUCCESS:
+            return response
+    if etag is not None:
+        response.headers['ETag'] = 'W/"{}"'.format(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("-c", 
@@ -55,11 +47,8 @@ if __name__ == '__main__':
     config = configparser.ConfigParser(delimiters=('='))
     config.read(args.configFile)
 
-    broker = OttoBroker(
-        config.get('DEFAULT', 'connection_string'),
-        config.get('DEFAULT', 'test_connection_string'),
-        int(config.get('DEFAULT', 'max_liabilities_ratio')),
-    )
+    configure_logging()
+    broker = build_broker(config)
 
     app = Flask(__name__)
 
@@ -74,6 +63,32 @@ if __name__ == '__main__':
     signal.signal(signal.SIGINT, handle_signals)
     signal.signal(signal.SIGTERM, handle_signals)
 
+    @app.before_request
+    def start_profile():
+        g.profile = None
+        if request.path not in UNPROFILED_PATHS:
+            g.profile = broker.start_profile(request.headers.get(PROFILE_HEADER))
+
+    @app.teardown_request
+    def finish_profile(exc):
+        if getattr(g, 'profile', None) is not None:
+            args = {k: v for k, v in request.args.items() if k != APIKEY_KEY}
+            broker.finish_profile(g.profile, request.path, args)
+            g.profile = None
+
+    @app.after_request
+    def compress_response(response):
+        if response.status_code != 200 or response.direct_passthrough or 'Content-Encoding' in response.headers:
+            return response
+        response.vary.add('Accept-Encoding')
+        if 'gzip' not in request.headers.get('Accept-Encoding', '').lower():
+            return response
+        body = response.get_data()
+        if len(body) >= GZIP_MIN_BYTES:
+            response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
+
     @app.route('/broker/hello')
     def flask_test():
         return "I am OttoBroker yes hello"
@@ -82,7 +97,25 @@ if __name__ == '__main__':
     def get_stock_info():
         if SYMBOLS_KEY not in request.args:
             return jsonify(broker.return_failure(MISSING_PARAM_MSG.format(param=SYMBOLS_KEY)))
-        return jsonify(broker.get_stock_value([s.upper() for s in request.args[SYMBOLS_KEY].split(',')]))
+        symbols = [s.upper() for s in request.args[SYMBOLS_KEY].split(',')]
+        return conditional_jsonify(broker.get_stock_value_etag(symbols), lambda: broker.get_stock_value(symbols))
+    
+    @app.route('/broker/ready')
+    def ready():
+        # unlike /broker/hello this only succeeds once the startup warm up checked the database
+        readiness = broker.get_readiness()
+        response = jsonify(readiness)
+        if not readiness['ready']:
+            response.status_code = 503
+        return response
+    
+    @app.route('/broker/quote_stats')
+    def quote_stats():
+        return jsonify(broker.get_quote_stats())
+    
+    @app.route('/broker/db_stats')
+    def db_stats():
+        return jsonify(broker.get_db_stats())
     
     @app.route('/broker/toggle_test_mode')
     def toggle_test():
@@ -112,7 +145,9 @@ if __name__ == '__main__':
             elif shallow.lower() == STR_FALSE.lower():
                 shallow = False
             
-        return jsonify(broker.get_user_info(request.args[USERID_KEY], shallow))
+        detail = request.args.get(DETAIL_KEY, broker.DETAIL_FULL).lower()
+        return conditional_jsonify(broker.get_user_info_etag(request.args[USERID_KEY], shallow, detail),
+                                   lambda: broker.get_user_info(request.args[USERID_KEY], shallow, detail))
     
     @app.route('/broker/all_users')
     def get_all_users():
@@ -125,7 +160,8 @@ if __name__ == '__main__':
             elif shallow.lower() == STR_FALSE.lower():
                 shallow = False
             
-        return jsonify(broker.get_all_users(shallow))
+        detail = request.args.get(DETAIL_KEY, broker.DETAIL_FULL).lower()
+        return conditional_jsonify(broker.get_all_users_etag(shallow, detail), lambda: broker.get_all_users(shallow, detail))
     
     @app.route('/broker/register')
     def register_user():
@@ -157,6 +193,28 @@ if __name__ == '__main__':
 
         return jsonify(broker.deposit(request.args[USERID_KEY], amount, request.args[REASON_KEY], request.args[APIKEY_KEY]))
     
+    @app.route('/broker/bulk_capital', methods=['POST'])
+    def bulk_capital():
+        try:
+            body = json.loads(request.get_data(as_text=True), parse_float=Decimal)
+        except Exception:
+            return jsonify(broker.return_failure('request body must be JSON', do_log=False))
+        if not isinstance(body, dict):
+            return jsonify(broker.return_failure('request body must be a JSON object', do_log=False))
+
+        if APIKEY_KEY not in body:
+            return jsonify(broker.return_failure(MISSING_PARAM_MSG.format(param=APIKEY_KEY)))
+        if ENTRIES_KEY not in body:
+            return jsonify(broker.return_failure(MISSING_PARAM_MSG.format(param=ENTRIES_KEY)))
+        if isinstance(body[ENTRIES_KEY], list) and len(body[ENTRIES_KEY]) > MAX_BULK_ENTRIES:
+            return jsonify(broker.return_failure('at most {} entries per call'.format(MAX_BULK_ENTRIES), do_log=False))
+
+        valuate = body.get(VALUATE_KEY, False)
+        if not isinstance(valuate, bool):
+            return jsonify(broker.return_failure(INVALID_TYPE_MSG.format(param=VALUATE_KEY, type='bool')))
+
+        return jsonify(broker.bulk_capital(body[ENTRIES_KEY], body[APIKEY_KEY], valuate))
+    
     @app.route('/broker/withdraw')
     def withdraw():
         if APIKEY_KEY not in request.args:
@@ -288,8 +346,102 @@ if __name__ == '__main__':
 
         return jsonify(broker.remove_watch(request.args[USERID_KEY], request.args[SYMBOL_KEY].upper(), request.args[APIKEY_KEY]))
     
+    @app.route('/broker/place_order')
+    def place_order():
+        for key in [APIKEY_KEY, USERID_KEY, SYMBOL_KEY, ACTION_KEY, ORDER_TYPE_KEY, PRICE_KEY, QUANTITY_KEY]:
+            if key not in request.args:
+                return jsonify(broker.return_failure(MISSING_PARAM_MSG.format(param=key)))
+
+        price = request.args[PRICE_KEY]
+        try:
+            price = Decimal(price)
+        except Exception:
+            return jsonify(broker.return_failure(INVALID_TYPE_MSG.format(param=PRICE_KEY, type='Decimal')))
+        quantity = request.args[QUANTITY_KEY]
+        try:
+            quantity = int(quantity)
+        except Exception:
+            return jsonify(broker.return_failure(INVALID_TYPE_MSG.format(param=QUANTITY_KEY, type='int')))
+
+        return jsonify(broker.place_order(request.args[USERID_KEY], request.args[SYMBOL_KEY].upper(), request.args[ACTION_KEY].lower(),
+                                          request.args[ORDER_TYPE_KEY].lower(), price, quantity, request.args[APIKEY_KEY]))
+    
+    @app.route('/broker/cancel_order')
+    def cancel_order():
+        for key in [APIKEY_KEY, USERID_KEY, ID_KEY]:
+            if key not in request.args:
+                return jsonify(broker.return_failure(MISSING_PARAM_MSG.format(param=key)))
+
+        order_id = request.args[ID_KEY]
+        try:
+            order_id = int(order_id)
+        except Exception:
+            return jsonify(broker.return_failure(INVALID_TYPE_MSG.format(param=ID_KEY, type='int')))
+
+        return jsonify(broker.cancel_order(order_id, request.args[USERID_KEY], request.args[APIKEY_KEY]))
+    
+    @app.route('/broker/orders')
+    def list_orders():
+        if USERID_KEY not in request.args:
+            return jsonify(broker.return_failure(MISSING_PARAM_MSG.format(param=USERID_KEY)))
+
+        return jsonify(broker.get_orders(request.args[USERID_KEY]))
+    
+    @app.route('/broker/profiles')
+    def list_profiles():
+        if APIKEY_KEY not in request.args:
+            return jsonify(broker.return_failure(MISSING_PARAM_MSG.format(param=APIKEY_KEY)))
+
+        return jsonify(broker.get_profiles(request.args[APIKEY_KEY]))
+    
+    @app.route('/broker/profile')
+    def get_profile():
+        if APIKEY_KEY not in request.args:
+            return jsonify(broker.return_failure(MISSING_PARAM_MSG.format(param=APIKEY_KEY)))
+
+        if ID_KEY not in request.args:
+            return jsonify(broker.return_failure(MISSING_PARAM_MSG.format(param=ID_KEY)))
+        profile_id = request.args[ID_KEY]
+        try:
+            profile_id = int(profile_id)
+        except Exception:
+            return jsonify(broker.return_failure(INVALID_TYPE_MSG.format(param=ID_KEY, type='int')))
+
+        return jsonify(broker.get_profile(request.args[APIKEY_KEY], profile_id))
+    
+    @app.route('/broker/watch_alerts')
+    def watch_alerts():
+        since = request.args.get(SINCE_KEY, '0')
+        try:
+            since = int(since)
+        except Exception:
+            return jsonify(broker.return_failure(INVALID_TYPE_MSG.format(param=SINCE_KEY, type='int')))
+
+        timeout = request.args.get(TIMEOUT_KEY, str(DEFAULT_POLL_TIMEOUT))
+        try:
+            timeout = min(max(float(timeout), 0), MAX_POLL_TIMEOUT)
+        except Exception:
+            return jsonify(broker.return_failure(INVALID_TYPE_MSG.format(param=TIMEOUT_KEY, type='float')))
+
+        return jsonify(broker.get_watch_alerts(since, request.args.get(USERID_KEY), timeout))
+    
+    @app.route('/broker/jobs')
+    def list_jobs():
+        return jsonify(broker.get_jobs())
+    
+    @app.route('/broker/run_job')
+    def run_job():
+        if APIKEY_KEY not in request.args:
+            return jsonify(broker.return_failure(MISSING_PARAM_MSG.format(param=APIKEY_KEY)))
+
+        if JOB_KEY not in request.args:
+            return jsonify(broker.return_failure(MISSING_PARAM_MSG.format(param=JOB_KEY)))
+
+        return jsonify(broker.run_job(request.args[JOB_KEY], request.args[APIKEY_KEY]))
+    
 
     app.run(
         debug=False,
-        port=8888
+        port=8888,
+        threaded=True
     )
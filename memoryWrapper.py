@@ -0,0 +1,641 @@
+from dataContainers import *
+
+import collections
+import datetime
+import hashlib
+import threading
+from decimal import Decimal, ROUND_HALF_UP
+
+
+class MemoryIntegrityError(Exception):
+    pass
+
+
+class _Lot():
+    # one share, a row of fakestocks while open and of closedstocks once closed
+    __slots__ = ('id', 'stocktypeid', 'userid', 'txid', 'closetxid', 'ticker', 'purchase_cost', 'purchased',
+                 'expiration', 'sell_cost', 'sold', 'borrow_charged')
+
+    def __init__(self, lot_id, stocktypeid, userid, txid, ticker, purchase_cost=None, purchased=None, sell_cost=None, sold=None):
+        self.id = lot_id
+        self.stocktypeid = stocktypeid
+        self.userid = userid
+        self.txid = txid
+        self.closetxid = None
+        self.ticker = ticker
+        self.purchase_cost = purchase_cost
+        self.purchased = purchased
+        self.expiration = None
+        self.sell_cost = sell_cost
+        self.sold = sold
+        self.borrow_charged = None
+
+
+class MemoryWrapper():
+    # the PostgresWrapper interface on process local tables, following createDB.sql and createFunctions.sql.
+    # every method holds one lock, which gives the same all-or-nothing behaviour as the plpgsql functions
+    LONG = 1
+    SHORT = 2
+
+    TX_BUY = 1
+    TX_SELL = 2
+    TX_CAPITAL = 3
+
+    def __init__(self, api_keys=None):
+        self._lock = threading.RLock()
+        self._ids = collections.Counter()
+        self._stats = collections.Counter()
+
+        self._api_users = {}
+        self._users = {}
+        self._transactions = {}
+        self._last_txid = None
+        self._last_txid_by_user = {}
+
+        # open lots per (user, ticker, stock type), oldest first, so FIFO selection pops from the left
+        self._open_lots = {}
+        self._open_keys_by_user = collections.defaultdict(set)
+        self._closed_lots_by_user = collections.defaultdict(list)
+
+        self._watches_by_user = collections.defaultdict(dict)
+
+        self._orders = {}
+        self._order_ids_by_user = collections.defaultdict(list)
+        self._order_ids_by_status = collections.defaultdict(set)
+
+        self._listeners = []
+
+        for api_key, display_name in (api_keys or {}).items():
+            self.add_api_user(api_key, display_name)
+
+    @staticmethod
+    def parse_api_keys(value):
+        # 'key:name,key2:name2'; the name defaults to the key
+        result = {}
+        for entry in (value or '').split(','):
+            api_key, _, display_name = entry.strip().partition(':')
+            if api_key:
+                result[api_key] = display_name or api_key
+        return result
+
+    @staticmethod
+    def _money(value):
+        # what storing into a NUMERIC(100, 2) column does
+        if not isinstance(value, Decimal):
+            value = Decimal(str(value))
+        return value.quantize(Decimal('.01'), rounding=ROUND_HALF_UP)
+
+    @staticmethod
+    def _now():
+        return datetime.datetime.now()
+
+    def _next_id(self, table):
+        self._ids[table] += 1
+        return self._ids[table]
+
+    def _count(self, read_only):
+        self._stats['reads' if read_only else 'writes'] += 1
+
+    def _api_user_id(self, api_key):
+        api_user = self._api_users.get(api_key)
+        return api_user[0] if api_user is not None else None
+
+    def _require_user(self, user_id):
+        if user_id not in self._users:
+            raise MemoryIntegrityError('user {} does not exist'.format(user_id))
+
+    def _add_transaction(self, txtypeid, user_id, dollaramount, stockamount, ticker, executed, reason, api_user_id, txid=None):
+        if txid is None:
+            txid = self._next_id('faketransactions')
+        self._transactions[txid] = (txid, txtypeid, user_id, self._money(dollaramount), stockamount, ticker, executed, reason, api_user_id)
+        self._last_txid_by_user[user_id] = max(txid, self._last_txid_by_user.get(user_id, txid))
+        self._last_txid = max(txid, self._last_txid or txid)
+        return txid
+
+    def _add_balance(self, user_id, amount):
+        user = self._users[user_id]
+        user[3] = self._money(user[3] + amount)
+
+    def _open(self, lot):
+        key = (lot.userid, lot.ticker, lot.stocktypeid)
+        self._open_lots.setdefault(key, collections.deque()).append(lot)
+        self._open_keys_by_user[lot.userid].add(key)
+
+    def _close(self, key, lots, closetxid):
+        for lot in lots:
+            lot.closetxid = closetxid
+            self._closed_lots_by_user[lot.userid].append(lot)
+        if not self._open_lots.get(key):
+            self._open_lots.pop(key, None)
+            self._open_keys_by_user[key[0]].discard(key)
+
+    def _take_oldest(self, key, quantity):
+        # the oldest quantity lots, or None without touching anything if there aren't enough
+        lots = self._open_lots.get(key)
+        if lots is None or len(lots) < quantity:
+            return None
+        return [lots.popleft() for _ in range(quantity)]
+
+    def _user_open_lots(self, user_id, stocktypeid):
+        for key in self._open_keys_by_user.get(user_id, ()):
+            if key[2] == stocktypeid:
+                yield from self._open_lots[key]
+
+    def _all_open_shorts(self):
+        for key, lots in self._open_lots.items():
+            if key[2] == self.SHORT:
+                yield from lots
+
+    @staticmethod
+    def _group_stocks(lots):
+        # the rows of SELECT stocktypeid, userid, ticker, purchase_cost, sell_cost, COUNT(id) ... GROUP BY
+        counts = collections.Counter()
+        for lot in lots:
+            counts[(lot.stocktypeid, lot.userid, lot.ticker, lot.purchase_cost, lot.sell_cost)] += 1
+        return [BrokerStock(key + (count,)) for key, count in counts.items()]
+
+    def add_api_user(self, api_key, display_name):
+        with self._lock:
+            if api_key not in self._api_users:
+                self._api_users[api_key] = (self._next_id('apiusers'), api_key, display_name)
+            return self._api_users[api_key][0]
+
+    def warm_up(self, deadline):
+        # nothing to connect to or prepare
+        return {'connections': 0, 'prepared': 0}
+
+    def pin_to_primary(self, user_id=None):
+        # there is no replica to lag behind
+        pass
+
+    def get_routing_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['replica_configured'] = False
+        stats['pinned_users'] = 0
+        stats['storage_backend'] = 'memory'
+        return stats
+
+    def get_statement_stats(self):
+        return {
+            'prepare_enabled': False,
+            'pool_size': 0,
+            'pools': 0
+        }
+
+    def broker_create_user(self, user_id, display_name, api_key):
+        with self._lock:
+            self._count(False)
+            if user_id in self._users or self._api_user_id(api_key) is None:
+                return None
+            self._users[user_id] = [user_id, self._now(), display_name, Decimal('0.00')]
+            return user_id
+
+    def broker_get_single_user(self, user_id):
+        with self._lock:
+            self._count(True)
+            user = self._users.get(user_id)
+            return BrokerUser(tuple(user)) if user is not None else None
+
+    def broker_get_all_user_ids(self):
+        with self._lock:
+            self._count(True)
+            return list(self._users)
+
+    def broker_get_single_api_users(self, api_key):
+        with self._lock:
+            self._count(True)
+            api_user = self._api_users.get(api_key)
+            return BrokerAPIUser(api_user) if api_user is not None else None
+
+    def broker_get_api_users(self):
+        with self._lock:
+            self._count(True)
+            return [BrokerAPIUser(api_user) for api_user in self._api_users.values()]
+
+    def broker_get_lookup_ids(self):
+        return {
+            'fakestocktypes': {'LONG': self.LONG, 'SHORT': self.SHORT},
+            'faketransactiontypes': {'BUY': self.TX_BUY, 'SELL': self.TX_SELL, 'CAPITAL': self.TX_CAPITAL}
+        }
+
+    def broker_get_held_tickers(self):
+        with self._lock:
+            self._count(True)
+            tickers = set([key[1] for key in self._open_lots])
+            tickers.update([watch[2] for watches in self._watches_by_user.values() for watch in watches.values()])
+            tickers.update([self._orders[order_id][2] for order_id in self._order_ids_by_status['OPEN']])
+            return list(tickers)
+
+    def broker_get_longs_by_user(self, user_id):
+        with self._lock:
+            self._count(True)
+            return self._group_stocks(self._user_open_lots(user_id, self.LONG))
+
+    def broker_get_historical_longs_by_user(self, user_id):
+        with self._lock:
+            self._count(True)
+            return self._group_stocks([lot for lot in self._closed_lots_by_user.get(user_id, ()) if lot.stocktypeid == self.LONG])
+
+    def broker_get_shorts_by_user(self, user_id):
+        with self._lock:
+            self._count(True)
+            return self._group_stocks(self._user_open_lots(user_id, self.SHORT))
+
+    def broker_get_historical_shorts_by_user(self, user_id):
+        with self._lock:
+            self._count(True)
+            return self._group_stocks([lot for lot in self._closed_lots_by_user.get(user_id, ()) if lot.stocktypeid == self.SHORT])
+
+    def _position_summaries(self, user_id):
+        positions = {}
+
+        def position(ticker):
+            if ticker not in positions:
+                positions[ticker] = [0, Decimal(0), 0, Decimal(0), Decimal(0), 0]
+            return positions[ticker]
+
+        for key in self._open_keys_by_user.get(user_id, ()):
+            entry = position(key[1])
+            for lot in self._open_lots[key]:
+                if lot.stocktypeid == self.LONG:
+                    entry[0] += 1
+                    entry[1] += lot.purchase_cost
+                else:
+                    entry[2] += 1
+                    entry[3] += lot.sell_cost
+        for lot in self._closed_lots_by_user.get(user_id, ()):
+            entry = position(lot.ticker)
+            entry[4] += lot.sell_cost - lot.purchase_cost
+            entry[5] += 1
+
+        return [BrokerPositionSummary((user_id, ticker) + tuple(positions[ticker])) for ticker in sorted(positions)]
+
+    def broker_get_position_summaries(self, user_id):
+        with self._lock:
+            self._count(True)
+            return self._position_summaries(user_id)
+
+    def broker_get_all_position_summaries(self):
+        with self._lock:
+            self._count(True)
+            user_ids = set(self._open_keys_by_user) | set(self._closed_lots_by_user)
+            return [summary for user_id in sorted(user_ids) for summary in self._position_summaries(user_id)]
+
+    @staticmethod
+    def _watch_fingerprint(entries):
+        if not entries:
+            return None
+        return hashlib.md5(','.join(entries).encode()).hexdigest()
+
+    def broker_get_user_state(self, user_id):
+        with self._lock:
+            self._count(True)
+            if user_id not in self._users:
+                return None
+            watches = self._watches_by_user.get(user_id, {}).values()
+            tickers = set([key[1] for key in self._open_keys_by_user.get(user_id, ())])
+            tickers.update([lot.ticker for lot in self._closed_lots_by_user.get(user_id, ())])
+            tickers.update([watch[2] for watch in watches])
+            fingerprint = self._watch_fingerprint(sorted(['{}:{}'.format(watch[2], watch[3]) for watch in watches]))
+            return self._last_txid_by_user.get(user_id), fingerprint, sorted(tickers)
+
+    def broker_get_global_state(self):
+        with self._lock:
+            self._count(True)
+            fingerprint = self._watch_fingerprint(sorted([
+                '{}:{}:{}'.format(watch[1], watch[2], watch[3]) for watches in self._watches_by_user.values() for watch in watches.values()
+            ]))
+            return self._last_txid, len(self._users), fingerprint
+
+    def broker_get_all_users(self):
+        with self._lock:
+            self._count(True)
+            return [BrokerUser(tuple(user)) for user in self._users.values()]
+
+    def broker_give_money_to_user(self, user_id, amount, reason, api_key):
+        with self._lock:
+            self._count(False)
+            amount = self._money(amount)
+            api_user_id = self._api_user_id(api_key)
+            user = self._users.get(user_id)
+            if api_user_id is None or user is None or (amount < 0 and user[3] + amount < 0):
+                return None
+            self._add_balance(user_id, amount)
+            return self._add_transaction(self.TX_CAPITAL, user_id, amount, 0, None, self._now(), reason, api_user_id)
+
+    def broker_give_money_bulk(self, entries, api_key):
+        with self._lock:
+            self._count(False)
+            api_user_id = self._api_user_id(api_key)
+            if api_user_id is None:
+                return []
+
+            now = self._now()
+            entries = [(user_id, self._money(amount), reason) for user_id, amount, reason in entries]
+            # every entry draws its transaction id, applied or not, like nextval in givemoneybulk
+            txids = [self._next_id('faketransactions') for _ in entries]
+            totals = collections.defaultdict(Decimal)
+            for user_id, amount, _ in entries:
+                totals[user_id] += amount
+            credited = set([user_id for user_id, total in totals.items()
+                            if user_id in self._users and self._users[user_id][3] + total >= 0])
+            for user_id in credited:
+                self._add_balance(user_id, totals[user_id])
+
+            result = []
+            for index, (user_id, amount, reason) in enumerate(entries):
+                if user_id in credited:
+                    self._add_transaction(self.TX_CAPITAL, user_id, amount, 0, None, now, reason, api_user_id, txid=txids[index])
+                    result.append((index + 1, user_id, txids[index], 'ok'))
+                else:
+                    status = 'unknown_user' if user_id not in self._users else 'insufficient_funds'
+                    result.append((index + 1, user_id, None, status))
+            return result
+
+    def broker_buy_long(self, user_id, ticker_symbol, ticker_value, quantity, api_key):
+        with self._lock:
+            self._count(False)
+            # like the numeric(100, 2) arguments of the SQL functions, the price is rounded before it is multiplied
+            ticker_value = self._money(ticker_value)
+            total_cost = self._money(quantity * ticker_value)
+            api_user_id = self._api_user_id(api_key)
+            user = self._users.get(user_id)
+            if api_user_id is None or user is None or user[3] < total_cost:
+                return None
+
+            now = self._now()
+            self._add_balance(user_id, -total_cost)
+            txid = self._add_transaction(self.TX_BUY, user_id, total_cost, quantity, ticker_symbol, now, None, api_user_id)
+            for _ in range(quantity):
+                self._open(_Lot(self._next_id('fakestocks'), self.LONG, user_id, txid, ticker_symbol,
+                                purchase_cost=ticker_value, purchased=now))
+            return txid
+
+    def broker_sell_long(self, user_id, ticker_symbol, ticker_value, quantity, api_key):
+        with self._lock:
+            self._count(False)
+            api_user_id = self._api_user_id(api_key)
+            if api_user_id is None:
+                return -1
+
+            key = (user_id, ticker_symbol, self.LONG)
+            lots = self._take_oldest(key, quantity)
+            if lots is None:
+                return -1
+
+            now = self._now()
+            ticker_value = self._money(ticker_value)
+            total_value = self._money(quantity * ticker_value)
+            self._add_balance(user_id, total_value)
+            txid = self._add_transaction(self.TX_SELL, user_id, total_value, quantity, ticker_symbol, now, None, api_user_id)
+            for lot in lots:
+                lot.sell_cost = ticker_value
+                lot.sold = now
+            self._close(key, lots, txid)
+            return txid
+
+    def broker_buy_short(self, user_id, ticker_symbol, ticker_value, quantity, api_key):
+        with self._lock:
+            self._count(False)
+            api_user_id = self._api_user_id(api_key)
+            user = self._users.get(user_id)
+            ticker_value = self._money(ticker_value)
+            total_cost = self._money(quantity * ticker_value)
+            if api_user_id is None or user is None or user[3] < total_cost:
+                return None
+
+            key = (user_id, ticker_symbol, self.SHORT)
+            lots = self._take_oldest(key, quantity)
+            if lots is None:
+                return None
+
+            now = self._now()
+            self._add_balance(user_id, -total_cost)
+            txid = self._add_transaction(self.TX_BUY, user_id, total_cost, quantity, ticker_symbol, now, None, api_user_id)
+            for lot in lots:
+                lot.purchase_cost = ticker_value
+                lot.purchased = now
+            self._close(key, lots, txid)
+            return txid
+
+    def broker_sell_short(self, user_id, ticker_symbol, ticker_value, quantity, api_key):
+        with self._lock:
+            self._count(False)
+            api_user_id = self._api_user_id(api_key)
+            if api_user_id is None or user_id not in self._users:
+                return -1
+
+            now = self._now()
+            ticker_value = self._money(ticker_value)
+            total_value = self._money(quantity * ticker_value)
+            self._add_balance(user_id, total_value)
+            txid = self._add_transaction(self.TX_SELL, user_id, total_value, quantity, ticker_symbol, now, None, api_user_id)
+            for _ in range(quantity):
+                self._open(_Lot(self._next_id('fakestocks'), self.SHORT, user_id, txid, ticker_symbol,
+                                sell_cost=ticker_value, sold=now))
+            return txid
+
+    def broker_get_watches(self, user_id):
+        with self._lock:
+            self._count(True)
+            return [BrokerWatch(watch) for watch in self._watches_by_user.get(user_id, {}).values()]
+
+    def broker_get_all_watches(self):
+        with self._lock:
+            self._count(True)
+            return [BrokerWatch(watch) for watches in self._watches_by_user.values() for watch in watches.values()]
+
+    def broker_update_watch(self, user_id, symbol, value):
+        with self._lock:
+            self._count(False)
+            watches = self._watches_by_user.get(user_id, {})
+            for watch_id, watch in list(watches.items()):
+                if watch[2] == symbol:
+                    watches[watch_id] = (watch_id, user_id, symbol, self._money(value), None)
+
+    def broker_create_watch(self, user_id, symbol, value):
+        with self._lock:
+            self._count(False)
+            self._require_user(user_id)
+            watch_id = self._next_id('watches')
+            self._watches_by_user[user_id][watch_id] = (watch_id, user_id, symbol, self._money(value), None)
+            return watch_id
+
+    def broker_mark_watches_alerted(self, watches):
+        with self._lock:
+            self._count(False)
+            now = self._now()
+            for user_id, symbol, watch_cost in watches:
+                user_watches = self._watches_by_user.get(user_id, {})
+                for watch_id, watch in list(user_watches.items()):
+                    if watch[2] == symbol and watch[3] == watch_cost:
+                        user_watches[watch_id] = watch[:4] + (now,)
+
+    def broker_remove_watch(self, user_id, symbol):
+        with self._lock:
+            self._count(False)
+            watches = self._watches_by_user.get(user_id, {})
+            for watch_id, watch in list(watches.items()):
+                if watch[2] == symbol:
+                    del watches[watch_id]
+
+    def _order(self, order_id):
+        return BrokerOrder(tuple(self._orders[order_id]))
+
+    def _set_order_status(self, order_id, status):
+        order = self._orders[order_id]
+        self._order_ids_by_status[order[7]].discard(order_id)
+        self._order_ids_by_status[status].add(order_id)
+        order[7] = status
+
+    def broker_create_order(self, user_id, ticker_symbol, action, order_type, trigger_price, quantity, api_key):
+        with self._lock:
+            self._count(False)
+            api_user_id = self._api_user_id(api_key)
+            if api_user_id is None:
+                return None
+            self._require_user(user_id)
+
+            order_id = self._next_id('orders')
+            # the columns of PostgresWrapper.ORDER_COLUMNS, ending with the api key the order was placed with
+            self._orders[order_id] = [order_id, user_id, ticker_symbol, action, order_type, self._money(trigger_price), quantity,
+                                      'OPEN', self._now(), None, None, None, api_key]
+            self._order_ids_by_user[user_id].append(order_id)
+            self._order_ids_by_status['OPEN'].add(order_id)
+            return self._order(order_id)
+
+    def broker_get_open_orders(self):
+        with self._lock:
+            self._count(True)
+            return [self._order(order_id) for order_id in sorted(self._order_ids_by_status['OPEN'])]
+
+    def broker_get_orders_by_user(self, user_id, limit):
+        with self._lock:
+            self._count(True)
+            return [self._order(order_id) for order_id in reversed(self._order_ids_by_user.get(user_id, [])[-limit:])]
+
+    def broker_cancel_order(self, order_id, user_id):
+        with self._lock:
+            self._count(False)
+            order = self._orders.get(order_id)
+            if order is None or order[1] != user_id or order[7] != 'OPEN':
+                return False
+            self._set_order_status(order_id, 'CANCELLED')
+            order[9] = self._now()
+            return True
+
+    def broker_claim_order(self, order_id):
+        with self._lock:
+            self._count(False)
+            order = self._orders.get(order_id)
+            if order is None or order[7] != 'OPEN':
+                return False
+            self._set_order_status(order_id, 'FILLING')
+            return True
+
+    def broker_close_order(self, order_id, status, fill_price, message):
+        with self._lock:
+            self._count(False)
+            order = self._orders.get(order_id)
+            if order is None:
+                return
+            self._set_order_status(order_id, status)
+            order[9] = self._now()
+            order[10] = self._money(fill_price) if fill_price is not None else None
+            order[11] = message
+
+    def broker_interrupt_filling_orders(self):
+        with self._lock:
+            self._count(False)
+            order_ids = sorted(self._order_ids_by_status['FILLING'])
+            for order_id in order_ids:
+                self._set_order_status(order_id, 'INTERRUPTED')
+                self._orders[order_id][9] = self._now()
+                self._orders[order_id][11] = 'broker stopped while the order was executing'
+            return order_ids
+
+    def _expired_shorts(self, max_age_seconds, now):
+        max_age = datetime.timedelta(seconds=max_age_seconds)
+        for lot in self._all_open_shorts():
+            if (lot.expiration if lot.expiration is not None else lot.sold + max_age) <= now:
+                yield lot
+
+    def broker_get_expired_short_tickers(self, max_age_seconds):
+        with self._lock:
+            self._count(True)
+            return sorted(set([lot.ticker for lot in self._expired_shorts(max_age_seconds, self._now())]))
+
+    def broker_cover_expired_shorts(self, prices, max_age_seconds, api_key):
+        with self._lock:
+            self._count(False)
+            api_user_id = self._api_user_id(api_key)
+            if api_user_id is None:
+                return []
+
+            now = self._now()
+            covers = collections.defaultdict(list)
+            for lot in self._expired_shorts(max_age_seconds, now):
+                if lot.ticker in prices:
+                    covers[(lot.userid, lot.ticker)].append(lot)
+
+            result = []
+            for (user_id, ticker), lots in sorted(covers.items()):
+                # a forced cover goes through even if it overdraws the account
+                price = self._money(prices[ticker])
+                key = (user_id, ticker, self.SHORT)
+                expired_ids = set([lot.id for lot in lots])
+                self._open_lots[key] = collections.deque([lot for lot in self._open_lots[key] if lot.id not in expired_ids])
+
+                self._add_balance(user_id, -(price * len(lots)))
+                txid = self._add_transaction(self.TX_BUY, user_id, price * len(lots), len(lots), ticker, now, 'short expired', api_user_id)
+                for lot in lots:
+                    lot.purchase_cost = price
+                    lot.purchased = now
+                self._close(key, lots, txid)
+                result.append((user_id, ticker, len(lots), txid))
+            return result
+
+    def broker_charge_borrow_fees(self, daily_rate, api_key):
+        with self._lock:
+            self._count(False)
+            api_user_id = self._api_user_id(api_key)
+            if api_user_id is None:
+                return []
+
+            now = self._now()
+            daily_rate = Decimal(str(daily_rate))
+            accrued = collections.defaultdict(Decimal)
+            lots_by_user = collections.defaultdict(list)
+            for lot in self._all_open_shorts():
+                # the fee accrues on the short sale price from the sale, or the previous charge, until now
+                seconds = Decimal(str((now - (lot.borrow_charged or lot.sold)).total_seconds()))
+                accrued[lot.userid] += lot.sell_cost * daily_rate * seconds / 86400
+                lots_by_user[lot.userid].append(lot)
+
+            result = []
+            for user_id in sorted(accrued):
+                # users owing less than a cent are skipped and keep accruing until the next run
+                fee = self._money(accrued[user_id])
+                if fee <= 0:
+                    continue
+                for lot in lots_by_user[user_id]:
+                    lot.borrow_charged = now
+                self._add_balance(user_id, -fee)
+                txid = self._add_transaction(self.TX_CAPITAL, user_id, -fee, 0, None, now, 'short borrow fee', api_user_id)
+                result.append((user_id, fee, txid))
+            return result
+
+    def broker_notify_users_changed(self, user_ids, sender):
+        # the tables only exist in this process, so only listeners on this wrapper can care
+        with self._lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            for user_id in user_ids:
+                callback(sender, user_id)
+
+    def listen_users_changed(self, callback, poll_interval=5):
+        with self._lock:
+            self._listeners.append(callback)
+        callback(None, None)
+        return None
@@ -0,0 +1,44 @@
+-- moves closed lots out of ottobroker.fakestocks into ottobroker.closedstocks.
+-- run once against an existing database, then re-run createFunctions.sql
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS ottobroker.closedstocks(
+    id int NOT NULL,
+    stocktypeid int NOT NULL,
+    userid varchar(256) NOT NULL,
+    txid int NOT NULL,
+    closetxid int,
+    ticker varchar(10) NOT NULL,
+    purchase_cost NUMERIC(100, 2),
+    purchased TIMESTAMP,
+    expiration TIMESTAMP,
+    sell_cost NUMERIC(100, 2),
+    sold TIMESTAMP, 
+    PRIMARY KEY(id),
+    FOREIGN KEY(stocktypeid) REFERENCES ottobroker.fakestocktypes(id),
+    FOREIGN KEY(userid) REFERENCES ottobroker.users(id),
+    FOREIGN KEY(txid) REFERENCES ottobroker.faketransactions(id),
+    FOREIGN KEY(closetxid) REFERENCES ottobroker.faketransactions(id)
+);
+
+-- keep trades from closing lots while they are being moved
+LOCK TABLE ottobroker.fakestocks IN EXCLUSIVE MODE;
+
+-- the closing transaction was never recorded on the lot, so closetxid stays NULL for migrated rows
+WITH moved AS (
+    DELETE FROM ottobroker.fakestocks f
+    USING ottobroker.fakestocktypes t
+    WHERE f.stocktypeid = t.id AND
+        ((t.stocktype = 'LONG' AND f.sold IS NOT NULL) OR (t.stocktype = 'SHORT' AND f.purchased IS NOT NULL))
+    RETURNING f.id, f.stocktypeid, f.userid, f.txid, f.ticker, f.purchase_cost, f.purchased, f.expiration, f.sell_cost, f.sold
+)
+INSERT INTO ottobroker.closedstocks (id, stocktypeid, userid, txid, ticker, purchase_cost, purchased, expiration, sell_cost, sold)
+SELECT id, stocktypeid, userid, txid, ticker, purchase_cost, purchased, expiration, sell_cost, sold FROM moved;
+
+CREATE INDEX IF NOT EXISTS fakestocks_userid_ticker_idx ON ottobroker.fakestocks(userid, ticker);
+CREATE INDEX IF NOT EXISTS closedstocks_userid_idx ON ottobroker.closedstocks(userid);
+
+COMMIT;
+
+-- reclaim the space the closed lots left behind
+VACUUM ANALYZE ottobroker.fakestocks;
@@ -0,0 +1,25 @@
+-- adds the resting order table to an existing database
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS ottobroker.orders(
+    id serial NOT NULL,
+    userid varchar(256) NOT NULL,
+    ticker varchar(10) NOT NULL,
+    action varchar(16) NOT NULL,
+    ordertype varchar(16) NOT NULL,
+    trigger_price NUMERIC(100, 2) NOT NULL,
+    quantity int NOT NULL,
+    status varchar(16) NOT NULL,
+    created TIMESTAMP NOT NULL,
+    closed TIMESTAMP,
+    fill_price NUMERIC(100, 2),
+    message varchar(256),
+    apiuserid int NOT NULL,
+    PRIMARY KEY(id),
+    FOREIGN KEY(userid) REFERENCES ottobroker.users(id),
+    FOREIGN KEY(apiuserid) REFERENCES ottobroker.apiusers(id)
+);
+CREATE INDEX IF NOT EXISTS orders_userid_idx ON ottobroker.orders(userid);
+CREATE INDEX IF NOT EXISTS orders_open_idx ON ottobroker.orders(id) WHERE status IN ('OPEN', 'FILLING');
+
+COMMIT;
@@ -0,0 +1,10 @@
+-- adds what the scheduled maintenance jobs need to an existing database,
+-- then re-run createFunctions.sql for coverexpiredshorts and chargeborrowfees
+BEGIN;
+
+-- when the borrow fee was last charged for an open short; NULL means since it was sold
+ALTER TABLE ottobroker.fakestocks ADD COLUMN IF NOT EXISTS borrow_charged TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS fakestocks_open_shorts_idx ON ottobroker.fakestocks(ticker) WHERE purchased IS NULL;
+
+COMMIT;
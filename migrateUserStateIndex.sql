@@ -0,0 +1,3 @@
+-- lets the per-user ETag lookup read a user's last transaction id from the index alone.
+-- CONCURRENTLY keeps trades running while it builds, so this can't run inside a transaction block
+CREATE INDEX CONCURRENTLY IF NOT EXISTS faketransactions_userid_id_idx ON ottobroker.faketransactions(userid, id);
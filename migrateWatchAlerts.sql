@@ -0,0 +1,2 @@
+-- remembers which watches already alerted so a restart doesn't re-arm them
+ALTER TABLE ottobroker.watches ADD COLUMN IF NOT EXISTS alerted TIMESTAMP;
@@ -0,0 +1,96 @@
+import logging
+import queue
+import threading
+from decimal import Decimal
+
+from thresholdIndex import ThresholdIndex
+
+_logger = logging.getLogger()
+
+
+class OrderBook():
+    LIMIT = 'limit'
+    STOP = 'stop'
+    ORDER_TYPES = (LIMIT, STOP)
+
+    BUY_ACTIONS = ('buy_long', 'buy_short')
+    SELL_ACTIONS = ('sell_long', 'sell_short')
+
+    # resting orders sit in per-symbol books sorted by trigger price, so a tick only touches the orders it crosses.
+    # crossed orders are handed to execute(order, price) on a single worker thread, in the order they triggered.
+    # execute runs holding guard, so whoever reloads the book under the same lock never sees a fill half done
+    def __init__(self, execute, guard=None):
+        self._execute = execute
+        self._guard = guard if guard is not None else threading.Lock()
+        self._index = ThresholdIndex()
+        self._orders = {}
+        self._lock = threading.Lock()
+        # bumped on every load so orders queued from a previous load (e.g. before a test mode toggle) are dropped
+        self._generation = 0
+        self._queue = queue.Queue()
+        self._thread = None
+
+    @classmethod
+    def direction(cls, action, order_type):
+        # limits buy at or below / sell at or above their price, stops the other way round
+        buying = action in cls.BUY_ACTIONS
+        if order_type == cls.LIMIT:
+            return ThresholdIndex.BELOW if buying else ThresholdIndex.ABOVE
+        return ThresholdIndex.ABOVE if buying else ThresholdIndex.BELOW
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='order-executor', daemon=True)
+        self._thread.start()
+
+    def load(self, order_list):
+        with self._lock:
+            self._generation += 1
+            self._index.clear()
+            self._orders = {}
+        for order in order_list:
+            self.add(order)
+        _logger.info('Loaded {} resting orders into the order book'.format(len(order_list)))
+        return len(order_list)
+
+    def add(self, order):
+        with self._lock:
+            self._orders[order.id] = order
+            self._index.add(order.id, order.ticker_symbol, Decimal(order.trigger_price),
+                            self.direction(order.action, order.order_type))
+
+    def remove(self, order_id):
+        with self._lock:
+            self._index.remove(order_id)
+            return self._orders.pop(order_id, None)
+
+    def on_prices(self, prices):
+        with self._lock:
+            generation = self._generation
+            for symbol, price in prices.items():
+                for order_id in self._index.pop_crossed(symbol, price):
+                    order = self._orders.pop(order_id, None)
+                    if order is not None:
+                        self._queue.put((generation, order, price))
+
+    def _run(self):
+        while True:
+            generation, order, price = self._queue.get()
+            with self._guard:
+                if generation != self._generation:
+                    continue
+                try:
+                    self._execute(order, price)
+                except Exception:
+                    _logger.exception('executing order {} failed'.format(order.id))
+
+    def symbols(self):
+        return self._index.symbols()
+
+    def get_stats(self):
+        return {
+            'resting_orders': len(self._index),
+            'symbols': len(self._index.symbols()),
+            'queued_executions': self._queue.qsize()
+        }
@@ -1,81 +1,364 @@
 from dataContainers import *
+import queryLog
 
 import psycopg2
 import psycopg2.extras
+import psycopg2.extensions
+import psycopg2.pool
 
+import collections
 import datetime
 import logging
+import select
+import threading
+import time
 import pickle
 import copy
 
 _logger = logging.getLogger()
 
+class _PreparingConnection(psycopg2.extensions.connection):
+    # remembers which statements have been PREPAREd on this server session
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
 class PostgresWrapper():
-    def __init__(self, connectionString, force_quiet=False):
+    USER_CHANGED_CHANNEL = 'ottobroker_user_changed'
+    ORDER_COLUMNS = """o.id, o.userid, o.ticker, o.action, o.ordertype, o.trigger_price, o.quantity, o.status,
+            o.created, o.closed, o.fill_price, o.message, a.apikey"""
+    STATEMENT_PREFIX = 'ottobroker_'
+
+    # raised by EXECUTE when the statement is gone (DISCARD ALL, a pooler handing out another session)
+    STATEMENT_MISSING_PGCODE = '26000'
+    # feature_not_supported covers much more than plans, only this message means a schema change altered
+    # the result columns of a cached plan
+    PLAN_CHANGED_PGCODE = '0A000'
+    PLAN_CHANGED_MSG = 'cached plan must not change result type'
+
+    def __init__(self, connectionString, force_quiet=False, replica_connection_string=None, read_your_writes_window=5,
+                 pool_size=10, prepare_statements=True):
         self.connection_string = connectionString
         self.force_quiet = force_quiet
-    
-    def _query_wrapper(self, query, vals=None, doFetch=True, do_log=True):
+
+        # read-only queries go to the replica unless the user they are about wrote to the primary recently
+        self.replica_connection_string = replica_connection_string
+        self._read_your_writes_window = read_your_writes_window
+        self._recent_writes = {}
+        self._all_pinned = None
+        self._routing_lock = threading.Lock()
+        self._routing_stats = collections.Counter()
+
+        # one pool per server; the semaphore makes callers wait for a free connection instead of
+        # getting a PoolError when every connection is checked out
+        self._pool_size = pool_size
+        self._pools = {}
+        self._pool_slots = {}
+        self._pool_lock = threading.Lock()
+        # opening a pool connects every one of its connections, so that happens under this lock instead of
+        # _pool_lock, which the statement stats and every checkout also take
+        self._pool_create_lock = threading.Lock()
+
+        self._prepare_statements = prepare_statements
+        self._statement_stats = collections.Counter()
+        # statement name -> query, recorded on first PREPARE so warm_up can prepare it on every pooled connection
+        self._statement_queries = {}
+
+    def _route(self, read_only, user_id):
+        with self._routing_lock:
+            if not read_only:
+                self._routing_stats['primary_writes'] += 1
+                return self.connection_string
+            if self.replica_connection_string is None:
+                self._routing_stats['primary_reads'] += 1
+                return self.connection_string
+
+            if self._all_pinned is not None:
+                if time.monotonic() - self._all_pinned < self._read_your_writes_window:
+                    self._routing_stats['pinned_reads'] += 1
+                    return self.connection_string
+                self._all_pinned = None
+
+            written = self._recent_writes.get(user_id) if user_id is not None else None
+            if written is not None:
+                if time.monotonic() - written < self._read_your_writes_window:
+                    self._routing_stats['pinned_reads'] += 1
+                    return self.connection_string
+                del self._recent_writes[user_id]
+
+            self._routing_stats['replica_reads'] += 1
+            return self.replica_connection_string
+
+    def _note_writes(self, user_ids):
+        if self.replica_connection_string is None:
+            return
+        now = time.monotonic()
+        with self._routing_lock:
+            for user_id in user_ids:
+                self._recent_writes[user_id] = now
+            if len(self._recent_writes) > 10000:
+                self._recent_writes = {u: t for u, t in self._recent_writes.items() if now - t < self._read_your_writes_window}
+
+    def pin_to_primary(self, user_id=None):
+        # another worker wrote to the primary, so the replica may not have the change yet; None pins every user
+        if user_id is not None:
+            self._note_writes([user_id])
+        elif self.replica_connection_string is not None:
+            with self._routing_lock:
+                self._all_pinned = time.monotonic()
+
+    def _get_pool(self, connection_string):
+        with self._pool_lock:
+            if connection_string in self._pools:
+                return self._pools[connection_string], self._pool_slots[connection_string]
+
+        with self._pool_create_lock:
+            with self._pool_lock:
+                if connection_string in self._pools:
+                    return self._pools[connection_string], self._pool_slots[connection_string]
+            # psycopg2 closes every connection handed back beyond minconn, so minconn is the full size for
+            # connections (and their prepared statements) to be reused; the constructor opens all of them at once
+            pool = psycopg2.pool.ThreadedConnectionPool(self._pool_size, self._pool_size, connection_string,
+                                                        connection_factory=_PreparingConnection)
+            with self._pool_lock:
+                self._pools[connection_string] = pool
+                self._pool_slots[connection_string] = threading.BoundedSemaphore(self._pool_size)
+                return pool, self._pool_slots[connection_string]
+
+    def _checkout(self, connection_string, timeout=None):
+        # returns None if no connection freed up within timeout
+        pool, slots = self._get_pool(connection_string)
+        if not slots.acquire(timeout=timeout):
+            return None
+        try:
+            connection = pool.getconn()
+            if connection.closed:
+                pool.putconn(connection, close=True)
+                connection = pool.getconn()
+        except Exception:
+            slots.release()
+            raise
+        return connection_string, connection
+
+    def _checkin(self, checkout, discard=False):
+        connection_string, connection = checkout
+        pool, slots = self._get_pool(connection_string)
+        try:
+            pool.putconn(connection, close=discard or connection.closed)
+        finally:
+            slots.release()
+
+    def _connect(self, connection_string):
+        try:
+            return self._checkout(connection_string)
+        except psycopg2.OperationalError:
+            if connection_string == self.connection_string:
+                raise
+            _logger.exception('replica unavailable, reading from the primary instead')
+            with self._routing_lock:
+                self._routing_stats['replica_failures'] += 1
+            return self._checkout(self.connection_string)
+
+    def warm_up(self, deadline):
+        # opens every pooled connection to the primary and replica and prepares the statements run so far on each,
+        # giving up on whatever is left once time.monotonic() passes deadline
+        result = collections.Counter({'connections': 0, 'prepared': 0})
+        with self._pool_lock:
+            statements = dict(self._statement_queries) if self._prepare_statements else {}
+
+        for connection_string in [self.connection_string, self.replica_connection_string]:
+            if connection_string is None:
+                continue
+            checkouts = []
+            try:
+                while len(checkouts) < self._pool_size:
+                    remaining = deadline - time.monotonic()
+                    checkout = self._checkout(connection_string, timeout=remaining) if remaining > 0 else None
+                    if checkout is None:
+                        break
+                    checkouts.append(checkout)
+                    result['connections'] += 1
+
+                for _, connection in checkouts:
+                    if time.monotonic() >= deadline:
+                        break
+                    cursor = connection.cursor()
+                    for name, query in statements.items():
+                        if name not in connection.prepared:
+                            cursor.execute('PREPARE ' + name + ' AS ' + self._positional(query))
+                            connection.prepared.add(name)
+                            result['prepared'] += 1
+                    cursor.close()
+                    connection.commit()
+            except Exception:
+                for checkout in checkouts:
+                    self._checkin(checkout, discard=True)
+                raise
+            for checkout in checkouts:
+                self._checkin(checkout)
+
+        with self._pool_lock:
+            self._statement_stats['prepares'] += result['prepared']
+        return dict(result)
+
+    def get_routing_stats(self):
+        with self._routing_lock:
+            stats = dict(self._routing_stats)
+            stats['replica_configured'] = self.replica_connection_string is not None
+            stats['pinned_users'] = len(self._recent_writes)
+        return stats
+
+    def get_statement_stats(self):
+        with self._pool_lock:
+            stats = dict(self._statement_stats)
+            stats['prepare_enabled'] = self._prepare_statements
+            stats['pool_size'] = self._pool_size
+            stats['pools'] = len(self._pools)
+        return stats
+
+    @staticmethod
+    def _positional(query):
+        # the psycopg2 %s placeholders become $1..$n for PREPARE
+        parts = query.split('%s')
+        return parts[0] + ''.join(['${}{}'.format(i, part) for i, part in enumerate(parts[1:], 1)])
+
+    def _execute(self, connection, cursor, query, vals, statement):
+        if statement is None or not self._prepare_statements:
+            cursor.execute(query, vals)
+            return
+
+        name = self.STATEMENT_PREFIX + statement
+        if name not in connection.prepared:
+            cursor.execute('PREPARE ' + name + ' AS ' + self._positional(query))
+            connection.prepared.add(name)
+            with self._pool_lock:
+                self._statement_stats['prepares'] += 1
+                self._statement_queries[name] = query
+
+        execute = 'EXECUTE ' + name
+        if vals:
+            execute += ' (' + ', '.join(['%s'] * len(vals)) + ')'
+        try:
+            cursor.execute(execute, vals)
+            with self._pool_lock:
+                self._statement_stats['prepared_executions'] += 1
+        except psycopg2.Error as e:
+            missing = e.pgcode == self.STATEMENT_MISSING_PGCODE
+            plan_changed = e.pgcode == self.PLAN_CHANGED_PGCODE and self.PLAN_CHANGED_MSG in str(e.pgerror)
+            if not missing and not plan_changed:
+                raise
+            # drop the stale statement and run the plain text; it is prepared again on next use
+            _logger.warning('prepared statement {} is no longer valid ({}), running it unprepared'.format(name, e.pgcode))
+            connection.rollback()
+            connection.prepared.discard(name)
+            cursor.execute('DEALLOCATE ALL' if missing else 'DEALLOCATE ' + name)
+            if missing:
+                connection.prepared.clear()
+            with self._pool_lock:
+                self._statement_stats['invalid_fallbacks'] += 1
+            cursor.execute(query, vals)
+
+    def _query_wrapper(self, query, vals=None, doFetch=True, do_log=True, read_only=False, user_id=None, statement=None):
+        # statement names the query so it is PREPAREd once per pooled connection and then run with EXECUTE
         if vals is None:
             vals = []
         retry = True
-        connection = None
+        checkout = None
         cursor = None
         while(retry):
             try:
-                connection = psycopg2.connect(self.connection_string)
+                checkout = self._connect(self._route(read_only, user_id))
+                connection = checkout[1]
                 cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-                if do_log and not self.force_quiet:
+                if do_log and not self.force_quiet and queryLog.sampled():
                     _logger.info('making Query: ' + query + ' with vals: {}'.format(vals))
-                cursor.execute(query, vals)
-                connection.commit()
-                result = None
-                if(doFetch):
-                    result = cursor.fetchall()
+                started = time.perf_counter()
+                error = None
+                try:
+                    self._execute(connection, cursor, query, vals, statement)
+                    connection.commit()
+                    result = None
+                    if(doFetch):
+                        result = cursor.fetchall()
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    queryLog.record('query', query, vals, started, error=error)
                 cursor.close()
-                connection.close()
+                self._checkin(checkout)
+                checkout = None
+                if not read_only and user_id is not None:
+                    self._note_writes([user_id])
                 return result
             except psycopg2.InternalError as e:
                 cursor.close()
-                connection.close()
+                self._checkin(checkout, discard=True)
+                checkout = None
                 if e.pgcode:
                     _logger.error("psycopg2 error code: " + str(e.pgcode))
                 if not retry:
                     raise e
                 retry = False
+            finally:
+                if checkout is not None:
+                    # any other failure leaves the session in an unknown state, so it is not reused
+                    self._checkin(checkout, discard=True)
+                    checkout = None
 
     def broker_create_user(self, user_id, display_name, api_key):
-        result_table = self._query_wrapper("SELECT ottobroker.createuser(%s, %s, %s);", [user_id, display_name, api_key])
+        result_table = self._query_wrapper("SELECT ottobroker.createuser(%s, %s, %s);", [user_id, display_name, api_key], user_id=user_id, statement='create_user')
         return result_table[0][0]
     
     def broker_get_single_user(self, user_id):
-        result = self._query_wrapper("SELECT * FROM ottobroker.users WHERE id=%s;", [user_id])
+        result = self._query_wrapper("SELECT * FROM ottobroker.users WHERE id=%s;", [user_id], read_only=True, user_id=user_id, statement='get_user')
         if len(result) > 0:
             return BrokerUser(result[0])
         else:
             return None
     
     def broker_get_all_user_ids(self):
-        rawVals = self._query_wrapper("SELECT id FROM ottobroker.users;", [])
+        rawVals = self._query_wrapper("SELECT id FROM ottobroker.users;", [], read_only=True, statement='get_user_ids')
         result = []
         for row in rawVals:
             result.append(row[0])
         return result
     
     def broker_get_single_api_users(self, api_key):
-        result = self._query_wrapper("SELECT * FROM ottobroker.apiusers where apikey=%s;", [api_key])
+        result = self._query_wrapper("SELECT * FROM ottobroker.apiusers where apikey=%s;", [api_key], read_only=True, statement='get_api_user')
         if len(result) > 0:
             return BrokerAPIUser(result[0])
         else:
             return None
     
+    def broker_get_api_users(self):
+        rawVals = self._query_wrapper("SELECT * FROM ottobroker.apiusers;", [], read_only=True)
+        return [BrokerAPIUser(raw) for raw in rawVals]
+
+    def broker_get_lookup_ids(self):
+        # {table: {name: id}} of the type tables createDB.sql fills in; empty ones mean the schema was never loaded
+        rawVals = self._query_wrapper("""SELECT 'fakestocktypes', stocktype, id FROM ottobroker.fakestocktypes
+        UNION ALL SELECT 'faketransactiontypes', txtype, id FROM ottobroker.faketransactiontypes;""", [], read_only=True)
+        result = {'fakestocktypes': {}, 'faketransactiontypes': {}}
+        for table, name, type_id in rawVals:
+            result[table][name] = type_id
+        return result
+
+    def broker_get_held_tickers(self):
+        # every symbol a valuation, watch alert or resting order can ask a price for
+        rawVals = self._query_wrapper("""SELECT ticker FROM ottobroker.fakestocks
+        UNION SELECT ticker FROM ottobroker.watches
+        UNION SELECT ticker FROM ottobroker.orders WHERE status = 'OPEN';""", [], read_only=True)
+        return [row[0] for row in rawVals]
+
     def broker_get_longs_by_user(self, user_id):
         rawVals = self._query_wrapper("""SELECT stocktypeid, userid, ticker, purchase_cost, sell_cost, COUNT(id)
         FROM ottobroker.fakestocks
         WHERE userid=%s AND
             stocktypeid=(SELECT id FROM ottobroker.fakestocktypes WHERE stocktype='LONG') AND
             sold IS NULL
-        GROUP BY stocktypeid, userid, ticker, purchase_cost, sell_cost;""", [user_id])
+        GROUP BY stocktypeid, userid, ticker, purchase_cost, sell_cost;""", [user_id], read_only=True, user_id=user_id, statement='get_longs')
         result = []
         for raw in rawVals:
             result.append(BrokerStock(raw))
@@ -83,11 +366,10 @@ class PostgresWrapper():
     
     def broker_get_historical_longs_by_user(self, user_id):
         rawVals = self._query_wrapper("""SELECT stocktypeid, userid, ticker, purchase_cost, sell_cost, COUNT(id)
-        FROM ottobroker.fakestocks
+        FROM ottobroker.closedstocks
         WHERE userid=%s AND
-            stocktypeid=(SELECT id FROM ottobroker.fakestocktypes WHERE stocktype='LONG') AND
-            sold IS NOT NULL
-        GROUP BY stocktypeid, userid, ticker, purchase_cost, sell_cost;""", [user_id])
+            stocktypeid=(SELECT id FROM ottobroker.fakestocktypes WHERE stocktype='LONG')
+        GROUP BY stocktypeid, userid, ticker, purchase_cost, sell_cost;""", [user_id], read_only=True, user_id=user_id, statement='get_historical_longs')
         result = []
         for raw in rawVals:
             result.append(BrokerStock(raw))
@@ -99,7 +381,7 @@ class PostgresWrapper():
         WHERE userid=%s AND
             stocktypeid=(SELECT id FROM ottobroker.fakestocktypes WHERE stocktype='SHORT') AND
             purchased IS NULL
-        GROUP BY stocktypeid, userid, ticker, purchase_cost, sell_cost;""", [user_id])
+        GROUP BY stocktypeid, userid, ticker, purchase_cost, sell_cost;""", [user_id], read_only=True, user_id=user_id, statement='get_shorts')
         result = []
         for raw in rawVals:
             result.append(BrokerStock(raw))
@@ -107,38 +389,115 @@ class PostgresWrapper():
     
     def broker_get_historical_shorts_by_user(self, user_id):
         rawVals = self._query_wrapper("""SELECT stocktypeid, userid, ticker, purchase_cost, sell_cost, COUNT(id)
-        FROM ottobroker.fakestocks
+        FROM ottobroker.closedstocks
         WHERE userid=%s AND
-            stocktypeid=(SELECT id FROM ottobroker.fakestocktypes WHERE stocktype='SHORT') AND
-            purchased IS NOT NULL
-        GROUP BY stocktypeid, userid, ticker, purchase_cost, sell_cost;""", [user_id])
+            stocktypeid=(SELECT id FROM ottobroker.fakestocktypes WHERE stocktype='SHORT')
+        GROUP BY stocktypeid, userid, ticker, purchase_cost, sell_cost;""", [user_id], read_only=True, user_id=user_id, statement='get_historical_shorts')
         result = []
         for raw in rawVals:
             result.append(BrokerStock(raw))
         return result
     
+    # per (user, ticker) aggregates of open lots and realized P&L of closed ones; {where} narrows both halves
+    POSITION_SUMMARY_QUERY = """SELECT userid, ticker,
+            sum(long_count)::int, coalesce(sum(long_cost), 0), sum(short_count)::int, coalesce(sum(short_proceeds), 0),
+            coalesce(sum(realized_pnl), 0), sum(closed_count)::int
+        FROM (
+            SELECT userid, ticker,
+                count(*) FILTER (WHERE stocktypeid = l.id AND sold IS NULL) AS long_count,
+                sum(purchase_cost) FILTER (WHERE stocktypeid = l.id AND sold IS NULL) AS long_cost,
+                count(*) FILTER (WHERE stocktypeid = s.id AND purchased IS NULL) AS short_count,
+                sum(sell_cost) FILTER (WHERE stocktypeid = s.id AND purchased IS NULL) AS short_proceeds,
+                NULL::numeric AS realized_pnl,
+                0 AS closed_count
+            FROM ottobroker.fakestocks,
+                (SELECT id FROM ottobroker.fakestocktypes WHERE stocktype='LONG') l,
+                (SELECT id FROM ottobroker.fakestocktypes WHERE stocktype='SHORT') s
+            {where}
+            GROUP BY userid, ticker
+            UNION ALL
+            SELECT userid, ticker, 0, NULL, 0, NULL, sum(sell_cost - purchase_cost), count(*)
+            FROM ottobroker.closedstocks
+            {where}
+            GROUP BY userid, ticker
+        ) positions
+        GROUP BY userid, ticker
+        ORDER BY userid, ticker;"""
+
+    def broker_get_position_summaries(self, user_id):
+        rawVals = self._query_wrapper(self.POSITION_SUMMARY_QUERY.format(where='WHERE userid=%s'), [user_id, user_id],
+            read_only=True, user_id=user_id, statement='get_position_summaries')
+        return [BrokerPositionSummary(raw) for raw in rawVals]
+
+    def broker_get_all_position_summaries(self):
+        rawVals = self._query_wrapper(self.POSITION_SUMMARY_QUERY.format(where=''), [], read_only=True)
+        return [BrokerPositionSummary(raw) for raw in rawVals]
+
+    def broker_get_user_state(self, user_id):
+        # everything a user_info response depends on besides prices: returns (last txid, watch fingerprint, tickers)
+        # or None for an unknown user
+        rawVals = self._query_wrapper("""SELECT u.id,
+            (SELECT max(t.id) FROM ottobroker.faketransactions t WHERE t.userid = u.id),
+            (SELECT md5(string_agg(w.ticker || ':' || w.watch_cost, ',' ORDER BY w.ticker)) FROM ottobroker.watches w WHERE w.userid = u.id),
+            ARRAY(SELECT ticker FROM ottobroker.fakestocks WHERE userid = u.id
+                UNION SELECT ticker FROM ottobroker.closedstocks WHERE userid = u.id
+                UNION SELECT ticker FROM ottobroker.watches WHERE userid = u.id)
+        FROM ottobroker.users u WHERE u.id = %s;""", [user_id], read_only=True, user_id=user_id, statement='get_user_state')
+        if len(rawVals) > 0:
+            return rawVals[0][1], rawVals[0][2], rawVals[0][3]
+        return None
+
+    def broker_get_global_state(self):
+        # (last txid, user count, watch fingerprint) across every user, for all_users
+        rawVals = self._query_wrapper("""SELECT (SELECT max(id) FROM ottobroker.faketransactions),
+            (SELECT count(*) FROM ottobroker.users),
+            (SELECT md5(string_agg(userid || ':' || ticker || ':' || watch_cost, ',' ORDER BY userid, ticker)) FROM ottobroker.watches);""",
+            [], read_only=True, statement='get_global_state')
+        return tuple(rawVals[0])
+
+    def broker_get_all_users(self):
+        rawVals = self._query_wrapper("SELECT * FROM ottobroker.users;", [], read_only=True, statement='get_all_users')
+        return [BrokerUser(raw) for raw in rawVals]
+
     def broker_give_money_to_user(self, user_id, amount, reason, api_key):
-        result_table =  self._query_wrapper("SELECT ottobroker.givemoney(%s, %s, %s, %s);", [user_id, amount, reason, api_key])
+        result_table =  self._query_wrapper("SELECT ottobroker.givemoney(%s, %s, %s, %s);", [user_id, amount, reason, api_key], user_id=user_id, statement='give_money')
         return result_table[0][0]
     
+    def broker_give_money_bulk(self, entries, api_key):
+        # entries are (user_id, amount, reason) tuples; returns (entry_index, user_id, txid, status) rows in entry order
+        user_ids = [e[0] for e in entries]
+        amounts = [e[1] for e in entries]
+        reasons = [e[2] for e in entries]
+        result = self._query_wrapper("SELECT * FROM ottobroker.givemoneybulk(%s::varchar[], %s::numeric[], %s::varchar[], %s);",
+            [user_ids, amounts, reasons, api_key], statement='give_money_bulk')
+        self._note_writes(set(user_ids))
+        return result
+    
     def broker_buy_long(self, user_id, ticker_symbol, ticker_value, quantity, api_key):
-        result_table =  self._query_wrapper("SELECT ottobroker.buylong(%s, %s, %s, %s, %s);", [user_id, ticker_symbol, ticker_value, quantity, api_key])
+        result_table =  self._query_wrapper("SELECT ottobroker.buylong(%s, %s, %s, %s, %s);", [user_id, ticker_symbol, ticker_value, quantity, api_key], user_id=user_id, statement='buy_long')
         return result_table[0][0]
     
     def broker_sell_long(self, user_id, ticker_symbol, ticker_value, quantity, api_key):
-        result_table = self._query_wrapper("SELECT ottobroker.selllong(%s, %s, %s, %s, %s);", [user_id, ticker_symbol, ticker_value, quantity, api_key])
+        result_table = self._query_wrapper("SELECT ottobroker.selllong(%s, %s, %s, %s, %s);", [user_id, ticker_symbol, ticker_value, quantity, api_key], user_id=user_id, statement='sell_long')
         return result_table[0][0]
     
     def broker_buy_short(self, user_id, ticker_symbol, ticker_value, quantity, api_key):
-        result_table =  self._query_wrapper("SELECT ottobroker.buyshort(%s, %s, %s, %s, %s);", [user_id, ticker_symbol, ticker_value, quantity, api_key])
+        result_table =  self._query_wrapper("SELECT ottobroker.buyshort(%s, %s, %s, %s, %s);", [user_id, ticker_symbol, ticker_value, quantity, api_key], user_id=user_id, statement='buy_short')
         return result_table[0][0]
     
     def broker_sell_short(self, user_id, ticker_symbol, ticker_value, quantity, api_key):
-        result_table = self._query_wrapper("SELECT ottobroker.sellshort(%s, %s, %s, %s, %s);", [user_id, ticker_symbol, ticker_value, quantity, api_key])
+        result_table = self._query_wrapper("SELECT ottobroker.sellshort(%s, %s, %s, %s, %s);", [user_id, ticker_symbol, ticker_value, quantity, api_key], user_id=user_id, statement='sell_short')
         return result_table[0][0]
     
     def broker_get_watches(self, user_id):
-        rawVals = self._query_wrapper("SELECT * from ottobroker.watches WHERE userid=%s;", [user_id])
+        rawVals = self._query_wrapper("SELECT * from ottobroker.watches WHERE userid=%s;", [user_id], read_only=True, user_id=user_id, statement='get_watches')
+        result = []
+        for raw in rawVals:
+            result.append(BrokerWatch(raw))
+        return result
+    
+    def broker_get_all_watches(self):
+        rawVals = self._query_wrapper("SELECT * from ottobroker.watches;", [], read_only=True, statement='get_all_watches')
         result = []
         for raw in rawVals:
             result.append(BrokerWatch(raw))
@@ -146,10 +505,118 @@ class PostgresWrapper():
     
     def broker_update_watch(self, user_id, symbol, value):
         # TODO: figure out how to verify this actually 'worked'
-        self._query_wrapper("UPDATE ottobroker.watches set watch_cost=%s WHERE userid=%s and ticker=%s;", [value, user_id, symbol], doFetch=False)
+        self._query_wrapper("UPDATE ottobroker.watches set watch_cost=%s, alerted=NULL WHERE userid=%s and ticker=%s;", [value, user_id, symbol], doFetch=False, user_id=user_id, statement='update_watch')
     
     def broker_create_watch(self, user_id, symbol, value):
-        return self._query_wrapper("INSERT INTO ottobroker.watches (userid, ticker, watch_cost) VALUES (%s, %s, %s) RETURNING id;", [user_id, symbol, value])[0][0]
+        return self._query_wrapper("INSERT INTO ottobroker.watches (userid, ticker, watch_cost) VALUES (%s, %s, %s) RETURNING id;", [user_id, symbol, value], user_id=user_id, statement='create_watch')[0][0]
     
+    def broker_mark_watches_alerted(self, watches):
+        # watches are (user_id, symbol, watch_cost); a watch set again at another cost since it fired stays armed
+        self._query_wrapper("""UPDATE ottobroker.watches w SET alerted = now()
+        FROM unnest(%s::varchar[], %s::varchar[], %s::numeric[]) AS a(userid, ticker, watch_cost)
+        WHERE w.userid = a.userid AND w.ticker = a.ticker AND w.watch_cost = a.watch_cost;""",
+            [[w[0] for w in watches], [w[1] for w in watches], [w[2] for w in watches]], doFetch=False)
+
     def broker_remove_watch(self, user_id, symbol):
-        self._query_wrapper("DELETE FROM ottobroker.watches WHERE userid=%s and ticker=%s;", [user_id, symbol], doFetch=False)
\ No newline at end of file
+        self._query_wrapper("DELETE FROM ottobroker.watches WHERE userid=%s and ticker=%s;", [user_id, symbol], doFetch=False, user_id=user_id, statement='remove_watch')
+    
+    def broker_create_order(self, user_id, ticker_symbol, action, order_type, trigger_price, quantity, api_key):
+        rawVals = self._query_wrapper("""WITH o AS (
+            INSERT INTO ottobroker.orders (userid, ticker, action, ordertype, trigger_price, quantity, status, created, apiuserid)
+            SELECT %s, %s, %s, %s, %s, %s, 'OPEN', now(), id FROM ottobroker.apiusers WHERE apikey=%s
+            RETURNING *
+        )
+        SELECT """ + self.ORDER_COLUMNS + " FROM o JOIN ottobroker.apiusers a ON a.id = o.apiuserid;",
+            [user_id, ticker_symbol, action, order_type, trigger_price, quantity, api_key], user_id=user_id)
+        if len(rawVals) > 0:
+            return BrokerOrder(rawVals[0])
+        return None
+
+    def broker_get_open_orders(self):
+        rawVals = self._query_wrapper("SELECT " + self.ORDER_COLUMNS + """
+        FROM ottobroker.orders o JOIN ottobroker.apiusers a ON a.id = o.apiuserid
+        WHERE o.status = 'OPEN';""")
+        return [BrokerOrder(raw) for raw in rawVals]
+
+    def broker_get_orders_by_user(self, user_id, limit):
+        rawVals = self._query_wrapper("SELECT " + self.ORDER_COLUMNS + """
+        FROM ottobroker.orders o JOIN ottobroker.apiusers a ON a.id = o.apiuserid
+        WHERE o.userid = %s
+        ORDER BY o.id DESC LIMIT %s;""", [user_id, limit], read_only=True, user_id=user_id)
+        return [BrokerOrder(raw) for raw in rawVals]
+
+    def broker_cancel_order(self, order_id, user_id):
+        return len(self._query_wrapper("""UPDATE ottobroker.orders SET status = 'CANCELLED', closed = now()
+        WHERE id = %s AND userid = %s AND status = 'OPEN' RETURNING id;""", [order_id, user_id], user_id=user_id)) > 0
+
+    def broker_claim_order(self, order_id):
+        # OPEN -> FILLING, so a cancel that races the execution either wins outright or fails
+        return len(self._query_wrapper("""UPDATE ottobroker.orders SET status = 'FILLING'
+        WHERE id = %s AND status = 'OPEN' RETURNING id;""", [order_id])) > 0
+
+    def broker_close_order(self, order_id, status, fill_price, message):
+        self._query_wrapper("""UPDATE ottobroker.orders SET status = %s, closed = now(), fill_price = %s, message = %s
+        WHERE id = %s;""", [status, fill_price, message, order_id], doFetch=False)
+
+    def broker_interrupt_filling_orders(self):
+        # orders left FILLING by a crash may or may not have traded, so they are parked for a human to check
+        rawVals = self._query_wrapper("""UPDATE ottobroker.orders SET status = 'INTERRUPTED', closed = now(),
+            message = 'broker stopped while the order was executing'
+        WHERE status = 'FILLING' RETURNING id;""")
+        return [row[0] for row in rawVals]
+
+    def broker_get_expired_short_tickers(self, max_age_seconds):
+        # only picks which tickers to quote; coverexpiredshorts re-checks every short on the primary, and a short
+        # old enough to expire is long past any replica lag
+        rawVals = self._query_wrapper("""SELECT DISTINCT ticker FROM ottobroker.fakestocks
+        WHERE stocktypeid=(SELECT id FROM ottobroker.fakestocktypes WHERE stocktype='SHORT') AND
+            purchased IS NULL AND
+            coalesce(expiration, sold + make_interval(secs => %s)) <= now();""", [max_age_seconds], read_only=True)
+        return [row[0] for row in rawVals]
+
+    def broker_cover_expired_shorts(self, prices, max_age_seconds, api_key):
+        # prices maps ticker to the price the expired shorts are bought back at;
+        # returns (user_id, ticker, quantity, txid) rows, one per covering transaction
+        tickers = list(prices)
+        result = self._query_wrapper("SELECT * FROM ottobroker.coverexpiredshorts(%s::varchar[], %s::numeric[], make_interval(secs => %s), %s);",
+            [tickers, [prices[t] for t in tickers], max_age_seconds, api_key])
+        self._note_writes(set([row[0] for row in result]))
+        return result
+
+    def broker_charge_borrow_fees(self, daily_rate, api_key):
+        # returns (user_id, fee, txid) rows, one per charged user
+        result = self._query_wrapper("SELECT * FROM ottobroker.chargeborrowfees(%s, %s);", [daily_rate, api_key])
+        self._note_writes(set([row[0] for row in result]))
+        return result
+
+    def broker_notify_users_changed(self, user_ids, sender):
+        self._query_wrapper("SELECT pg_notify(%s, %s || ':' || u) FROM unnest(%s::varchar[]) u;",
+            [self.USER_CHANGED_CHANNEL, sender, list(user_ids)], do_log=False)
+
+    def listen_users_changed(self, callback, poll_interval=5):
+        # callback gets (sender, user_id) for every notification, and (None, None) whenever notifications may
+        # have been missed because the listening connection was (re)established
+        def run():
+            while True:
+                connection = None
+                try:
+                    connection = psycopg2.connect(self.connection_string)
+                    connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                    connection.cursor().execute('LISTEN ' + self.USER_CHANGED_CHANNEL + ';')
+                    callback(None, None)
+                    while True:
+                        if select.select([connection], [], [], poll_interval) == ([], [], []):
+                            continue
+                        connection.poll()
+                        while connection.notifies:
+                            sender, _, user_id = connection.notifies.pop(0).payload.partition(':')
+                            callback(sender, user_id)
+                except Exception:
+                    _logger.exception('lost the {} listener, reconnecting'.format(self.USER_CHANGED_CHANNEL))
+                    if connection is not None:
+                        connection.close()
+                    time.sleep(poll_interval)
+
+        thread = threading.Thread(target=run, name='user-changed-listener', daemon=True)
+        thread.start()
+        return thread
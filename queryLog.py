@@ -0,0 +1,35 @@
+import logging
+import random
+import time
+
+_logger = logging.getLogger()
+_slow_logger = logging.getLogger('ottobroker.slow')
+
+SLOW_LOGGER_NAME = _slow_logger.name
+
+_sample_rate = 1.0
+_slow_threshold = None
+
+
+def configure(sample_rate=1.0, slow_threshold_ms=None):
+    global _sample_rate, _slow_threshold
+    _sample_rate = max(0.0, min(1.0, float(sample_rate)))
+    _slow_threshold = None if slow_threshold_ms is None else float(slow_threshold_ms) / 1000
+
+
+def sampled():
+    return _sample_rate >= 1.0 or random.random() < _sample_rate
+
+
+def record(kind, description, params, started, error=None):
+    # started is a time.perf_counter() value taken before the call; error is set when the call raised,
+    # since a timeout or lock wait that ends in an error is usually the slowest call of all
+    duration = time.perf_counter() - started
+    if _slow_threshold is not None and duration >= _slow_threshold:
+        message = 'slow {} took {:.1f}ms: {}'.format(kind, duration * 1000, description)
+        if params is not None:
+            message += ' with vals: {}'.format(params)
+        if error is not None:
+            message += ' failed with: {!r}'.format(error)
+        _slow_logger.warning(message)
+    return duration
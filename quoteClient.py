@@ -0,0 +1,191 @@
+import collections
+import concurrent.futures
+import json
+import logging
+import threading
+import time
+from decimal import Decimal
+
+from webWrapper import RestWrapper
+from circuitBreaker import CircuitBreaker
+
+_logger = logging.getLogger()
+
+Quote = collections.namedtuple('Quote', ['value', 'name', 'fetched', 'stale'])
+QuoteFailure = collections.namedtuple('QuoteFailure', ['message'])
+
+
+class QuoteError(Exception):
+    pass
+
+
+class _Flight():
+    def __init__(self, symbols):
+        self.symbols = symbols
+        self.done = threading.Event()
+        self.quotes = None
+
+
+class QuoteClient():
+    BATCH_ENDPOINT = '/stock/market/batch/'
+
+    PROVIDER_UNAVAILABLE_MSG = 'Quote provider unavailable'
+
+    def __init__(self, base_url, max_batch_symbols=100, max_fetch_workers=4, failure_threshold=3, reset_timeout=30):
+        self._rest = RestWrapper(base_url, {})
+        self._breaker = CircuitBreaker('quotes', failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+
+        # symbol -> most recent successful Quote, used to value portfolios while the provider is down
+        self._last_known = {}
+        # bumped whenever a fetched price differs from the last known one; each symbol keeps the value of its last bump
+        self._price_version = 0
+        self._price_versions = {}
+
+        self._max_batch_symbols = max_batch_symbols
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_fetch_workers, thread_name_prefix='quote-fetch')
+
+        # symbol -> the upstream batch currently fetching it
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+        self._stats = collections.Counter()
+
+    def get_quotes(self, symbol_list, allow_stale=False):
+        symbols = list(dict.fromkeys(symbol_list))
+        joined = []
+        own_flights = []
+        provider_available = True
+
+        with self._lock:
+            self._stats['requests'] += 1
+            missing = []
+            for symbol in symbols:
+                flight = self._in_flight.get(symbol)
+                if flight is None:
+                    missing.append(symbol)
+                elif flight not in joined:
+                    joined.append(flight)
+
+            if joined:
+                self._stats['coalesced_calls'] += 1
+                self._stats['coalesced_symbols'] += len(symbols) - len(missing)
+                if not missing:
+                    self._stats['fully_coalesced_calls'] += 1
+
+            if missing and not self._breaker.allow():
+                provider_available = False
+                self._stats['rejected_calls'] += 1
+                missing = []
+
+            for i in range(0, len(missing), self._max_batch_symbols):
+                flight = _Flight(missing[i:i + self._max_batch_symbols])
+                for symbol in flight.symbols:
+                    self._in_flight[symbol] = flight
+                own_flights.append(flight)
+            if own_flights:
+                self._stats['issued_calls'] += 1
+                self._stats['issued_batches'] += len(own_flights)
+
+        if len(own_flights) == 1:
+            self._run_flight(own_flights[0])
+        elif own_flights:
+            concurrent.futures.wait([self._executor.submit(self._run_flight, flight) for flight in own_flights])
+
+        result = {}
+        for flight in joined + own_flights:
+            flight.done.wait()
+            for symbol in flight.symbols:
+                if symbol in flight.quotes:
+                    result[symbol] = flight.quotes[symbol]
+        if not provider_available:
+            for symbol in symbols:
+                if symbol not in result:
+                    result[symbol] = QuoteFailure(self.PROVIDER_UNAVAILABLE_MSG)
+
+        if allow_stale:
+            for symbol in symbols:
+                if isinstance(result.get(symbol), QuoteFailure) and symbol in self._last_known:
+                    result[symbol] = self._last_known[symbol]._replace(stale=True)
+
+        return {symbol: result[symbol] for symbol in symbols if symbol in result}
+
+    def _run_flight(self, flight):
+        try:
+            flight.quotes = self._fetch(flight.symbols)
+            self._breaker.record_success()
+            with self._lock:
+                for symbol, quote in flight.quotes.items():
+                    previous = self._last_known.get(symbol)
+                    if previous is None or previous.value != quote.value:
+                        self._price_version += 1
+                        self._price_versions[symbol] = self._price_version
+                self._last_known.update(flight.quotes)
+        except Exception as e:
+            self._breaker.record_failure()
+            if isinstance(e, QuoteError):
+                _logger.error('Quote batch for {} failed: {}'.format(','.join(flight.symbols), e))
+            else:
+                _logger.exception(e)
+            with self._lock:
+                self._stats['failed_batches'] += 1
+            # report the failure against each symbol of the chunk instead of failing the whole call
+            flight.quotes = {symbol: QuoteFailure(str(e)) for symbol in flight.symbols}
+        finally:
+            with self._lock:
+                for symbol in flight.symbols:
+                    if self._in_flight.get(symbol) is flight:
+                        del self._in_flight[symbol]
+            flight.done.set()
+
+    def _fetch(self, symbol_list):
+        unparsed = self._rest.request(
+            self.BATCH_ENDPOINT,
+            {
+                'types': 'quote',
+                'symbols': ','.join(symbol_list)}
+            )
+
+        try:
+            data = json.loads(unparsed)
+        except Exception as e:
+            _logger.exception(e)
+            raise QuoteError('Invalid API response')
+        if data is None:
+            raise QuoteError('Got None from api response')
+        elif not isinstance(data, dict):
+            raise QuoteError('Unexpected data type ' + str(type(data)))
+
+        result = {}
+        fetched = time.time()
+        try:
+            for symbol in symbol_list:
+                if symbol in data:
+                    result[symbol] = Quote(
+                        Decimal(str(data[symbol]['quote']['latestPrice'])),
+                        data[symbol]['quote']['companyName'],
+                        fetched,
+                        False
+                    )
+        except Exception as e:
+            _logger.exception(e)
+            raise QuoteError('Unexpected response format')
+
+        return result
+
+    def get_price_version(self, symbols=None):
+        # the max over a set of symbols changes exactly when one of their prices does;
+        # the breaker state is included because an open breaker turns fresh prices into stale ones
+        with self._lock:
+            if symbols is None:
+                version = self._price_version
+            else:
+                version = max([self._price_versions.get(symbol, 0) for symbol in symbols], default=0)
+        return version, self._breaker.state
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight_symbols'] = len(self._in_flight)
+            stats['last_known_symbols'] = len(self._last_known)
+        stats['breaker_state'] = self._breaker.state
+        return stats
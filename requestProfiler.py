@@ -0,0 +1,121 @@
+import collections
+import cProfile
+import datetime
+import functools
+import io
+import itertools
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+
+_logger = logging.getLogger()
+
+# cProfile names C functions by their owning type or module, e.g. "<method 'execute' of 'psycopg2.extensions.cursor' objects>"
+_C_FUNCTION_OWNER = re.compile(r"of '([\w.]+)' objects|<built-in method ([\w.]+?)\.\w+>")
+
+
+@functools.lru_cache(maxsize=4096)
+def _top_level_module(filename, function_name):
+    if filename == '~':
+        match = _C_FUNCTION_OWNER.search(function_name)
+        return match.group(match.lastindex).split('.')[0] if match else None
+
+    # the longest sys.path entry containing the file gives its import name, e.g. .../lib/python3/http/client.py -> http
+    for entry in sorted([p for p in sys.path if p], key=len, reverse=True):
+        if filename.startswith(entry.rstrip(os.sep) + os.sep):
+            return os.path.splitext(filename[len(entry.rstrip(os.sep)) + 1:])[0].split(os.sep)[0]
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+class RequestProfiler():
+    # cProfile only sees the thread that called start(). work handed to other threads, such as the quote client's
+    # fetch pool, the warm-up thread or the scheduler, is not in the profile; the request thread waiting on it
+    # shows up under 'wait' instead
+    CATEGORY_DB = 'db'
+    CATEGORY_HTTP = 'http'
+    CATEGORY_WAIT = 'wait'
+    CATEGORY_PYTHON = 'python'
+
+    # matched against the top-level module a function belongs to
+    DB_MODULES = ('psycopg2', 'postgresWrapper')
+    HTTP_MODULES = ('urllib', 'http', 'socket', '_socket', 'ssl', '_ssl', 'webWrapper')
+    # select/selectors is the aiohttp event loop idling while an awaited executor call runs
+    WAIT_MODULES = ('_thread', 'threading', 'select', 'selectors')
+
+    TOP_FUNCTION_COUNT = 25
+
+    def __init__(self, sample_rate=0.0, max_profiles=50):
+        self._sample_rate = sample_rate
+        self._profiles = collections.deque(maxlen=max_profiles)
+        self._ids = itertools.count(1)
+        # cProfile can only have one active profiler at a time, so concurrent requests just go unprofiled
+        self._active = threading.Lock()
+
+    def start(self, forced=False):
+        if not forced and (self._sample_rate <= 0 or random.random() >= self._sample_rate):
+            return None
+        if not self._active.acquire(blocking=False):
+            return None
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except Exception:
+            self._active.release()
+            raise
+        return (profile, time.perf_counter(), datetime.datetime.now())
+
+    def finish(self, handle, name, args):
+        profile, started, started_at = handle
+        try:
+            profile.disable()
+        finally:
+            self._active.release()
+        duration = time.perf_counter() - started
+
+        stats = pstats.Stats(profile)
+        breakdown = collections.Counter()
+        for (filename, _, function_name), (_, _, self_time, _, _) in stats.stats.items():
+            breakdown[self._categorize(filename, function_name)] += self_time
+
+        top = io.StringIO()
+        stats.stream = top
+        stats.sort_stats('cumulative').print_stats(self.TOP_FUNCTION_COUNT)
+
+        result = {
+            'id': next(self._ids),
+            'name': name,
+            'args': args,
+            'started': started_at,
+            'duration': round(duration, 6),
+            'breakdown': {category: round(seconds, 6) for category, seconds in breakdown.items()},
+            'top_functions': top.getvalue()
+        }
+        self._profiles.append(result)
+        _logger.info('profiled {} in {:.1f}ms: {}'.format(name, duration * 1000, result['breakdown']))
+        return result
+
+    @classmethod
+    def _categorize(cls, filename, function_name):
+        module = _top_level_module(filename, function_name)
+        if module in cls.DB_MODULES:
+            return cls.CATEGORY_DB
+        if module in cls.HTTP_MODULES:
+            return cls.CATEGORY_HTTP
+        if module in cls.WAIT_MODULES:
+            return cls.CATEGORY_WAIT
+        return cls.CATEGORY_PYTHON
+
+    def list_profiles(self):
+        return [{k: v for k, v in p.items() if k != 'top_functions'} for p in self._profiles]
+
+    def get_profile(self, profile_id):
+        for profile in self._profiles:
+            if profile['id'] == profile_id:
+                return profile
+        return None
@@ -0,0 +1,105 @@
+import datetime
+import logging
+import threading
+import time
+
+_logger = logging.getLogger()
+
+
+class JobScheduler():
+    # runs named jobs on fixed intervals from one background thread.
+    # a job is a callable returning how many rows it processed
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add_job(self, name, interval, func, run_at_start=False):
+        with self._lock:
+            self._jobs[name] = {
+                'func': func,
+                'interval': interval,
+                'next_run': time.monotonic() + (0 if run_at_start else interval),
+                'running': threading.Lock(),
+                'stats': {
+                    'interval': interval,
+                    'runs': 0,
+                    'failures': 0,
+                    'total_rows': 0,
+                    'last_rows': None,
+                    'last_runtime': None,
+                    'last_started': None,
+                    'last_error': None
+                }
+            }
+        self._wake.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run_forever, name='job-scheduler', daemon=True)
+        self._thread.start()
+
+    def _run_forever(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                due = [name for name, job in self._jobs.items() if job['next_run'] <= now]
+                next_run = min([job['next_run'] for job in self._jobs.values()], default=now + 60)
+
+            for name in due:
+                self.run_job(name)
+
+            if not due:
+                self._wake.wait(max(next_run - time.monotonic(), 0))
+                self._wake.clear()
+
+    def run_job(self, name):
+        # returns the job's stats, or None if the job is unknown or already running
+        with self._lock:
+            job = self._jobs.get(name)
+        if job is None or not job['running'].acquire(blocking=False):
+            return None
+
+        try:
+            started_at = datetime.datetime.now()
+            started = time.perf_counter()
+            rows = None
+            error = None
+            try:
+                rows = job['func']()
+            except Exception as e:
+                _logger.exception('job {} failed'.format(name))
+                error = str(e)
+            runtime = time.perf_counter() - started
+
+            with self._lock:
+                stats = job['stats']
+                stats['runs'] += 1
+                stats['last_started'] = started_at
+                stats['last_runtime'] = round(runtime, 6)
+                stats['last_error'] = error
+                if error is None:
+                    stats['last_rows'] = rows
+                    stats['total_rows'] += rows
+                else:
+                    stats['failures'] += 1
+                job['next_run'] = time.monotonic() + job['interval']
+                result = dict(stats)
+
+            if error is None:
+                _logger.info('job {} processed {} rows in {:.1f}ms'.format(name, rows, runtime * 1000))
+            return result
+        finally:
+            job['running'].release()
+
+    def get_stats(self):
+        with self._lock:
+            now = time.monotonic()
+            result = {}
+            for name, job in self._jobs.items():
+                stats = dict(job['stats'])
+                stats['next_run_in'] = round(max(job['next_run'] - now, 0), 1)
+                result[name] = stats
+            return result
@@ -0,0 +1,131 @@
+import logging
+from logging import handlers
+import queue
+import atexit
+from decimal import Decimal
+
+from broker import OttoBroker
+from memoryWrapper import MemoryWrapper
+import queryLog
+
+# shared by main.py (Flask) and asyncMain.py (aiohttp); importing this module must not start anything
+
+LOG_FORMAT = '%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s'
+
+# START CONSTANTS
+# api params
+SYMBOLS_KEY = 'symbols'
+SYMBOL_KEY = 'symbol'
+USERID_KEY = 'userid'
+APIKEY_KEY = 'apikey'
+DISPLAYNAME_KEY = 'displayname'
+AMOUNT_KEY = 'amount'
+REASON_KEY = 'reason'
+QUANTITY_KEY = 'quantity'
+ENTRIES_KEY = 'entries'
+VALUATE_KEY = 'valuate'
+SHALLOW_KEY = 'shallow'
+DETAIL_KEY = 'detail'
+SINCE_KEY = 'since'
+JOB_KEY = 'job'
+ACTION_KEY = 'action'
+ORDER_TYPE_KEY = 'type'
+PRICE_KEY = 'price'
+ID_KEY = 'id'
+
+# profiling
+PROFILE_HEADER = 'X-Broker-Profile'
+UNPROFILED_PATHS = {'/broker/profiles', '/broker/profile', '/broker/watch_alerts', '/broker/ready'}
+TIMEOUT_KEY = 'timeout'
+
+# conditional GET and compression
+IF_NONE_MATCH_HEADER = 'If-None-Match'
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+
+# bulk limits
+MAX_BULK_ENTRIES = 10000
+
+# long-poll limits
+MAX_POLL_TIMEOUT = 60
+DEFAULT_POLL_TIMEOUT = 25
+
+# error messages
+MISSING_PARAM_MSG = 'missing required parameter: {param}'
+INVALID_TYPE_MSG = 'param \'{param}\' could not be converted to type \'{type}\''
+
+# bool conversion consts
+STR_TRUE = 'True'
+STR_FALSE = 'False'
+
+
+# END CONSTANTS
+
+def configure_logging():
+    handler = handlers.TimedRotatingFileHandler("logs/log_broker.log", when="midnight", interval=1)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    slow_handler = handlers.TimedRotatingFileHandler("logs/log_slow.log", when="midnight", interval=1)
+    slow_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    slow_handler.addFilter(logging.Filter(queryLog.SLOW_LOGGER_NAME))
+
+    # request threads only put records on the queue; the listener thread does the file writes
+    log_queue = queue.Queue(-1)
+    log_listener = handlers.QueueListener(log_queue, handler, slow_handler, respect_handler_level=True)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+
+    queue_handler = handlers.QueueHandler(log_queue)
+    # the file handlers apply LOG_FORMAT, so the queued record only carries the bare message
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.basicConfig(handlers=[queue_handler], level=logging.INFO)
+
+def etag_matches(if_none_match, etag):
+    # If-None-Match uses the weak comparison, so W/ prefixes on either side don't matter
+    if etag is None or not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or tag.replace('W/', '', 1).strip('"') == etag:
+            return True
+    return False
+
+def build_broker(config):
+    queryLog.configure(
+        sample_rate=config.get('DEFAULT', 'query_log_sample_rate', fallback='0.1'),
+        slow_threshold_ms=config.get('DEFAULT', 'slow_log_threshold_ms', fallback='250'),
+    )
+
+    broker = OttoBroker(
+        config.get('DEFAULT', 'connection_string', fallback=None),
+        config.get('DEFAULT', 'test_connection_string', fallback=None),
+        int(config.get('DEFAULT', 'max_liabilities_ratio')),
+        watch_alert_percent=config.get('DEFAULT', 'watch_alert_percent', fallback='5'),
+        quote_api_url=config.get('DEFAULT', 'quote_api_url', fallback=OttoBroker.DEFAULT_QUOTE_API_URL),
+        max_quote_batch=int(config.get('DEFAULT', 'max_quote_batch', fallback='100')),
+        quote_fetch_workers=int(config.get('DEFAULT', 'quote_fetch_workers', fallback='4')),
+        quote_failure_threshold=int(config.get('DEFAULT', 'quote_failure_threshold', fallback='3')),
+        quote_breaker_reset=float(config.get('DEFAULT', 'quote_breaker_reset', fallback='30')),
+        replica_connection_string=config.get('DEFAULT', 'replica_connection_string', fallback=None),
+        replica_pin_seconds=float(config.get('DEFAULT', 'replica_pin_seconds', fallback='5')),
+        user_cache_size=int(config.get('DEFAULT', 'user_cache_size', fallback='1000')),
+        user_cache_notify=config.get('DEFAULT', 'user_cache_notify', fallback='False').lower() == 'true',
+        user_cache_ttl=float(config.get('DEFAULT', 'user_cache_ttl', fallback='5')),
+        db_pool_size=int(config.get('DEFAULT', 'db_pool_size', fallback='10')),
+        prepare_statements=config.get('DEFAULT', 'prepare_statements', fallback='True').lower() == 'true',
+        maintenance_api_key=config.get('DEFAULT', 'maintenance_api_key', fallback=None),
+        short_max_age_days=float(config.get('DEFAULT', 'short_max_age_days', fallback='30')),
+        borrow_fee_daily_rate=Decimal(config.get('DEFAULT', 'borrow_fee_daily_rate', fallback='0')),
+        expired_shorts_interval=float(config.get('DEFAULT', 'expired_shorts_interval', fallback='300')),
+        borrow_fee_interval=float(config.get('DEFAULT', 'borrow_fee_interval', fallback='86400')),
+        order_refresh_interval=float(config.get('DEFAULT', 'order_refresh_interval', fallback='15')),
+        watch_refresh_interval=float(config.get('DEFAULT', 'watch_refresh_interval', fallback='60')),
+        etag_max_age=float(config.get('DEFAULT', 'etag_max_age', fallback='5')),
+        storage_backend=config.get('DEFAULT', 'storage_backend', fallback=OttoBroker.STORAGE_POSTGRES).lower(),
+        memory_api_keys=MemoryWrapper.parse_api_keys(config.get('DEFAULT', 'memory_api_keys', fallback='')),
+        api_key_cache_ttl=float(config.get('DEFAULT', 'api_key_cache_ttl', fallback='60')),
+        profile_sample_rate=float(config.get('DEFAULT', 'profile_sample_rate', fallback='0')),
+    )
+    broker.start_user_cache_listeners()
+    broker.start_jobs()
+    broker.start_warm_up(float(config.get('DEFAULT', 'warm_up_budget', fallback='10')))
+    return broker
@@ -0,0 +1,90 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+
+class StubQuoteServer():
+    # answers the IEX batch quote endpoint with random-walk prices after an injected delay
+    def __init__(self, latency=0.0, port=0, host='127.0.0.1'):
+        self.latency = latency
+        self.request_count = 0
+        self._prices = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def quote(self, symbol):
+        with self._lock:
+            price = self._prices.get(symbol)
+            if price is None:
+                price = random.uniform(5, 500)
+            else:
+                price = max(0.01, price * random.uniform(0.995, 1.005))
+            self._prices[symbol] = price
+        return {
+            'quote': {
+                'symbol': symbol,
+                'companyName': '{} Inc.'.format(symbol),
+                'latestPrice': round(price, 2)
+            }
+        }
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urllib.parse.urlparse(self.path)
+                if not parsed.path.rstrip('/').endswith('/stock/market/batch'):
+                    self.send_error(404)
+                    return
+
+                with stub._lock:
+                    stub.request_count += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                params = urllib.parse.parse_qs(parsed.query)
+                symbols = [s for s in params.get('symbols', [''])[0].split(',') if s]
+                body = json.dumps({symbol: stub.quote(symbol) for symbol in symbols}).encode()
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stub-quotes', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to delay every upstream response')
+    args = parser.parse_args()
+
+    server = StubQuoteServer(latency=args.latency, port=args.port)
+    print('serving stub quotes at {}'.format(server.url))
+    server._server.serve_forever()
@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import quoteClient
+from broker import OttoBroker
+
+API_KEY = 'k' * 32
+# a scratch database loaded with createDB.sql and createFunctions.sql; its tables are emptied before every test
+TEST_DSN_ENV = 'OTTOBROKER_TEST_DSN'
+BACKENDS = [OttoBroker.STORAGE_MEMORY, OttoBroker.STORAGE_POSTGRES]
+RESET_SQL = '''
+TRUNCATE ottobroker.orders, ottobroker.watches, ottobroker.closedstocks, ottobroker.fakestocks,
+    ottobroker.faketransactions, ottobroker.users, ottobroker.apiusers RESTART IDENTITY;
+INSERT INTO ottobroker.apiusers (apikey, displayname) VALUES (%s, 'tests');
+'''
+
+
+class FakeQuotes():
+    # prices handed to the broker's quote client instead of calling out to the provider
+    def __init__(self):
+        self.prices = {}
+
+    def fetch(self, symbol_list):
+        return {symbol: quoteClient.Quote(self.prices[symbol], symbol, time.time(), False)
+                for symbol in symbol_list if symbol in self.prices}
+
+
+def reset_database(dsn):
+    import psycopg2
+    connection = psycopg2.connect(dsn)
+    try:
+        with connection, connection.cursor() as cursor:
+            cursor.execute(RESET_SQL, [API_KEY])
+    finally:
+        connection.close()
+
+
+def make_broker(backend, quotes):
+    dsn = os.environ.get(TEST_DSN_ENV)
+    if backend == OttoBroker.STORAGE_POSTGRES:
+        if not dsn:
+            pytest.skip('set {} to run against postgres'.format(TEST_DSN_ENV))
+        reset_database(dsn)
+    broker = OttoBroker(dsn, dsn, 2, storage_backend=backend, memory_api_keys={API_KEY: 'tests'},
+                        db_pool_size=4, order_refresh_interval=0, watch_refresh_interval=0)
+    broker._quotes._fetch = quotes.fetch
+    broker.is_market_live = lambda time=None: True
+    return broker
+
+
+@pytest.fixture
+def quotes():
+    return FakeQuotes()
+
+
+@pytest.fixture(params=BACKENDS)
+def broker(request, quotes):
+    return make_broker(request.param, quotes)
@@ -0,0 +1,17 @@
+import time
+
+from conftest import API_KEY
+
+
+def test_revoked_api_keys_stop_working_after_the_cache_ttl(broker):
+    broker._api_key_cache_ttl = 0.05
+    assert broker._is_valid_api_user(API_KEY)
+
+    lookups = []
+    broker._cur_db.broker_get_single_api_users = lambda api_key: lookups.append(api_key)
+    assert broker._is_valid_api_user(API_KEY)
+    assert lookups == []
+
+    time.sleep(0.06)
+    assert not broker._is_valid_api_user(API_KEY)
+    assert lookups == [API_KEY]
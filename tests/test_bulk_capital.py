@@ -0,0 +1,20 @@
+from decimal import Decimal
+
+from broker import OttoBroker
+from conftest import API_KEY
+
+
+def test_bulk_capital_rejects_bad_entries_without_failing_the_batch(broker):
+    broker.register_user('payee', 'Payee', API_KEY)
+    result = broker.bulk_capital([
+        {'userid': 'payee', 'amount': 'NaN', 'reason': 'payout'},
+        {'userid': 'payee', 'amount': 'Infinity', 'reason': 'payout'},
+        {'userid': 'x' * 257, 'amount': '1', 'reason': 'payout'},
+        {'userid': 'payee', 'amount': '1', 'reason': 'r' * 257},
+        {'userid': 'payee', 'amount': Decimal('12.50'), 'reason': 'payout'},
+    ], API_KEY)
+
+    assert result[OttoBroker.STATUS_KEY] == OttoBroker.STATUS_SUCCESS
+    assert result['applied'] == 1
+    assert [r[OttoBroker.STATUS_KEY] for r in result['results']] == [OttoBroker.STATUS_ERROR] * 4 + [OttoBroker.STATUS_SUCCESS]
+    assert broker._get_user('payee').balance == Decimal('12.50')
@@ -0,0 +1,36 @@
+from decimal import Decimal
+
+from conftest import API_KEY
+
+
+def test_user_info_etag_follows_the_served_snapshot(broker, quotes):
+    quotes.prices['AAA'] = Decimal('10.00')
+    broker.register_user('tagged', 'Tagged', API_KEY)
+    broker.deposit('tagged', Decimal('100'), 'tests', API_KEY)
+    etag = broker.get_user_info_etag('tagged', False)
+    assert etag is not None
+    assert broker.get_user_info_etag('tagged', False) == etag
+
+    # a write this worker doesn't hear about leaves both the body and the etag on the cached snapshot
+    broker._cur_db.broker_give_money_to_user('tagged', Decimal('5'), 'elsewhere', API_KEY)
+    assert broker.get_user_info_etag('tagged', False) == etag
+    assert broker.get_user_info('tagged', False)['user']['balance'] == Decimal('100.00')
+
+    # once the snapshot is replaced, both move together
+    broker._user_cache.invalidate(broker._backend_name(), 'tagged')
+    assert broker.get_user_info_etag('tagged', False) != etag
+    assert broker.get_user_info('tagged', False)['user']['balance'] == Decimal('105.00')
+
+
+def test_user_info_etag_changes_with_positions_and_watches(broker, quotes):
+    quotes.prices['AAA'] = Decimal('10.00')
+    broker.register_user('tagged', 'Tagged', API_KEY)
+    broker.deposit('tagged', Decimal('100'), 'tests', API_KEY)
+    etags = [broker.get_user_info_etag('tagged', False)]
+
+    broker.buy_long('AAA', 1, 'tagged', API_KEY)
+    etags.append(broker.get_user_info_etag('tagged', False))
+    broker.set_watch('tagged', 'AAA', API_KEY)
+    etags.append(broker.get_user_info_etag('tagged', False))
+
+    assert len(set(etags)) == 3
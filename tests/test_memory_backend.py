@@ -0,0 +1,53 @@
+import os
+from decimal import Decimal
+
+import pytest
+
+from broker import OttoBroker
+from conftest import API_KEY, TEST_DSN_ENV, make_broker
+
+
+def run_scenario(db):
+    # prices with more than two decimals, the way quotes come back from the provider
+    db.broker_create_user('parity', 'Parity', API_KEY)
+    db.broker_give_money_to_user('parity', Decimal('1000'), 'seed', API_KEY)
+    db.broker_buy_long('parity', 'AAA', Decimal('0.1234'), 100, API_KEY)
+    db.broker_sell_long('parity', 'AAA', Decimal('0.1251'), 40, API_KEY)
+    db.broker_sell_short('parity', 'BBB', Decimal('3.3333'), 7, API_KEY)
+    db.broker_buy_short('parity', 'BBB', Decimal('3.335'), 3, API_KEY)
+    db.broker_give_money_to_user('parity', Decimal('0.005'), 'rounding', API_KEY)
+    db.broker_give_money_bulk([('parity', Decimal('0.015'), 'bulk'), ('parity', Decimal('-0.004'), 'bulk')], API_KEY)
+
+    def lots(stocks):
+        return sorted([repr(stock.to_dict()) for stock in stocks])
+
+    return {
+        'balance': db.broker_get_single_user('parity').balance,
+        'longs': lots(db.broker_get_longs_by_user('parity')),
+        'historical_longs': lots(db.broker_get_historical_longs_by_user('parity')),
+        'shorts': lots(db.broker_get_shorts_by_user('parity')),
+        'historical_shorts': lots(db.broker_get_historical_shorts_by_user('parity')),
+    }
+
+
+def test_prices_are_rounded_before_they_are_multiplied(broker):
+    db = broker._cur_db
+    db.broker_create_user('rounding', 'Rounding', API_KEY)
+    db.broker_give_money_to_user('rounding', Decimal('1000'), 'seed', API_KEY)
+    db.broker_buy_long('rounding', 'AAA', Decimal('0.1234'), 100, API_KEY)
+
+    assert db.broker_get_single_user('rounding').balance == Decimal('988.00')
+    assert [stock.purchase_cost for stock in db.broker_get_longs_by_user('rounding')] == [Decimal('0.12')]
+
+
+def test_scenario_balance(broker):
+    # 1000 - 100 * 0.12 + 40 * 0.13 + 7 * 3.33 - 3 * 3.34 + 0.01 + 0.02 + 0.00
+    assert run_scenario(broker._cur_db)['balance'] == Decimal('1006.52')
+
+
+def test_memory_backend_matches_the_sql_functions(quotes):
+    if not os.environ.get(TEST_DSN_ENV):
+        pytest.skip('set {} to run against postgres'.format(TEST_DSN_ENV))
+    memory = run_scenario(make_broker(OttoBroker.STORAGE_MEMORY, quotes)._cur_db)
+    postgres = run_scenario(make_broker(OttoBroker.STORAGE_POSTGRES, quotes)._cur_db)
+    assert memory == postgres
@@ -0,0 +1,94 @@
+import collections
+import threading
+from decimal import Decimal
+
+import pytest
+
+from broker import OttoBroker
+from conftest import API_KEY, make_broker
+from orderBook import OrderBook
+from thresholdIndex import ThresholdIndex
+
+Order = collections.namedtuple('Order', ['id', 'ticker_symbol', 'trigger_price', 'action', 'order_type'])
+
+
+@pytest.mark.parametrize('action, order_type, direction', [
+    ('buy_long', OrderBook.LIMIT, ThresholdIndex.BELOW),
+    ('buy_short', OrderBook.LIMIT, ThresholdIndex.BELOW),
+    ('sell_long', OrderBook.LIMIT, ThresholdIndex.ABOVE),
+    ('sell_short', OrderBook.LIMIT, ThresholdIndex.ABOVE),
+    ('buy_long', OrderBook.STOP, ThresholdIndex.ABOVE),
+    ('buy_short', OrderBook.STOP, ThresholdIndex.ABOVE),
+    ('sell_long', OrderBook.STOP, ThresholdIndex.BELOW),
+    ('sell_short', OrderBook.STOP, ThresholdIndex.BELOW),
+])
+def test_direction(action, order_type, direction):
+    assert OrderBook.direction(action, order_type) == direction
+
+
+@pytest.mark.parametrize('direction, price, crossed', [
+    (ThresholdIndex.ABOVE, Decimal('9.99'), False),
+    (ThresholdIndex.ABOVE, Decimal('10.00'), True),
+    (ThresholdIndex.ABOVE, Decimal('10.01'), True),
+    (ThresholdIndex.BELOW, Decimal('10.01'), False),
+    (ThresholdIndex.BELOW, Decimal('10.00'), True),
+    (ThresholdIndex.BELOW, Decimal('9.99'), True),
+])
+def test_pop_crossed(direction, price, crossed):
+    index = ThresholdIndex()
+    index.add('order', 'AAA', Decimal('10.00'), direction)
+
+    assert index.pop_crossed('AAA', price) == (['order'] if crossed else [])
+    # crossed entries leave the index, the others keep resting
+    assert ('order' in index) != crossed
+    assert index.pop_crossed('BBB', price) == []
+
+
+@pytest.fixture
+def memory_broker(quotes):
+    return make_broker(OttoBroker.STORAGE_MEMORY, quotes)
+
+
+def place_and_fill(broker, user_id, price):
+    placed = broker.place_order(user_id, 'AAA', 'buy_long', OrderBook.LIMIT, Decimal('10.00'), 5, API_KEY)
+    order = broker._order_book.remove(placed['order']['id'])
+    broker._fill_order(order, price)
+    return broker.get_orders(user_id)['orders'][0]
+
+
+def test_fill_order_fills_at_the_triggering_price(memory_broker):
+    memory_broker.register_user('buyer', 'Buyer', API_KEY)
+    memory_broker.deposit('buyer', Decimal('100'), 'tests', API_KEY)
+
+    order = place_and_fill(memory_broker, 'buyer', Decimal('9.50'))
+    assert order['status'] == 'FILLED'
+    assert order['fill_price'] == Decimal('9.50')
+    assert memory_broker._get_user('buyer').balance == Decimal('52.50')
+
+
+def test_fill_order_rejects_trades_that_fail_their_checks(memory_broker):
+    memory_broker.register_user('broke', 'Broke', API_KEY)
+
+    order = place_and_fill(memory_broker, 'broke', Decimal('9.50'))
+    assert order['status'] == 'REJECTED'
+    assert order['fill_price'] is None
+
+
+def test_orders_queued_before_a_reload_are_dropped():
+    executed = []
+    done = threading.Event()
+
+    def execute(order, price):
+        executed.append(order.id)
+        done.set()
+
+    book = OrderBook(execute)
+    book.add(Order(1, 'AAA', Decimal('10.00'), 'buy_long', OrderBook.LIMIT))
+    # crossed but not executed yet, then the book is reloaded as a test mode toggle does
+    book.on_prices({'AAA': Decimal('9.00')})
+    book.load([Order(2, 'AAA', Decimal('10.00'), 'buy_long', OrderBook.LIMIT)])
+    book.on_prices({'AAA': Decimal('9.00')})
+
+    book.start()
+    assert done.wait(5)
+    assert executed == [2]
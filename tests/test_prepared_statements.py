@@ -0,0 +1,59 @@
+import os
+
+import psycopg2
+import pytest
+
+from conftest import TEST_DSN_ENV
+from postgresWrapper import PostgresWrapper
+
+SETUP_SQL = '''
+DROP TABLE IF EXISTS public.prepared_scratch;
+CREATE TABLE public.prepared_scratch (id integer);
+INSERT INTO public.prepared_scratch VALUES (1);
+CREATE OR REPLACE FUNCTION public.prepared_unsupported() RETURNS integer AS $$
+BEGIN
+    RAISE EXCEPTION 'not a plan change' USING ERRCODE = '0A000';
+END;
+$$ LANGUAGE plpgsql;
+'''
+TEARDOWN_SQL = '''
+DROP TABLE IF EXISTS public.prepared_scratch;
+DROP FUNCTION IF EXISTS public.prepared_unsupported();
+'''
+
+
+def run_sql(dsn, sql):
+    connection = psycopg2.connect(dsn)
+    try:
+        with connection, connection.cursor() as cursor:
+            cursor.execute(sql)
+    finally:
+        connection.close()
+
+
+@pytest.fixture
+def db():
+    dsn = os.environ.get(TEST_DSN_ENV)
+    if not dsn:
+        pytest.skip('set {} to run against postgres'.format(TEST_DSN_ENV))
+    run_sql(dsn, SETUP_SQL)
+    # one pooled connection, so every call reuses the statements it prepared
+    yield PostgresWrapper(dsn, force_quiet=True, pool_size=1), dsn
+    run_sql(dsn, TEARDOWN_SQL)
+
+
+def test_changed_result_type_falls_back_to_plain_query(db):
+    db, dsn = db
+    query = 'SELECT * FROM public.prepared_scratch;'
+    assert db._query_wrapper(query, statement='scratch') == [[1]]
+
+    run_sql(dsn, 'ALTER TABLE public.prepared_scratch ADD COLUMN name text;')
+    assert db._query_wrapper(query, statement='scratch') == [[1, None]]
+    assert db._statement_stats['invalid_fallbacks'] == 1
+
+
+def test_other_feature_not_supported_errors_are_raised(db):
+    db, dsn = db
+    with pytest.raises(psycopg2.NotSupportedError):
+        db._query_wrapper('SELECT public.prepared_unsupported();', statement='unsupported')
+    assert db._statement_stats['invalid_fallbacks'] == 0
@@ -0,0 +1,67 @@
+import collections
+import threading
+import time
+from decimal import Decimal
+
+import quoteClient
+from quoteClient import QuoteClient
+
+
+class RecordingFetch():
+    # stands in for QuoteClient._fetch and remembers every upstream batch
+    def __init__(self, hold_symbol=None):
+        self.batches = []
+        self.release = threading.Event()
+        self._hold_symbol = hold_symbol
+        self._lock = threading.Lock()
+
+    def __call__(self, symbol_list):
+        with self._lock:
+            self.batches.append(list(symbol_list))
+        if self._hold_symbol in symbol_list:
+            assert self.release.wait(5)
+        return {symbol: quoteClient.Quote(Decimal('1.00'), symbol, time.time(), False) for symbol in symbol_list}
+
+    def fetch_counts(self):
+        return collections.Counter([symbol for batch in self.batches for symbol in batch])
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_overlapping_callers_share_one_upstream_fetch_per_symbol():
+    client = QuoteClient('http://quotes.invalid')
+    fetch = RecordingFetch(hold_symbol='AAA')
+    client._fetch = fetch
+
+    results = {}
+    first = threading.Thread(target=lambda: results.update(first=client.get_quotes(['AAA', 'BBB'])))
+    first.start()
+    wait_for(lambda: 'AAA' in client._in_flight)
+
+    # BBB is already being fetched for the first caller, so only CCC goes upstream for this one
+    second = threading.Thread(target=lambda: results.update(second=client.get_quotes(['BBB', 'CCC'])))
+    second.start()
+    wait_for(lambda: client.get_stats().get('coalesced_calls') == 1)
+    fetch.release.set()
+    first.join()
+    second.join()
+
+    assert fetch.fetch_counts() == {'AAA': 1, 'BBB': 1, 'CCC': 1}
+    assert sorted(results['first']) == ['AAA', 'BBB']
+    assert sorted(results['second']) == ['BBB', 'CCC']
+
+
+def test_large_requests_are_split_into_bounded_chunks():
+    client = QuoteClient('http://quotes.invalid', max_batch_symbols=3)
+    fetch = RecordingFetch()
+    client._fetch = fetch
+    symbols = ['S{}'.format(i) for i in range(10)]
+
+    assert sorted(client.get_quotes(symbols)) == sorted(symbols)
+    assert sorted([len(batch) for batch in fetch.batches]) == [1, 3, 3, 3]
+    assert fetch.fetch_counts() == dict.fromkeys(symbols, 1)
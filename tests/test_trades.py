@@ -0,0 +1,78 @@
+import threading
+from decimal import Decimal
+
+from broker import OttoBroker
+from conftest import API_KEY
+
+
+def run_concurrently(*funcs):
+    barrier = threading.Barrier(len(funcs))
+    results = [None] * len(funcs)
+
+    def run(index, func):
+        barrier.wait()
+        results[index] = func()
+
+    threads = [threading.Thread(target=run, args=(i, func)) for i, func in enumerate(funcs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def statuses(results):
+    return sorted([result[OttoBroker.STATUS_KEY] for result in results])
+
+
+def test_concurrent_full_position_sells_fill_once(broker, quotes):
+    quotes.prices['AAA'] = Decimal('10.00')
+    broker.register_user('seller', 'Seller', API_KEY)
+    broker.deposit('seller', Decimal('1000'), 'tests', API_KEY)
+    assert broker.buy_long('AAA', 10, 'seller', API_KEY)[OttoBroker.STATUS_KEY] == OttoBroker.STATUS_SUCCESS
+    balance = broker._get_user('seller').balance
+
+    # both workers hold the same snapshot, so both pass the position check and only the database can refuse one
+    user = broker._get_user('seller')
+    results = run_concurrently(
+        lambda: broker.sell_long('AAA', 10, 'seller', API_KEY, user=user),
+        lambda: broker.sell_long('AAA', 10, 'seller', API_KEY, user=user))
+
+    assert statuses(results) == [OttoBroker.STATUS_ERROR, OttoBroker.STATUS_SUCCESS]
+    after = broker._get_user('seller')
+    assert after.balance == balance + Decimal('100.00')
+    assert 'AAA' not in after.longs
+
+
+def test_concurrent_full_position_buybacks_fill_once(broker, quotes):
+    quotes.prices['AAA'] = Decimal('10.00')
+    broker.register_user('shorter', 'Shorter', API_KEY)
+    broker.deposit('shorter', Decimal('1000'), 'tests', API_KEY)
+    assert broker.sell_short('AAA', 5, 'shorter', API_KEY)[OttoBroker.STATUS_KEY] == OttoBroker.STATUS_SUCCESS
+    balance = broker._get_user('shorter').balance
+
+    user = broker._get_user('shorter')
+    results = run_concurrently(
+        lambda: broker.buy_short('AAA', 5, 'shorter', API_KEY, user=user),
+        lambda: broker.buy_short('AAA', 5, 'shorter', API_KEY, user=user))
+
+    assert statuses(results) == [OttoBroker.STATUS_ERROR, OttoBroker.STATUS_SUCCESS]
+    assert broker._get_user('shorter').balance == balance - Decimal('50.00')
+
+
+def test_liability_check_needs_fresh_prices_for_every_position(broker, quotes):
+    quotes.prices['AAA'] = Decimal('10.00')
+    quotes.prices['BBB'] = Decimal('10.00')
+    broker.register_user('trader', 'Trader', API_KEY)
+    broker.deposit('trader', Decimal('1000'), 'tests', API_KEY)
+    assert broker.buy_long('AAA', 10, 'trader', API_KEY)[OttoBroker.STATUS_KEY] == OttoBroker.STATUS_SUCCESS
+
+    # AAA only has its last known price now; valuations still use it, trades may not
+    del quotes.prices['AAA']
+    assert broker.get_user_info('trader', False)['user']['assets'] == Decimal('1000.00')
+    for result in (broker.buy_long('BBB', 1, 'trader', API_KEY), broker.sell_short('BBB', 1, 'trader', API_KEY)):
+        assert result[OttoBroker.STATUS_KEY] == OttoBroker.STATUS_ERROR
+        assert result[OttoBroker.MESSAGE_KEY] == OttoBroker.PRICES_UNAVAILABLE_MSG
+
+    quotes.prices['AAA'] = Decimal('10.00')
+    assert broker.buy_long('BBB', 1, 'trader', API_KEY)[OttoBroker.STATUS_KEY] == OttoBroker.STATUS_SUCCESS
@@ -0,0 +1,41 @@
+import time
+
+from postgresWrapper import PostgresWrapper
+from userCache import UserSnapshotCache
+
+
+def test_snapshots_expire_after_ttl():
+    cache = UserSnapshotCache(max_entries=10, ttl=0.05)
+    cache.put('live', 'u1', False, 'snapshot', cache.generation('live', 'u1'))
+    assert cache.get('live', 'u1', False) == 'snapshot'
+    time.sleep(0.06)
+    assert cache.get('live', 'u1', False) is None
+    assert cache.get_stats()['expirations'] == 1
+
+
+def test_remote_invalidation_pins_reads_to_the_primary():
+    db = PostgresWrapper('primary', replica_connection_string='replica', read_your_writes_window=60)
+    assert db._route(True, 'u1') == 'replica'
+
+    db.pin_to_primary('u1')
+    assert db._route(True, 'u1') == 'primary'
+    assert db._route(True, 'u2') == 'replica'
+
+    db.pin_to_primary()
+    assert db._route(True, 'u2') == 'primary'
+
+
+def test_generations_stay_bounded_without_caching_raced_loads():
+    cache = UserSnapshotCache(max_entries=2)
+    # a load for u1 starts, then u1 is written to and its generation is pruned by writes to other users
+    generation = cache.generation('live', 'u1')
+    cache.invalidate('live', 'u1')
+    for user_id in ('u2', 'u3', 'u4'):
+        cache.invalidate('live', user_id)
+    assert cache.get_stats()['generations'] == 2
+
+    cache.put('live', 'u1', False, 'stale', generation)
+    assert cache.get('live', 'u1', False) is None
+
+    cache.put('live', 'u1', False, 'fresh', cache.generation('live', 'u1'))
+    assert cache.get('live', 'u1', False) == 'fresh'
@@ -0,0 +1,33 @@
+from decimal import Decimal
+
+from conftest import API_KEY
+
+
+def test_warm_up_loads_resting_orders_and_watches(broker, quotes):
+    quotes.prices['AAPL'] = Decimal('100.00')
+    broker.register_user('1', 'one', API_KEY)
+    broker.set_watch('1', 'AAPL', API_KEY)
+    order = broker.place_order('1', 'AAPL', 'buy_long', 'limit', Decimal('90.00'), 1, API_KEY)['order']
+    broker._order_book.load([])
+    broker._watch_alerts.load([])
+
+    assert broker.warm_up(5)
+    readiness = broker.get_readiness()
+    assert readiness['ready']
+    assert readiness['steps']['watch_alerts'][broker.STATUS_KEY] == broker.STATUS_SUCCESS
+    assert readiness['steps']['watch_alerts']['watches'] == 1
+    assert readiness['steps']['orders']['orders'] == 1
+    assert order['id'] in broker._order_book._orders
+    assert broker._watch_alerts.symbols() == ['AAPL']
+
+
+def test_failed_order_load_keeps_the_broker_unready(broker):
+    def fail():
+        raise Exception('orders table is gone')
+    broker._cur_db.broker_get_open_orders = fail
+
+    assert not broker.warm_up(5)
+    readiness = broker.get_readiness()
+    assert not readiness['ready']
+    assert readiness['steps']['orders'][broker.STATUS_KEY] == broker.STATUS_ERROR
+    assert 'quotes' not in readiness['steps']
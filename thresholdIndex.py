@@ -0,0 +1,106 @@
+import bisect
+import threading
+
+
+class _ThresholdBook():
+    def __init__(self):
+        # parallel lists kept sorted by threshold so crossed entries can be found with bisect
+        self.thresholds = []
+        self.keys = []
+
+    def insert(self, threshold, key):
+        index = bisect.bisect_right(self.thresholds, threshold)
+        self.thresholds.insert(index, threshold)
+        self.keys.insert(index, key)
+
+    def remove(self, threshold, key):
+        index = bisect.bisect_left(self.thresholds, threshold)
+        while index < len(self.thresholds) and self.thresholds[index] == threshold:
+            if self.keys[index] == key:
+                del self.thresholds[index]
+                del self.keys[index]
+                return True
+            index += 1
+        return False
+
+    def __len__(self):
+        return len(self.thresholds)
+
+
+# ABOVE entries fire once the price is at or above their threshold, BELOW entries once it is at or below.
+# fired entries are removed from the index
+class ThresholdIndex():
+
+    ABOVE = 'above'
+    BELOW = 'below'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._books = {}
+        self._entries = {}
+
+    def add(self, key, symbol, threshold, direction):
+        if direction not in (self.ABOVE, self.BELOW):
+            raise ValueError('Unknown threshold direction {}'.format(direction))
+
+        with self._lock:
+            self._remove(key)
+            books = self._books.setdefault(symbol, {self.ABOVE: _ThresholdBook(), self.BELOW: _ThresholdBook()})
+            books[direction].insert(threshold, key)
+            self._entries[key] = (symbol, threshold, direction)
+
+    def remove(self, key):
+        with self._lock:
+            return self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+
+        symbol, threshold, direction = entry
+        books = self._books[symbol]
+        books[direction].remove(threshold, key)
+        if not books[self.ABOVE] and not books[self.BELOW]:
+            del self._books[symbol]
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._books = {}
+            self._entries = {}
+
+    def pop_crossed(self, symbol, price):
+        with self._lock:
+            books = self._books.get(symbol)
+            if books is None:
+                return []
+
+            above = books[self.ABOVE]
+            index = bisect.bisect_right(above.thresholds, price)
+            crossed = above.keys[:index]
+            del above.thresholds[:index]
+            del above.keys[:index]
+
+            below = books[self.BELOW]
+            index = bisect.bisect_left(below.thresholds, price)
+            crossed.extend(below.keys[index:])
+            del below.thresholds[index:]
+            del below.keys[index:]
+
+            for key in crossed:
+                del self._entries[key]
+            if not above and not below:
+                del self._books[symbol]
+
+            return crossed
+
+    def symbols(self):
+        with self._lock:
+            return list(self._books.keys())
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
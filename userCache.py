@@ -0,0 +1,93 @@
+import collections
+import threading
+import time
+
+
+class UserSnapshotCache():
+    # LRU of hydrated BrokerUser objects keyed by (backend, user_id, shallow).
+    # every invalidation bumps a per-user generation so a load that raced with a write is never cached.
+    # ttl bounds how long a snapshot lives when writes from other workers can't invalidate it
+    def __init__(self, max_entries=1000, ttl=None):
+        self._max_entries = max_entries
+        self._ttl = ttl if ttl else None
+        self._entries = collections.OrderedDict()
+        # generations come from one increasing sequence and are kept for at most max_entries users, oldest
+        # invalidation first. a pruned user reads as _generation_floor, the sequence at the last prune, which is
+        # newer than any generation handed out before it, so a load that raced the pruned invalidation still misses
+        self._generations = collections.OrderedDict()
+        self._generation_sequence = 0
+        self._generation_floor = 0
+        self._epochs = collections.Counter()
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    @property
+    def enabled(self):
+        return self._max_entries > 0
+
+    def get(self, backend, user_id, shallow):
+        if not self.enabled:
+            return None
+        key = (backend, user_id, shallow)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._ttl is not None and time.monotonic() - entry[1] >= self._ttl:
+                del self._entries[key]
+                self._stats['expirations'] += 1
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            user = entry[0]
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return user
+
+    def generation(self, backend, user_id):
+        with self._lock:
+            return self._generation(backend, user_id)
+
+    def _generation(self, backend, user_id):
+        return (self._epochs[None], self._epochs[backend], self._generations.get((backend, user_id), self._generation_floor))
+
+    def put(self, backend, user_id, shallow, user, generation):
+        if not self.enabled:
+            return
+        key = (backend, user_id, shallow)
+        with self._lock:
+            if self._generation(backend, user_id) != generation:
+                return
+            self._entries[key] = (user, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def invalidate(self, backend, user_id):
+        with self._lock:
+            self._generation_sequence += 1
+            self._generations[(backend, user_id)] = self._generation_sequence
+            self._generations.move_to_end((backend, user_id))
+            while len(self._generations) > self._max_entries:
+                self._generations.popitem(last=False)
+                self._generation_floor = self._generation_sequence
+                self._stats['generation_prunes'] += 1
+            self._entries.pop((backend, user_id, False), None)
+            self._entries.pop((backend, user_id, True), None)
+            self._stats['invalidations'] += 1
+
+    def clear(self, backend=None):
+        with self._lock:
+            for key in [k for k in self._entries if backend is None or k[0] == backend]:
+                del self._entries[key]
+            self._epochs[backend] += 1
+            self._stats['clears'] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['generations'] = len(self._generations)
+            stats['max_entries'] = self._max_entries
+            stats['ttl'] = self._ttl
+        return stats
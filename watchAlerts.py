@@ -0,0 +1,112 @@
+import collections
+import datetime
+import logging
+import threading
+from decimal import Decimal, ROUND_HALF_UP
+
+from thresholdIndex import ThresholdIndex
+
+_logger = logging.getLogger()
+
+
+class WatchAlertEngine():
+    def __init__(self, alert_percent, max_alerts=1000):
+        self._alert_ratio = Decimal(alert_percent) / Decimal(100)
+        self._index = ThresholdIndex()
+
+        # (user_id, symbol) -> watch_cost for every armed watch
+        self._watches = {}
+        self._watch_lock = threading.Lock()
+
+        self._alerts = collections.deque(maxlen=max_alerts)
+        self._next_alert_id = 1
+        self._alert_condition = threading.Condition()
+        # called from the publishing thread after every batch of alerts, for waiters that can't block on the condition
+        self._listeners = []
+
+    def load(self, watch_list):
+        # watches that already alerted stay quiet across restarts
+        armed = [watch for watch in watch_list if watch.alerted is None]
+        with self._watch_lock:
+            self._index.clear()
+            self._watches = {}
+        for watch in armed:
+            self.set_watch(watch.user_id, watch.ticker_symbol, watch.watch_cost)
+        _logger.info('Loaded {} of {} watches into the alert engine'.format(len(armed), len(watch_list)))
+        return len(armed)
+
+    def set_watch(self, user_id, symbol, watch_cost):
+        watch_cost = Decimal(watch_cost)
+        with self._watch_lock:
+            self._watches[(user_id, symbol)] = watch_cost
+            self._index.add((user_id, symbol, ThresholdIndex.ABOVE), symbol,
+                            watch_cost * (1 + self._alert_ratio), ThresholdIndex.ABOVE)
+            self._index.add((user_id, symbol, ThresholdIndex.BELOW), symbol,
+                            watch_cost * (1 - self._alert_ratio), ThresholdIndex.BELOW)
+
+    def remove_watch(self, user_id, symbol):
+        with self._watch_lock:
+            self._watches.pop((user_id, symbol), None)
+            self._index.remove((user_id, symbol, ThresholdIndex.ABOVE))
+            self._index.remove((user_id, symbol, ThresholdIndex.BELOW))
+
+    def on_prices(self, prices):
+        # returns (user_id, symbol, direction, watch_cost, price) for every watch that alerted
+        triggered = []
+        with self._watch_lock:
+            for symbol, price in prices.items():
+                for user_id, _, direction in self._index.pop_crossed(symbol, price):
+                    watch_cost = self._watches.pop((user_id, symbol), None)
+                    if watch_cost is None:
+                        continue
+                    # a watch alerts once, then stays quiet until it is set again
+                    self._index.remove((user_id, symbol, ThresholdIndex.ABOVE))
+                    self._index.remove((user_id, symbol, ThresholdIndex.BELOW))
+                    triggered.append((user_id, symbol, direction, watch_cost, price))
+
+        if triggered:
+            self._publish(triggered)
+        return triggered
+
+    def _publish(self, triggered):
+        now = datetime.datetime.now()
+        with self._alert_condition:
+            for user_id, symbol, direction, watch_cost, price in triggered:
+                change = price - watch_cost
+                self._alerts.append({
+                    'id': self._next_alert_id,
+                    'user_id': user_id,
+                    'symbol': symbol,
+                    'direction': direction,
+                    'watch_cost': watch_cost,
+                    'price': price,
+                    'change': change,
+                    'percent_change': (change * 100 / watch_cost).quantize(Decimal('.01'), rounding=ROUND_HALF_UP) if watch_cost else None,
+                    'triggered': now
+                })
+                self._next_alert_id += 1
+            self._alert_condition.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+    def _alerts_after(self, since, user_id):
+        return [a for a in self._alerts if a['id'] > since and (user_id is None or a['user_id'] == user_id)]
+
+    def wait_for_alerts(self, since=0, user_id=None, timeout=None):
+        with self._alert_condition:
+            self._alert_condition.wait_for(lambda: self._alerts_after(since, user_id), timeout=timeout)
+            alerts = self._alerts_after(since, user_id)
+            cursor = self._next_alert_id - 1
+        return alerts, cursor
+
+    def add_listener(self, listener):
+        with self._alert_condition:
+            self._listeners.append(listener)
+
+    def symbols(self):
+        with self._watch_lock:
+            return list(set([symbol for _, symbol in self._watches]))
+
+    def watch_count(self):
+        return len(self._watches)
@@ -1,5 +1,8 @@
 import urllib.request
 import logging
+import time
+
+import queryLog
 
 _logger = logging.getLogger()
 
@@ -20,6 +23,16 @@ class RestWrapper():
 
         url += urllib.parse.urlencode(keyList)
         
-        _logger.info("http request to [" + url + "] with timeout " + str(timeout))
-        with urllib.request.urlopen(url) as response:
-            return response.read()
\ No newline at end of file
+        if queryLog.sampled():
+            _logger.info("http request to [" + url + "] with timeout " + str(timeout))
+        started = time.perf_counter()
+        error = None
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                result = response.read()
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            queryLog.record('http request', url, None, started, error=error)
+        return result
\ No newline at end of file